@@ -1,74 +1,195 @@
-from fastapi import FastAPI, Request, BackgroundTasks
+from fastapi import FastAPI, Request, BackgroundTasks, Header
 from pydantic import BaseModel
 import sqlite3
 import httpx
 import os
-from typing import List, Dict
+from typing import Dict, List, Optional
 import asyncio
+import base64, hashlib, hmac, json, secrets, time
+from datetime import datetime
+from coordinator_db import connect, connect_path, group_by_shard, init_db
+import coordinator_db
+from deadlines import DeadlineScheduler
+import shared_path  # noqa: F401  共用模块在仓库根目录的 shared/ 中
+from fast_json import FastJSONResponse
+import retention
+import tracing
 
 app = FastAPI()
+# 链路追踪：记录每个请求并提供 /traces 查看接口
+tracing.install(app, "coordinator")
 
-# SQLite 文件路径（协调器本地）
-DB_PATH = "./approval_results.db"
-
-# 初始化数据库
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # 建立approvals表
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS approvals (
-            client_id TEXT PRIMARY KEY,
-            total_count int,
-            receive_count int,
-            final_result TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS approval_results (
-            client_id TEXT,
-            server_url TEXT,
-            result TEXT,
-            PRIMARY KEY (client_id, server_url),
-            FOREIGN KEY(client_id) REFERENCES approval_tasks(client_id)
-        );
-    ''')
-    conn.commit()
-    conn.close()
+# 审批令牌签名密钥（与各数据/函数提供方共享），未配置时不签发令牌
+APPROVAL_TOKEN_SECRET = os.environ.get("APPROVAL_TOKEN_SECRET", "")
+# 审批令牌有效期（秒）
+APPROVAL_TOKEN_TTL = int(os.environ.get("APPROVAL_TOKEN_TTL", "3600"))
+# 审批任务默认超时时间（秒），超时后最终结果记为 "timeout"；默认 0 表示不超时，
+# 只有请求中指定了 timeout 的任务才会超时
+APPROVAL_TIMEOUT = float(os.environ.get("COORDINATOR_APPROVAL_TIMEOUT", "0"))
+# get_results 长轮询最多等待的秒数
+MAX_RESULT_WAIT = float(os.environ.get("COORDINATOR_MAX_RESULT_WAIT", "30"))
 
 init_db()
 
+_retention_task = None
+
+# ---------- 审批超时与结果等待 ----------
+# 等待结果的长轮询请求：client_id -> [Future, ...]，任务完成或超时时唤醒
+_result_waiters: Dict[str, List[asyncio.Future]] = {}
+
+def notify_finished(client_ids: List[str]):
+    """任务已有最终结果：不再需要超时处理，并唤醒等待结果的请求"""
+    for client_id in client_ids:
+        deadline_scheduler.discard(client_id)
+        for future in _result_waiters.pop(client_id, []):
+            if not future.done():
+                future.set_result(None)
+
+async def expire_approvals(client_ids: List[str]):
+    with tracing.span("db.expire_approvals", count=len(client_ids)):
+        expired = await asyncio.to_thread(coordinator_db.expire_approvals, client_ids)
+    if expired:
+        print(f"{expired} 个审批任务超时")
+    notify_finished(client_ids)
+
+deadline_scheduler = DeadlineScheduler(expire_approvals)
+
+def approval_deadline(timeout: Optional[float], now: float) -> Optional[float]:
+    timeout = APPROVAL_TIMEOUT if timeout is None else timeout
+    return now + timeout if timeout > 0 else None
+
+# 启动时拉起归档任务，并从数据库重建审批截止时间
+@app.on_event("startup")
+async def start_background_tasks():
+    global _retention_task
+    if coordinator_db.RETENTION_DAYS > 0 and (_retention_task is None or _retention_task.done()):
+        _retention_task = asyncio.get_running_loop().create_task(retention.run_periodically(
+            coordinator_db.archive_finished, coordinator_db.RETENTION_INTERVAL, "审批任务归档"
+        ))
+    if not deadline_scheduler.running():
+        deadline_scheduler.load(await asyncio.to_thread(coordinator_db.load_deadlines))
+        print(f"已载入 {len(deadline_scheduler)} 个未完成审批任务的截止时间")
+    deadline_scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    global _retention_task
+    if _retention_task is not None:
+        _retention_task.cancel()
+        _retention_task = None
+    deadline_scheduler.stop()
+
 # 请求模型
 class ApprovalRequest(BaseModel):
     client_id: str
     server_urls: List[str]
     content: str
+    # 审批通过后允许解密的根密钥名，不填则不限制
+    key_names: List[str] = []
+    # 审批超时时间（秒），不填使用 COORDINATOR_APPROVAL_TIMEOUT，0 表示不超时
+    timeout: Optional[float] = None
 
 class ApprovalResult(BaseModel):
     client_id: str
     server_url: str
     result: str  # "yes" or "no"
+    # 审批决定所在链路（由审批服务器的发件箱转发），协调器的处理接在该链路上
+    traceparent: Optional[str] = None
+
+# 批量审批结果
+class ApprovalResults(BaseModel):
+    results: List[ApprovalResult]
+
+# 批量发起审批
+class ApprovalRequests(BaseModel):
+    requests: List[ApprovalRequest]
+
+# IN 查询每批最多携带的参数个数（SQLite 对单条语句的参数个数有限制）
+SQL_BATCH_SIZE = 500
+# 批量通知审批服务器的超时时间（秒），一次请求可能携带数千条审批
+NOTIFY_TIMEOUT = float(os.environ.get("COORDINATOR_NOTIFY_TIMEOUT", "60"))
+
+# ---------- 审批令牌 ----------
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def issue_approval_token(client_id: str, key_names: str):
+    """
+    签发审批令牌：base64url(载荷).base64url(HMAC-SHA256)
+    载荷包含 client_id、允许解密的根密钥名、过期时间和令牌编号，提供方可据此在本地完成校验
+    """
+    if not APPROVAL_TOKEN_SECRET:
+        return None
+    payload = {
+        "cid": client_id,
+        "keys": json.loads(key_names) if key_names else ["*"],
+        "exp": int(time.time()) + APPROVAL_TOKEN_TTL,
+        "jti": secrets.token_hex(8),
+    }
+    body = _b64url(json.dumps(payload, separators=(",", ":")).encode())
+    sig = hmac.new(APPROVAL_TOKEN_SECRET.encode(), body.encode(), hashlib.sha256).digest()
+    return f"{body}.{_b64url(sig)}"
+
+# 查询凭据：发起审批时返回给发起方，协调器只保存其 SHA-256。
+# client_id 通常可以猜到，get_results 只对带有该凭据（X-Result-Secret 请求头）的请求返回审批令牌
+def hash_result_secret(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+def new_result_secret():
+    """返回 (凭据, 凭据的哈希)"""
+    secret = secrets.token_urlsafe(32)
+    return secret, hash_result_secret(secret)
 
-# 保存审批结果
-def save_approval_result(client_id: str, server_url: str, result: str):
-    conn = sqlite3.connect(DB_PATH)
+def result_secret_matches(secret: Optional[str], secret_hash: Optional[str]) -> bool:
+    if not secret or not secret_hash:
+        return False
+    return hmac.compare_digest(hash_result_secret(secret), secret_hash)
+
+# ---------- 审批结果写入 ----------
+# 审批服务器的发件箱至少投递一次，同一条结果可能重复到达，写入必须幂等：
+# 只更新对应审批服务器的那一行，且只有尚未答复（或已被记为超时）时才写入；
+# receive_count 按已答复的行数重新计算，重复投递不会让任务提前收齐
+SAVE_RESULT_SQL = '''
+    UPDATE approval_results
+    SET result = ?
+    WHERE client_id = ? AND server_url = ? AND (result IS NULL OR result = 'timeout')
+'''
+COUNT_RESULTS_SQL = '''
+    UPDATE approvals
+    SET receive_count = (
+        SELECT COUNT(*) FROM approval_results r
+        WHERE r.client_id = approvals.client_id AND r.result IS NOT NULL AND r.result != 'timeout'
+    )
+    WHERE client_id = ?
+'''
+
+def _save_result(c: sqlite3.Cursor, client_id: str, server_url: str, result: str) -> bool:
+    """写入一条审批结果，返回是否为该审批服务器的第一次答复"""
+    # 发起审批时保存的地址统一以 / 结尾
+    server_url = server_url.rstrip("/") + "/"
+    c.execute(SAVE_RESULT_SQL, (result, client_id, server_url))
+    if c.rowcount > 0:
+        return True
+    c.execute("SELECT 1 FROM approval_results WHERE client_id = ? AND server_url = ?", (client_id, server_url))
+    if c.fetchone() is None:
+        # 审批服务器上报的地址须与发起审批时 server_urls 中的地址一致
+        print(f"忽略审批结果：任务 {client_id} 的审批服务器中没有 {server_url}")
+    return False
+
+# 保存审批结果，返回是否为该审批服务器的第一次答复
+def save_approval_result(client_id: str, server_url: str, result: str) -> bool:
+    conn = connect(client_id)
     c = conn.cursor()
-    c.execute('''
-        UPDATE approval_results
-        SET result = ?
-        WHERE client_id = ?
-    ''', (result, client_id))
-    c.execute('''
-        UPDATE approvals
-        SET receive_count = receive_count + 1
-        WHERE client_id = ?
-    ''', (client_id,))
+    saved = _save_result(c, client_id, server_url, result)
+    if saved:
+        c.execute(COUNT_RESULTS_SQL, (client_id,))
     conn.commit()
     conn.close()
+    return saved
 
 # 获取所有结果
 def get_results_by_client(client_id: str) -> List[Dict]:
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect(client_id)
     c = conn.cursor()
     c.execute('''
         SELECT server_url, result FROM approval_results WHERE client_id = ?
@@ -79,7 +200,7 @@ def get_results_by_client(client_id: str) -> List[Dict]:
 
 # 判断是否收齐所有审批
 def is_all_approved(client_id: str) -> bool:
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect(client_id)
     c = conn.cursor()
     c.execute('''
         SELECT total_count, receive_count FROM approvals WHERE client_id = ?
@@ -97,27 +218,128 @@ def write_summary(client_id: str):
         if item['result'] == "no":
             final_result = "no"
             break
-    # 将结果写入数据库
-    conn = sqlite3.connect(DB_PATH)
+    # 将结果写入数据库，审批通过时一并签发审批令牌
+    conn = connect(client_id)
     c = conn.cursor()
+    token = None
+    if final_result == "yes":
+        c.execute("SELECT key_names FROM approvals WHERE client_id = ?", (client_id,))
+        token = issue_approval_token(client_id, c.fetchone()[0])
+    # 已超时的任务不再改写最终结果（迟到的审批结果只记录在 approval_results 中）
     c.execute('''
         UPDATE approvals
-        SET final_result = ?
-        WHERE client_id = ?
-    ''', (final_result, client_id))
+        SET final_result = ?, token = ?, finished_at = ?
+        WHERE client_id = ? AND final_result IS NULL
+    ''', (final_result, token, datetime.now().isoformat(), client_id))
     conn.commit()
     conn.close()
 
+# 批量保存审批结果，并对已收齐的任务汇总最终结果（每个分片在一个事务内完成）
+def save_approval_results(results: List[ApprovalResult]) -> List[str]:
+    by_client = {}
+    for r in results:
+        by_client.setdefault(r.client_id, []).append(r)
+    finished = []
+    for path, client_ids in group_by_shard(by_client).items():
+        shard_results = [r for cid in client_ids for r in by_client[cid]]
+        finished.extend(_save_shard_results(path, client_ids, shard_results))
+    return finished
+
+def _save_shard_results(path: str, client_ids: List[str], results: List[ApprovalResult]) -> List[str]:
+    conn = connect_path(path)
+    c = conn.cursor()
+    saved = {r.client_id for r in results if _save_result(c, r.client_id, r.server_url, r.result)}
+    client_ids = [client_id for client_id in client_ids if client_id in saved]
+    c.executemany(COUNT_RESULTS_SQL, [(client_id,) for client_id in client_ids])
+
+    # 找出本批次中已收齐全部结果的任务
+    finished = []
+    for i in range(0, len(client_ids), SQL_BATCH_SIZE):
+        part = client_ids[i:i + SQL_BATCH_SIZE]
+        marks = ",".join("?" * len(part))
+        c.execute(f'''
+            SELECT client_id, key_names FROM approvals
+            WHERE client_id IN ({marks}) AND total_count = receive_count AND final_result IS NULL
+        ''', part)
+        finished.extend(c.fetchall())
+
+    # 有一方不通过则整个任务不通过，通过时签发审批令牌
+    for client_id, key_names in finished:
+        c.execute('''
+            SELECT 1 FROM approval_results WHERE client_id = ? AND result = 'no' LIMIT 1
+        ''', (client_id,))
+        final_result = "no" if c.fetchone() else "yes"
+        token = issue_approval_token(client_id, key_names) if final_result == "yes" else None
+        c.execute('''
+            UPDATE approvals
+            SET final_result = ?, token = ?, finished_at = ?
+            WHERE client_id = ?
+        ''', (final_result, token, datetime.now().isoformat(), client_id))
+    conn.commit()
+    conn.close()
+    return [client_id for client_id, _ in finished]
+
+def normalize_server_urls(urls: List[str]) -> List[str]:
+    """去掉结尾的 / 并去重（保持顺序）；写入 approval_results 时统一补上 /，与 _save_result 的写法一致"""
+    return list(dict.fromkeys(url.rstrip("/") for url in urls))
+
+# 批量写入审批任务（每个分片在一个事务内完成），已存在的 client_id 跳过并返回
+def insert_approval_requests(reqs: List[ApprovalRequest], deadlines: Dict[str, Optional[float]],
+                             secret_hashes: Dict[str, str]) -> List[str]:
+    by_client = {r.client_id: r for r in reqs}
+    created_at = datetime.now().isoformat()
+    duplicates = []
+    for path, client_ids in group_by_shard(by_client).items():
+        conn = connect_path(path)
+        c = conn.cursor()
+        existing = set()
+        for i in range(0, len(client_ids), SQL_BATCH_SIZE):
+            part = client_ids[i:i + SQL_BATCH_SIZE]
+            marks = ",".join("?" * len(part))
+            c.execute(f"SELECT client_id FROM approvals WHERE client_id IN ({marks})", part)
+            existing.update(row[0] for row in c.fetchall())
+        new = [by_client[cid] for cid in client_ids if cid not in existing]
+        c.executemany('''
+            INSERT INTO approvals
+            (client_id, total_count, receive_count, key_names, created_at, deadline, secret_hash)
+            VALUES (?, ?, 0, ?, ?, ?, ?)
+        ''', [(r.client_id, len(r.server_urls), json.dumps(r.key_names) if r.key_names else None, created_at,
+               deadlines[r.client_id], secret_hashes[r.client_id]) for r in new])
+        c.executemany('''
+            INSERT INTO approval_results (client_id, server_url)
+            VALUES (?, ?)
+        ''', [(r.client_id, url + "/") for r in new for url in r.server_urls])
+        conn.commit()
+        conn.close()
+        duplicates.extend(cid for cid in client_ids if cid in existing)
+    return duplicates
 
 # 向一个审批服务器发送请求
 async def send_approval(server_url: str, client_id: str, content: str, base_apiurl: str):
     try:
-        async with httpx.AsyncClient() as client:
-            await client.post(server_url, json={
-                "client_id": client_id,
-                "content": content,
-                "base_apiurl": base_apiurl
-            })
+        with tracing.span("coordinator.send_approval", server_url=server_url):
+            async with httpx.AsyncClient() as client:
+                await client.post(server_url, json={
+                    "client_id": client_id,
+                    "content": content,
+                    "base_apiurl": base_apiurl
+                }, headers=tracing.inject())
+    except Exception as e:
+        print(f"Error contacting {server_url}: {e}")
+
+# 向一个审批服务器批量发送审批请求；审批服务器不支持批量接口（旧版本）时逐条发送
+async def send_approvals(server_url: str, approvals: List[dict]):
+    try:
+        with tracing.span("coordinator.send_approvals", server_url=server_url, count=len(approvals)):
+            async with httpx.AsyncClient(timeout=NOTIFY_TIMEOUT) as client:
+                resp = await client.post(f"{server_url}/approval/approvals", json={"approvals": approvals},
+                                         headers=tracing.inject())
+            if resp.status_code in (404, 405):
+                for item in approvals:
+                    await send_approval(f"{server_url}/approval/approval", item["client_id"], item["content"],
+                                        item["base_apiurl"])
+            elif resp.status_code != 200:
+                print(f"Error contacting {server_url}: {resp.status_code} {resp.text}")
     except Exception as e:
         print(f"Error contacting {server_url}: {e}")
 
@@ -143,28 +365,91 @@ async def start_approval(
     request: Request,
 ):
     # 往主表插入任务信息
+    req.server_urls = normalize_server_urls(req.server_urls)
     url_count = len(req.server_urls)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO approvals (client_id, total_count, receive_count)
-        VALUES (?, ?, 0)
-    ''', (req.client_id, url_count))
+    deadline = approval_deadline(req.timeout, time.time())
+    result_secret, secret_hash = new_result_secret()
+    with tracing.span("db.start_approval", client_id=req.client_id):
+        conn = connect(req.client_id)
+        c = conn.cursor()
+        c.execute('''
+            INSERT INTO approvals
+            (client_id, total_count, receive_count, key_names, created_at, deadline, secret_hash)
+            VALUES (?, ?, 0, ?, ?, ?, ?)
+        ''', (req.client_id, url_count, json.dumps(req.key_names) if req.key_names else None,
+              datetime.now().isoformat(), deadline, secret_hash))
+
+        # 获取当前服务器的fastapi的服务地址
+        base_apiurl = str(request.base_url)
+        # 并发通知所有审批服务器
+        for url in req.server_urls:
+            # 往子表插入审批服务器信息
+            c.execute('''
+                INSERT INTO approval_results (client_id, server_url)
+                VALUES (?, ?)
+            ''', (req.client_id, url + "/"))
+            full_url = url + "/approval/approval"
+            background_tasks.add_task(send_approval, full_url, req.client_id, req.content, base_apiurl)
+        conn.commit()
+        conn.close()
+    if deadline is not None:
+        deadline_scheduler.add(req.client_id, deadline)
+    # 查询凭据只在这里返回一次，发起方查询结果时在 X-Result-Secret 请求头中携带
+    return {"status": "sent", "message": f"已向 {url_count} 个服务器发出审批请求", "result_secret": result_secret}
 
-    # 获取当前服务器的fastapi的服务地址
+'''示例
+curl -X POST http://127.0.0.1:8000/start_approvals \
+  -H "Content-Type: application/json" \
+  -d '{
+    "requests": [
+      {"client_id": "client_001", "server_urls": ["http://127.0.0.1:9001", "http://127.0.0.1:9002"], "content": "申请访问内部系统"},
+      {"client_id": "client_002", "server_urls": ["http://127.0.0.1:9001", "http://127.0.0.1:9002"], "content": "申请访问内部系统"}
+    ]
+  }'
+'''
+# 批量发起审批：全部任务在各分片的一个事务内写入，每个审批服务器只收到一次批量通知
+@app.post("/start_approvals")
+async def start_approvals(
+    data: ApprovalRequests,
+    background_tasks: BackgroundTasks,
+    request: Request,
+):
+    # 同一 client_id 重复出现时以最后一次为准
+    reqs = list({r.client_id: r for r in data.requests}.values())
+    for r in reqs:
+        r.server_urls = normalize_server_urls(r.server_urls)
+    now = time.time()
+    deadlines = {r.client_id: approval_deadline(r.timeout, now) for r in reqs}
+    secrets_by_client = {r.client_id: new_result_secret() for r in reqs}
+    with tracing.span("db.start_approvals", count=len(reqs)):
+        duplicates = set(insert_approval_requests(
+            reqs, deadlines, {cid: pair[1] for cid, pair in secrets_by_client.items()}
+        )) if reqs else set()
+    for client_id, deadline in deadlines.items():
+        if deadline is not None and client_id not in duplicates:
+            deadline_scheduler.add(client_id, deadline)
+
+    # 按审批服务器分组，每个服务器一次请求
     base_apiurl = str(request.base_url)
-    # 并发通知所有审批服务器
-    for url in req.server_urls:
-        # 往子表插入审批服务器信息
-        c.execute('''
-            INSERT INTO approval_results (client_id, server_url)
-            VALUES (?, ?)
-        ''', (req.client_id, url + "/"))
-        full_url = url + "/approval/approval"
-        background_tasks.add_task(send_approval, full_url, req.client_id, req.content, base_apiurl)
-    conn.commit()
-    conn.close()
-    return {"status": "sent", "message": f"已向 {url_count} 个服务器发出审批请求"}
+    by_server = {}
+    for r in reqs:
+        if r.client_id in duplicates:
+            continue
+        for url in r.server_urls:
+            by_server.setdefault(url, []).append(
+                {"client_id": r.client_id, "content": r.content, "base_apiurl": base_apiurl}
+            )
+    for url, approvals in by_server.items():
+        background_tasks.add_task(send_approvals, url, approvals)
+    started = len(reqs) - len(duplicates)
+    return FastJSONResponse({
+        "status": "sent",
+        "started": started,
+        "duplicates": sorted(duplicates),
+        # 各任务的查询凭据，已存在的 client_id 不返回
+        "result_secrets": {cid: pair[0] for cid, pair in secrets_by_client.items() if cid not in duplicates},
+        "message": f"已发起 {started} 个审批任务，向 {len(by_server)} 个服务器发出批量审批请求",
+    })
 
 '''示例
 curl -X POST http://192.168.216.128:5000/receive_result \
@@ -181,25 +466,113 @@ curl -X POST http://192.168.216.128:5000/receive_result \
 async def receive_result(
     result: ApprovalResult,
 ):
-    save_approval_result(result.client_id, result.server_url, result.result)
+    with tracing.span("db.save_result", result.traceparent, client_id=result.client_id):
+        # 重复投递的结果不再处理
+        if not save_approval_result(result.client_id, result.server_url, result.result):
+            return {"status": "ok", "duplicate": True}
 
-    # 判断是否收齐全部结果（并将最终结果写入数据库）
-    if is_all_approved(result.client_id):
-        write_summary(result.client_id)
+        # 判断是否收齐全部结果（并将最终结果写入数据库）
+        if is_all_approved(result.client_id):
+            write_summary(result.client_id)
+            notify_finished([result.client_id])
 
     return {"status": "ok"}
 
-# 客户端主动查询结果（可选）
 '''示例
-curl -X GET http://127.0.0.1:8000/get_results/client_001
+curl -X POST http://127.0.0.1:5000/receive_results \
+  -H "Content-Type: application/json" \
+  -d '{
+    "results": [
+      {"client_id": "client_001", "server_url": "http://127.0.0.1:9001/", "result": "yes"},
+      {"client_id": "client_002", "server_url": "http://127.0.0.1:9001/", "result": "no"}
+    ]
+  }'
 '''
-@app.get("/get_results/{client_id}")
-def get_results(client_id: str):
-    conn = sqlite3.connect(DB_PATH)
+# 批量接收审批服务器返回的结果
+@app.post("/receive_results")
+async def receive_results(
+    data: ApprovalResults,
+):
+    # 每条结果在其审批决定所在的链路上记录一个 span，耗时为整批写入的耗时
+    result_spans = [
+        tracing.start_span("coordinator.receive_result", r.traceparent, client_id=r.client_id,
+                           server_url=r.server_url, batch_size=len(data.results))
+        for r in data.results if r.traceparent
+    ]
+    try:
+        with tracing.span("db.save_results", count=len(data.results)):
+            finished = save_approval_results(data.results) if data.results else []
+    finally:
+        for s in result_spans:
+            s.end()
+    notify_finished(finished)
+    return FastJSONResponse({"status": "ok", "received": len(data.results), "finished": finished})
+
+def read_final_result(client_id: str):
+    conn = connect(client_id)
     c = conn.cursor()
     c.execute('''
-        SELECT final_result FROM approvals WHERE client_id = ?
+        SELECT final_result, token, secret_hash FROM approvals WHERE client_id = ?
     ''', (client_id,))
-    result = c.fetchone()
+    row = c.fetchone()
     conn.close()
-    return {"client_id": client_id, "results": result}
+    return row
+
+# 客户端主动查询结果（可选）；wait 大于 0 时在任务完成或超时前最多等待 wait 秒（长轮询），
+# 最终结果为 "timeout" 表示在截止时间前没有收齐审批结果
+'''示例
+curl -X GET http://127.0.0.1:8000/get_results/client_001 \
+  -H "X-Result-Secret: <start_approval 返回的 result_secret>"
+curl -X GET "http://127.0.0.1:8000/get_results/client_001?wait=30"
+'''
+@app.get("/get_results/{client_id}")
+async def get_results(client_id: str, wait: float = 0, x_result_secret: Optional[str] = Header(None)):
+    row = read_final_result(client_id)
+    if row is not None and row[0] is None and wait > 0:
+        future = asyncio.get_running_loop().create_future()
+        waiters = _result_waiters.setdefault(client_id, [])
+        waiters.append(future)
+        try:
+            await asyncio.wait_for(future, min(wait, MAX_RESULT_WAIT))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if future in waiters:
+                waiters.remove(future)
+                if not waiters and _result_waiters.get(client_id) is waiters:
+                    del _result_waiters[client_id]
+        row = read_final_result(client_id)
+    # 审批通过时向出示查询凭据的发起方返回审批令牌，发起方在向 tee 申请解密时携带
+    result = (row[0],) if row else None
+    token = row[1] if row and result_secret_matches(x_result_secret, row[2]) else None
+    return {"client_id": client_id, "results": result, "token": token}
+
+# 查看审批超时调度状态
+'''示例
+curl -X GET http://127.0.0.1:8000/deadlines
+'''
+@app.get("/deadlines")
+async def get_deadlines():
+    return {**deadline_scheduler.describe(), "result_waiters": sum(len(w) for w in _result_waiters.values())}
+
+# 查询已归档的审批任务及各方结果，日期为任务完成日期（YYYY-MM-DD）
+'''示例
+curl -X GET "http://127.0.0.1:8000/get_archived?client_id=client_001&date_from=2025-01-01"
+'''
+@app.get("/get_archived")
+async def get_archived(
+    client_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = 1000,
+):
+    filters = {"client_id": client_id} if client_id else {}
+    approvals = await asyncio.to_thread(
+        retention.query_archive, coordinator_db.ARCHIVE_DIR, "approvals", filters, date_from, date_to, limit
+    )
+    results = []
+    if client_id:
+        results = await asyncio.to_thread(
+            retention.query_archive, coordinator_db.ARCHIVE_DIR, "approval_results", filters, date_from, date_to
+        )
+    return FastJSONResponse({"count": len(approvals), "data": approvals, "results": results})
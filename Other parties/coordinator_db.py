@@ -0,0 +1,283 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+import shared_path  # noqa: F401  共用模块在仓库根目录的 shared/ 中
+import retention
+
+# SQLite 文件路径（协调器本地）
+DB_PATH = "./approval_results.db"
+
+# 分片个数：按 client_id 的哈希把审批任务分散到多个 SQLite 文件中，
+# 每个分片有独立的写锁，写入吞吐随分片数增长。为 1 时只使用 DB_PATH，与旧版本一致
+SHARD_COUNT = int(os.environ.get("COORDINATOR_SHARDS", "1"))
+# 等待其他连接释放写锁的超时时间（秒）
+BUSY_TIMEOUT = 30.0
+
+# 已完成的审批任务在热表中保留的天数，超过后移入归档文件；不设置或为 0 时不归档
+# （归档后 get_results 查不到该任务，只能通过 get_archived 查询）
+RETENTION_DAYS = int(os.environ.get("COORDINATOR_RETENTION_DAYS", "0"))
+# 归档任务的执行间隔（秒）
+RETENTION_INTERVAL = float(os.environ.get("COORDINATOR_RETENTION_INTERVAL", "3600"))
+# 归档文件目录
+ARCHIVE_DIR = os.environ.get("COORDINATOR_ARCHIVE_DIR", "./approval_archive")
+
+def shard_paths(shard_count: int = None) -> List[str]:
+    """返回各分片的数据库文件路径，文件名中带有分片总数，避免不同分片配置误读同一批文件"""
+    shard_count = shard_count or SHARD_COUNT
+    if shard_count == 1:
+        return [DB_PATH]
+    root, ext = os.path.splitext(DB_PATH)
+    return [f"{root}.{i}-of-{shard_count}{ext}" for i in range(shard_count)]
+
+def shard_index(client_id: str, shard_count: int = None) -> int:
+    """使用稳定哈希（不受 PYTHONHASHSEED 影响）计算 client_id 所在分片"""
+    shard_count = shard_count or SHARD_COUNT
+    digest = hashlib.blake2b(client_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+def shard_path(client_id: str) -> str:
+    return shard_paths()[shard_index(client_id)]
+
+def connect_path(path: str) -> sqlite3.Connection:
+    return sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+
+def connect(client_id: str) -> sqlite3.Connection:
+    """打开 client_id 所在分片的连接"""
+    return connect_path(shard_path(client_id))
+
+def group_by_shard(client_ids: Iterable[str]) -> Dict[str, List[str]]:
+    """把一批 client_id 按所在分片分组，返回 {分片路径: [client_id, ...]}"""
+    paths = shard_paths()
+    groups = {}
+    for client_id in client_ids:
+        groups.setdefault(paths[shard_index(client_id)], []).append(client_id)
+    return groups
+
+# 初始化单个分片
+def init_shard(path: str):
+    conn = connect_path(path)
+    # 新数据库开启增量 VACUUM，归档删除记录后可以逐步归还空闲页（已有数据库见 enable-incremental-vacuum 命令）
+    retention.init_incremental_vacuum(conn)
+    c = conn.cursor()
+    # WAL 模式下读不阻塞写
+    c.execute("PRAGMA journal_mode=WAL")
+    # 建立approvals表
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS approvals (
+            client_id TEXT PRIMARY KEY,
+            total_count int,
+            receive_count int,
+            final_result TEXT,
+            key_names TEXT,
+            token TEXT,
+            created_at TEXT,
+            finished_at TEXT,
+            deadline REAL,
+            secret_hash TEXT
+        )
+    ''')
+    # 兼容旧版本数据库：补齐新增的列
+    c.execute("PRAGMA table_info(approvals)")
+    columns = {row[1] for row in c.fetchall()}
+    for column in ("key_names", "token", "created_at", "finished_at", "secret_hash"):
+        if column not in columns:
+            c.execute(f"ALTER TABLE approvals ADD COLUMN {column} TEXT")
+    # 审批截止时间（epoch 秒），旧数据为 NULL 表示不会超时
+    if "deadline" not in columns:
+        c.execute("ALTER TABLE approvals ADD COLUMN deadline REAL")
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS approval_results (
+            client_id TEXT,
+            server_url TEXT,
+            result TEXT,
+            PRIMARY KEY (client_id, server_url),
+            FOREIGN KEY(client_id) REFERENCES approval_tasks(client_id)
+        );
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_approvals_finished ON approvals (finished_at)")
+    # 只索引未完成的任务，启动时重建截止时间堆只需读取这部分
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_approvals_pending_deadline ON approvals (deadline)
+        WHERE final_result IS NULL AND deadline IS NOT NULL
+    ''')
+    conn.commit()
+    conn.close()
+
+# 初始化数据库
+def init_db(shard_count: int = None):
+    for path in shard_paths(shard_count):
+        init_shard(path)
+
+# ---------- 分片迁移 ----------
+def reshard(old_count: int, new_count: int, keep: bool = False):
+    """
+    将数据从 old_count 个分片迁移到 new_count 个分片
+    迁移按旧分片逐个进行，每个旧分片的数据在目标分片中各自以一个事务写入；
+    迁移期间应停止协调器服务
+    """
+    if old_count == new_count:
+        print("分片数未改变，无需迁移")
+        return
+    old_paths = shard_paths(old_count)
+    new_paths = shard_paths(new_count)
+    init_db(new_count)
+
+    moved = 0
+    for old_path in old_paths:
+        if not os.path.exists(old_path) or old_path in new_paths:
+            continue
+        src = connect_path(old_path)
+        approvals = src.execute('''
+            SELECT client_id, total_count, receive_count, final_result, key_names, token,
+                   created_at, finished_at, deadline, secret_hash
+            FROM approvals
+        ''').fetchall()
+        results = src.execute('''
+            SELECT client_id, server_url, result FROM approval_results
+        ''').fetchall()
+        src.close()
+
+        # 按新分片分组后批量写入
+        approval_groups = {}
+        for row in approvals:
+            approval_groups.setdefault(shard_index(row[0], new_count), []).append(row)
+        result_groups = {}
+        for row in results:
+            result_groups.setdefault(shard_index(row[0], new_count), []).append(row)
+        for index in set(approval_groups) | set(result_groups):
+            dst = connect_path(new_paths[index])
+            dst.executemany('''
+                INSERT OR REPLACE INTO approvals
+                (client_id, total_count, receive_count, final_result, key_names, token,
+                 created_at, finished_at, deadline, secret_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', approval_groups.get(index, []))
+            dst.executemany('''
+                INSERT OR REPLACE INTO approval_results (client_id, server_url, result)
+                VALUES (?, ?, ?)
+            ''', result_groups.get(index, []))
+            dst.commit()
+            dst.close()
+        moved += len(approvals)
+        print(f"{old_path}: 已迁移 {len(approvals)} 个审批任务")
+
+        if not keep:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(old_path + suffix):
+                    os.remove(old_path + suffix)
+    print(f"迁移完成，共迁移 {moved} 个审批任务到 {new_count} 个分片")
+
+# ---------- 审批截止时间 ----------
+def load_deadlines() -> List[tuple]:
+    """读取所有分片中未完成且设置了截止时间的任务 (client_id, 截止时间)，走部分索引，不扫描已完成的任务"""
+    items = []
+    for path in shard_paths():
+        conn = connect_path(path)
+        items.extend(conn.execute('''
+            SELECT client_id, deadline FROM approvals
+            WHERE final_result IS NULL AND deadline IS NOT NULL
+        ''').fetchall())
+        conn.close()
+    return items
+
+def expire_approvals(client_ids: List[str], final_result: str = "timeout") -> int:
+    """
+    将一批到期的任务标记为超时（每个分片在一个事务内完成），尚未答复的审批服务器结果也记为超时；
+    已经完成的任务不受影响，返回实际被标记的任务数
+    """
+    finished_at = datetime.now().isoformat()
+    expired = 0
+    for path, ids in group_by_shard(client_ids).items():
+        conn = connect_path(path)
+        c = conn.cursor()
+        c.executemany('''
+            UPDATE approvals SET final_result = ?, finished_at = ?
+            WHERE client_id = ? AND final_result IS NULL
+        ''', [(final_result, finished_at, cid) for cid in ids])
+        expired += c.rowcount
+        c.executemany('''
+            UPDATE approval_results SET result = ?
+            WHERE client_id = ? AND result IS NULL
+        ''', [(final_result, cid) for cid in ids])
+        conn.commit()
+        conn.close()
+    return expired
+
+# ---------- 归档 ----------
+def archive_shard(path: str, cutoff: str) -> int:
+    """将一个分片中完成时间早于 cutoff 的审批任务及其各方结果移入归档文件"""
+    conn = connect_path(path)
+    c = conn.cursor()
+    archived = 0
+    while True:
+        c.execute('''
+            SELECT client_id, total_count, receive_count, final_result, key_names,
+                   created_at, finished_at
+            FROM approvals
+            WHERE final_result IS NOT NULL AND finished_at < ?
+            LIMIT ?
+        ''', (cutoff, retention.ARCHIVE_BATCH_SIZE))
+        columns = [d[0] for d in c.description]
+        approvals = [dict(zip(columns, row)) for row in c.fetchall()]
+        if not approvals:
+            break
+        # 各方结果按所属任务的完成日期归档，方便按日期一起查询
+        finished_at = {a["client_id"]: a["finished_at"] for a in approvals}
+        results = []
+        for i in range(0, len(approvals), 500):
+            part = [a["client_id"] for a in approvals[i:i + 500]]
+            marks = ",".join("?" * len(part))
+            c.execute(f'''
+                SELECT client_id, server_url, result FROM approval_results WHERE client_id IN ({marks})
+            ''', part)
+            results.extend(
+                {"client_id": r[0], "server_url": r[1], "result": r[2], "finished_at": finished_at[r[0]]}
+                for r in c.fetchall()
+            )
+
+        # 先落盘归档文件再删除，中途失败最多导致重复归档，不会丢数据
+        retention.write_archive(ARCHIVE_DIR, "approvals", approvals, "finished_at")
+        retention.write_archive(ARCHIVE_DIR, "approval_results", results, "finished_at")
+        ids = [(a["client_id"],) for a in approvals]
+        c.executemany("DELETE FROM approval_results WHERE client_id = ?", ids)
+        c.executemany("DELETE FROM approvals WHERE client_id = ?", ids)
+        conn.commit()
+        archived += len(approvals)
+    retention.incremental_vacuum(conn)
+    conn.close()
+    return archived
+
+def archive_finished():
+    if RETENTION_DAYS <= 0:
+        return
+    cutoff = (datetime.now() - timedelta(days=RETENTION_DAYS)).isoformat()
+    archived = sum(archive_shard(path, cutoff) for path in shard_paths())
+    if archived:
+        print(f"已归档 {archived} 个审批任务")
+
+'''示例
+# 从单库迁移到 4 个分片，之后以 COORDINATOR_SHARDS=4 启动协调器
+python coordinator_db.py reshard --from 1 --to 4
+# 停服后将已有的各分片转换为增量 VACUUM 模式（会对每个分片执行一次完整 VACUUM）
+COORDINATOR_SHARDS=4 python coordinator_db.py enable-incremental-vacuum
+'''
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="协调器数据库分片工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("reshard", help="在不同分片数之间迁移数据")
+    p.add_argument("--from", dest="old_count", type=int, required=True)
+    p.add_argument("--to", dest="new_count", type=int, required=True)
+    p.add_argument("--keep", action="store_true", help="迁移后保留旧分片文件")
+    sub.add_parser("enable-incremental-vacuum", help="将已有的各分片转换为增量 VACUUM 模式")
+    args = parser.parse_args()
+    if args.command == "reshard":
+        reshard(args.old_count, args.new_count, args.keep)
+    elif args.command == "enable-incremental-vacuum":
+        for path in shard_paths():
+            conn = connect_path(path)
+            converted = retention.enable_incremental_vacuum(conn)
+            conn.close()
+            print(f"{path}: {'已转换为增量 VACUUM 模式' if converted else '已是增量 VACUUM 模式'}")
@@ -0,0 +1,122 @@
+import asyncio
+import heapq
+import time
+import traceback
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+# ---------- 审批截止时间调度 ----------
+# 每个未完成的审批任务有一个截止时间（epoch 秒），协调器在内存中用最小堆保存 (截止时间, client_id)。
+# 后台协程睡到最早的截止时间，把到期的任务成批交给 expire 回调按 client_id 更新数据库，不需要定期扫描整张表。
+# 任务提前完成时只从字典中删除，堆中的旧条目在弹出时跳过（惰性删除），旧条目过多时用字典重建堆。
+# 服务启动时从各分片读取未完成任务的截止时间重建堆（走部分索引，只读未完成的任务）
+
+# 每批处理的到期任务数
+EXPIRE_BATCH_SIZE = 1000
+# 最长睡眠时间（秒），系统时间被调整后最多延迟这么久
+MAX_SLEEP = 60.0
+# expire 回调失败后重试的间隔（秒）
+RETRY_DELAY = 5.0
+# 堆中旧条目超过有效条目数加上这个数量时重建堆
+COMPACT_SLACK = 1024
+
+class DeadlineScheduler:
+    def __init__(self, expire: Callable[[List[str]], Awaitable[None]], batch_size: int = EXPIRE_BATCH_SIZE):
+        self.expire = expire
+        self.batch_size = batch_size
+        self._heap: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task = None
+        self.stats = {"expired": 0, "batches": 0, "failures": 0}
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def load(self, items: Iterable[Tuple[str, float]]):
+        """批量载入 (client_id, 截止时间)，一次建堆"""
+        self._deadlines.update(items)
+        self._heap = [(deadline, client_id) for client_id, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+        self._wake()
+
+    def add(self, client_id: str, deadline: float):
+        self._deadlines[client_id] = deadline
+        heapq.heappush(self._heap, (deadline, client_id))
+        # 新的截止时间早于当前睡眠的目标时提前唤醒
+        if self._heap[0] == (deadline, client_id):
+            self._wake()
+
+    def discard(self, client_id: str):
+        """任务已完成，不再需要超时处理"""
+        if self._deadlines.pop(client_id, None) is not None and \
+                len(self._heap) > 2 * len(self._deadlines) + COMPACT_SLACK:
+            self._heap = [(deadline, cid) for cid, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def _is_live(self, entry: Tuple[float, str]) -> bool:
+        return self._deadlines.get(entry[1]) == entry[0]
+
+    def next_deadline(self) -> Optional[float]:
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now: float, limit: int) -> List[str]:
+        client_ids = []
+        while self._heap and self._heap[0][0] <= now and len(client_ids) < limit:
+            entry = heapq.heappop(self._heap)
+            if self._is_live(entry):
+                del self._deadlines[entry[1]]
+                client_ids.append(entry[1])
+        return client_ids
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            now = time.time()
+            deadline = self.next_deadline()
+            if deadline is None or deadline > now:
+                self._wakeup.clear()
+                timeout = MAX_SLEEP if deadline is None else min(deadline - now, MAX_SLEEP)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            client_ids = self.pop_expired(now, self.batch_size)
+            try:
+                await self.expire(client_ids)
+                self.stats["expired"] += len(client_ids)
+                self.stats["batches"] += 1
+            except Exception:
+                # 数据库暂时不可用等情况：稍后重试这一批
+                self.stats["failures"] += 1
+                print(f"处理 {len(client_ids)} 个超时审批任务失败，{RETRY_DELAY} 秒后重试")
+                traceback.print_exc()
+                for client_id in client_ids:
+                    self.add(client_id, now + RETRY_DELAY)
+
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def describe(self) -> dict:
+        deadline = self.next_deadline()
+        return {
+            "outstanding": len(self._deadlines),
+            "heap_entries": len(self._heap),
+            "next_deadline": deadline,
+            **self.stats,
+        }
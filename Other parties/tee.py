@@ -1,60 +1,236 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi.responses import StreamingResponse
 import os, base64, requests, zipfile
-import subprocess
+from typing import Iterator, List, Optional
+import collections
+import hashlib
+import itertools
+import contextvars
+import json
+import mmap
+import shutil
 import tempfile
 import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import shared_path  # noqa: F401  共用模块在仓库根目录的 shared/ 中
+import admission
+import envelope_format
+import luks_profiles
+import tracing
 
 app = FastAPI()
+# 链路追踪：记录每个请求并提供 /traces 查看接口
+tracing.install(app, "tee")
 
-VAULT_PROVIDER_URL = "http://192.168.216.129:9001/vault/decrypt_key"
+VAULT_PROVIDER_URL = os.environ.get("VAULT_PROVIDER_URL", "http://192.168.216.129:9001/vault/decrypt_key")
+# 批量解密 DEK 的接口，默认与 VAULT_PROVIDER_URL 位于同一服务
+VAULT_PROVIDER_BATCH_URL = os.environ.get(
+    "VAULT_PROVIDER_BATCH_URL",
+    VAULT_PROVIDER_URL.rsplit("/", 1)[0] + "/decrypt_keys"
+)
 
-# 使用本地明文 DEK 对加密数据进行 LUKS 解密
+# 信封仓库的下载地址，按信封 ID 取信封
+VAULT_PROVIDER_ENVELOPE_URL = os.environ.get(
+    "VAULT_PROVIDER_ENVELOPE_URL",
+    VAULT_PROVIDER_URL.rsplit("/", 1)[0] + "/envelopes"
+)
+# 按 ID 下载的信封缓存目录；信封 ID 是内容的 sha256，已缓存的信封不再重复下载
+ENVELOPE_CACHE_DIR = os.environ.get("TEE_ENVELOPE_CACHE_DIR", "./envelope_cache")
+
+# 分块仓库的下载地址，解密去重信封时按分块 ID 取分块
+VAULT_PROVIDER_CHUNK_URL = os.environ.get(
+    "VAULT_PROVIDER_CHUNK_URL",
+    VAULT_PROVIDER_URL.rsplit("/", 1)[0] + "/chunks"
+)
+# 认证通过的分块缓存目录；同一模型的新版本只需下载新增的分块
+CHUNK_CACHE_DIR = os.environ.get("TEE_CHUNK_CACHE_DIR", os.path.join(ENVELOPE_CACHE_DIR, "chunks"))
+# 解密去重信封时提前下载的分块数
+CHUNK_PREFETCH = int(os.environ.get("TEE_CHUNK_PREFETCH", "4"))
+
+# 批量解密接口中的 input_dir、output_dir 都是该目录下的相对路径，不接受绝对路径和 ..，
+# 请求方不能让 tee 读写服务器上的任意目录
+TEE_DATA_DIR = os.environ.get("TEE_DATA_DIR", ".")
+
+# 并行解密的工作线程数，默认与 CPU 核数相同；LUKS 信封主要耗在磁盘 IO 上，可适当调大
+DECRYPT_WORKERS = int(os.environ.get("TEE_DECRYPT_WORKERS", str(os.cpu_count() or 1)))
+# 同时处理中的信封明文大小之和的上限（字节），防止并行解密时页缓存和临时文件占满内存
+DECRYPT_MEMORY_BUDGET = int(os.environ.get("TEE_DECRYPT_MEMORY_BUDGET", str(2 * 1024 ** 3)))
+# 等待内存预算的信封数达到该值时，新的批量解密请求直接返回 429
+ADMISSION_MAX_QUEUE = int(os.environ.get("TEE_ADMISSION_MAX_QUEUE", "64"))
+
+# 将分块 AEAD 信封解密到内存映射的输出文件：密文直接映射 zip 中的 data.bin，
+# 明文按块解密到预先分配好大小的输出映射中，不经过 Python bytes 中转，由页缓存负责读写
+def mmap_decrypt_data(encrypted_zip_path: str, plaintext_dek: bytes, output_path: str, manifest: dict):
+    offset, length = envelope_format.member_span(encrypted_zip_path)
+    plaintext_size = manifest["plaintext_size"]
+    with open(encrypted_zip_path, "rb") as src_file, open(output_path, "w+b") as dst_file:
+        dst_file.truncate(plaintext_size)
+        src_map = mmap.mmap(src_file.fileno(), 0, access=mmap.ACCESS_READ)
+        # 空文件无法映射，用空缓冲区代替（仍需校验最后一帧）
+        dst_map = mmap.mmap(dst_file.fileno(), plaintext_size) if plaintext_size else None
+        try:
+            envelope_format.decrypt_into_buffer(
+                plaintext_dek, manifest, memoryview(src_map)[offset:offset + length],
+                memoryview(dst_map) if dst_map is not None else memoryview(bytearray())
+            )
+            if dst_map is not None:
+                dst_map.flush()
+        finally:
+            for m in (src_map, dst_map):
+                try:
+                    if m is not None:
+                        m.close()
+                except BufferError:
+                    # 出错时异常的 traceback 仍引用着内存视图，映射随异常一起回收
+                    pass
+    return output_path
+
+# 以只读内存映射的方式打开解密结果，供后续计算直接使用，不再复制一份明文
+def open_plaintext_buffer(output_path: str) -> memoryview:
+    with open(output_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b"")
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+# 以只读文件对象的方式打开分块 AEAD 信封，按需解密读到的分块，明文不落盘（可 seek，可交给模型加载等库直接读取）
+def open_envelope(encrypted_zip_path: str, plaintext_key_path: str, **options) -> envelope_format.EnvelopeReader:
+    with open(plaintext_key_path, "rb") as f:
+        plaintext_dek = base64.b64decode(f.read())
+    return envelope_format.EnvelopeReader(encrypted_zip_path, plaintext_dek, **options)
+
+# 使用本地明文 DEK 对加密数据进行解密（支持分块 AEAD 和 LUKS 两种信封格式）
 def luks_decrypt_data(encrypted_zip_path: str, plaintext_key_path: str, output_path: str):
+    # 读取明文 DEK
+    with open(plaintext_key_path, "rb") as f:
+        plaintext_dek = f.read()
+    plaintext_dek = base64.b64decode(plaintext_dek)
+    return decrypt_envelope_file(encrypted_zip_path, plaintext_dek, output_path)
+
+# ---------- 去重信封 ----------
+def _chunk_cache_path(chunk_id: str) -> str:
+    return os.path.join(CHUNK_CACHE_DIR, chunk_id[:2], chunk_id)
+
+def fetch_chunk(chunk_id: str) -> bytes:
+    """取一个分块的密文：优先使用本地缓存，否则从提供方的分块仓库下载"""
+    if len(chunk_id) != 64 or any(ch not in "0123456789abcdef" for ch in chunk_id):
+        raise ValueError(f"非法的分块 ID: {chunk_id}")
+    path = _chunk_cache_path(chunk_id)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    resp = requests.get(f"{VAULT_PROVIDER_CHUNK_URL}/{chunk_id}", headers=tracing.inject())
+    if resp.status_code != 200:
+        raise RuntimeError(f"下载分块失败: {resp.text}")
+    return resp.content
+
+def cache_chunk(chunk_id: str, blob: bytes):
+    """缓存认证通过的分块，被篡改的分块不会进入缓存"""
+    path = _chunk_cache_path(chunk_id)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(blob)
+    os.replace(tmp_path, path)
+
+def prefetch(func, items, depth: int):
+    """按顺序返回 func(item) 的结果，后台线程最多提前执行 depth 个"""
+    with ThreadPoolExecutor(max_workers=max(depth, 1)) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.submit(contextvars.copy_context().run, func, item))
+            if len(pending) > depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def decrypt_recipe_file(encrypted_zip_path: str, store_key: bytes, output_path: str, manifest: dict):
+    with zipfile.ZipFile(encrypted_zip_path, "r") as z:
+        recipe = envelope_format.load_recipe(z)
+    chunk_ids = [entry[0] for entry in envelope_format.recipe_entries(recipe)]
+    with open(output_path, "wb") as dst:
+        envelope_format.decrypt_recipe(store_key, manifest, recipe, prefetch(fetch_chunk, chunk_ids, CHUNK_PREFETCH),
+                                       dst, cache_chunk)
+    return output_path
+
+# 使用明文 DEK 解密单个信封，可在多个线程中并行调用
+@tracing.traced("crypto.decrypt")
+def decrypt_envelope_file(encrypted_zip_path: str, plaintext_dek: bytes, output_path: str):
     try:
-        # 读取明文 DEK
-        with open(plaintext_key_path, "rb") as f:
-            plaintext_dek = f.read()
-        plaintext_dek = base64.b64decode(plaintext_dek)
-        # 打开加密压缩包并提取相应文件
-        with zipfile.ZipFile(encrypted_zip_path, "r") as z:   
-            # 读取密文文件
-            with z.open("data.bin") as f:
-                encrypted_content = f.read()
-            # 读取 luks_header
-            with z.open("luks_header.bin") as f:
-                luks_header = f.read()
+        # 分块 AEAD 格式：信封头中记录了加密算法和分块大小
+        with zipfile.ZipFile(encrypted_zip_path, "r") as z:
+            manifest = envelope_format.read_manifest(z)
+            data_stored = (envelope_format.DATA_NAME in z.namelist()
+                           and z.getinfo(envelope_format.DATA_NAME).compress_type == zipfile.ZIP_STORED)
+        if manifest is not None:
+            try:
+                if manifest["format"] == envelope_format.RECIPE_FORMAT:
+                    # 去重信封：按分块清单取分块解密，plaintext_dek 为仓库 DEK
+                    decrypt_recipe_file(encrypted_zip_path, plaintext_dek, output_path, manifest)
+                elif data_stored:
+                    # data.bin 未压缩时直接内存映射解密
+                    mmap_decrypt_data(encrypted_zip_path, plaintext_dek, output_path, manifest)
+                else:
+                    with zipfile.ZipFile(encrypted_zip_path, "r") as z, \
+                            z.open(envelope_format.DATA_NAME) as src, open(output_path, "wb") as dst:
+                        envelope_format.decrypt_stream(plaintext_dek, manifest, src, dst)
+            except Exception:
+                # 认证失败时输出文件中可能残留未经认证的明文
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                raise
+            print(f"解密完成，结果已保存到: {output_path}")
+            return output_path
 
         # 保存密文（LUKS 块设备）到临时文件
         with tempfile.TemporaryDirectory() as tmpdir:
             luks_data_path = os.path.join(tmpdir, "data.img")
             luks_header_path = os.path.join(tmpdir, "header.bin")
-            plain_path = os.path.join(tmpdir, "recovered_output.bin")
-
-            # 提取文件实际大小的密文
-            # 提取前8字节为明文大小（大端）
-            file_size = int.from_bytes(encrypted_content[:8], byteorder="big")
-            # 提取真正的密文部分
-            ciphertext = encrypted_content[8:]
-            with open(luks_data_path, "wb") as f:
-                f.write(ciphertext)
+
+            with zipfile.ZipFile(encrypted_zip_path, "r") as z:
+                verifier = envelope_format.DigestVerifier(envelope_format.read_digest(z),
+                                                          envelope_format.digest_key(plaintext_dek))
+                with z.open("data.bin") as src:
+                    # 提取前8字节为明文大小（大端）
+                    file_size = int.from_bytes(src.read(8), byteorder="big")
+                    # 其余为真正的密文部分，流式写入临时文件，不在内存中保留整份密文
+                    with open(luks_data_path, "wb") as f:
+                        shutil.copyfileobj(src, f, 1024 * 1024)
+                header = z.read("luks_header.bin")
             with open(luks_header_path, "wb") as f:
-                f.write(luks_header)
+                f.write(header)
 
-            subprocess.run([
-                "cryptsetup", "open",
-                "--header", luks_header_path,
-                luks_data_path, "luks_tmp",
-                "--key-file", "-"
-            ], input=plaintext_dek, check=True)
+            # 加密参数（cipher、扇区大小、PBKDF）都从 header 中读取，不依赖加密时使用的参数组
+            params = luks_profiles.read_header(header)
+            data_size = os.path.getsize(luks_data_path)
+            if data_size % params["sector_size"] or data_size < file_size:
+                raise ValueError(f"LUKS 密文长度 {data_size} 与扇区大小 {params['sector_size']} 或明文长度 {file_size} 不符")
 
-            subprocess.run(["dd", f"if=/dev/mapper/luks_tmp", f"of={plain_path}", "bs=1M"], check=True)
+            # 每次解密使用独立的映射名，多个信封并行解密时互不冲突
+            mapper_name = luks_profiles.new_mapper_name()
+            luks_profiles.luks_open(luks_data_path, luks_header_path, mapper_name, plaintext_dek)
 
-            subprocess.run(["cryptsetup", "close", "luks_tmp"], check=True)
+            try:
+                # 从映射设备读出明文写入目标文件（只写到明文长度，去掉按扇区补齐的填充），同时计算摘要
+                with open(f"/dev/mapper/{mapper_name}", "rb") as src, open(output_path, "wb") as dst:
+                    remaining = file_size
+                    while remaining:
+                        block = src.read(min(remaining, 1024 * 1024))
+                        if not block:
+                            raise ValueError("LUKS 设备中的数据短于明文长度")
+                        dst.write(block)
+                        verifier.update(block)
+                        remaining -= len(block)
+            finally:
+                luks_profiles.luks_close(mapper_name)
 
-            with open(plain_path, "rb") as f:
-                decrypted_data = f.read(file_size)
-            with open(output_path, "wb") as f:
-                f.write(decrypted_data)
+            try:
+                verifier.verify()
+            except ValueError:
+                os.remove(output_path)
+                raise
 
         print(f"解密完成，结果已保存到: {output_path}")
         return output_path
@@ -75,6 +251,7 @@ async def request_decryption_key(
     encrypted_key: UploadFile = File(...),
     key_name: str = Form(...),
     client_id: str = Form(...),
+    approval_token: Optional[str] = Form(None),
 ):
     try:
         files = {
@@ -84,9 +261,12 @@ async def request_decryption_key(
             "key_name": key_name,
             "client_id": client_id
         }
+        # 携带协调器签发的审批令牌，提供方可在本地校验而无需查库
+        if approval_token:
+            data["approval_token"] = approval_token
 
         # 向数据/函数提供方发送请求
-        resp = requests.post(VAULT_PROVIDER_URL, files=files, data=data)
+        resp = requests.post(VAULT_PROVIDER_URL, files=files, data=data, headers=tracing.inject())
         if resp.status_code != 200:
             raise HTTPException(status_code=500, detail=f"请求解密密钥失败: {resp.text}")
 
@@ -99,3 +279,224 @@ async def request_decryption_key(
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"TEE 请求密钥出错: {str(e)}")
+
+# ---------- 批量并行解密 ----------
+# 全局内存预算：各线程在解密信封前申请该信封的明文大小，已接受的请求中的信封只排队、不超时；
+# 单个超过上限的信封在没有其他任务进行时也允许执行
+memory_budget = admission.MemoryBudget(DECRYPT_MEMORY_BUDGET, ADMISSION_MAX_QUEUE, None, "tee")
+
+def reject_if_overloaded():
+    """排队等待预算的信封已达上限时拒绝新的批量请求，不再开始流式响应"""
+    overloaded = memory_budget.overloaded()
+    if overloaded is not None:
+        raise HTTPException(status_code=429, detail=str(overloaded),
+                            headers={"Retry-After": str(overloaded.retry_after)})
+
+def _within(base: str, path: str) -> bool:
+    return os.path.commonpath([base, path]) == base
+
+def resolve_data_path(path: str) -> str:
+    """把请求中的目录解析到 TEE_DATA_DIR 下，绝对路径、含 .. 或经符号链接指向目录外的路径抛出 ValueError"""
+    parts = path.replace("\\", "/").split("/")
+    if not path or os.path.isabs(path) or ".." in parts:
+        raise ValueError(f"路径必须是 TEE_DATA_DIR 下的相对路径，且不能包含 ..: {path}")
+    base = os.path.realpath(TEE_DATA_DIR)
+    resolved = os.path.realpath(os.path.join(base, path))
+    if not _within(base, resolved):
+        raise ValueError(f"路径不在 TEE_DATA_DIR 下: {path}")
+    return resolved
+
+# 读取信封中的根密钥名、加密 DEK 和明文大小，不解压数据部分
+def read_envelope_info(encrypted_zip_path: str) -> dict:
+    with zipfile.ZipFile(encrypted_zip_path, "r") as z:
+        manifest = envelope_format.read_manifest(z)
+        size = manifest["plaintext_size"] if manifest else z.getinfo("data.bin").file_size
+        return {
+            "key_name": z.read("key_name.txt").decode().strip(),
+            "encrypted_key": z.read("encrypted_key.txt").decode().strip(),
+            "size": size,
+        }
+
+# 一次请求取回所有信封的明文 DEK，相同的加密 DEK 只发送一次
+@tracing.traced("tee.fetch_datakeys")
+def fetch_datakeys(infos: List[dict], client_id: str, approval_token: Optional[str] = None) -> List[bytes]:
+    unique = list(dict.fromkeys((info["key_name"], info["encrypted_key"]) for info in infos))
+    resp = requests.post(VAULT_PROVIDER_BATCH_URL, json={
+        "client_id": client_id,
+        "approval_token": approval_token,
+        "keys": [{"key_name": k, "encrypted_key": ct} for k, ct in unique],
+    }, headers=tracing.inject())
+    if resp.status_code != 200:
+        raise RuntimeError(f"请求解密密钥失败: {resp.text}")
+    body = resp.json()
+    if body.get("status") != "ok":
+        raise RuntimeError(body.get("message", "请求解密密钥失败"))
+    plaintexts = dict(zip(unique, (base64.b64decode(k) for k in body["keys"])))
+    return [plaintexts[(info["key_name"], info["encrypted_key"])] for info in infos]
+
+def _decrypt_one(encrypted_zip_path: str, plaintext_dek: bytes, output_path: str, size: int) -> dict:
+    with admission.Reservation(memory_budget, size, timeout=None, bounded=False):
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        decrypt_envelope_file(encrypted_zip_path, plaintext_dek, output_path)
+    return {"envelope": encrypted_zip_path, "output": output_path, "status": "ok", "size": size}
+
+def iter_decrypt_envelopes(envelope_paths: List[str], output_dir: str, client_id: str,
+                           approval_token: Optional[str] = None, workers: Optional[int] = None,
+                           base_dir: Optional[str] = None) -> Iterator[dict]:
+    """
+    并行解密多个信封，每个信封完成后立即产出一条结果：
+    先批量取回所有 DEK（一次网络往返），再交给线程池解密，
+    各线程在开始前向全局内存预算申请该信封的明文大小
+    """
+    infos = [read_envelope_info(path) for path in envelope_paths]
+    deks = fetch_datakeys(infos, client_id, approval_token)
+    base_dir = base_dir or os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in envelope_paths])
+
+    workers = max(1, min(workers or DECRYPT_WORKERS, len(envelope_paths)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for path, info, dek in zip(envelope_paths, infos, deks):
+            rel = os.path.relpath(os.path.abspath(path), base_dir)
+            if rel.endswith(".zip"):
+                rel = rel[:-len(".zip")]
+            output_path = os.path.join(output_dir, rel)
+            # 工作线程沿用当前链路上下文
+            future = pool.submit(contextvars.copy_context().run, _decrypt_one, path, dek, output_path, info["size"])
+            futures[future] = (path, output_path)
+        for future in as_completed(futures):
+            path, output_path = futures[future]
+            try:
+                yield future.result()
+            except Exception as e:
+                yield {"envelope": path, "output": output_path, "status": "error",
+                       "error": f"{type(e).__name__}: {e}"}
+
+'''示例
+curl -N -X POST http://192.168.216.130:1000/decrypt_folder \
+  -F "input_dir=encrypted_output" \
+  -F "output_dir=decrypted_output" \
+  -F "client_id=client_001" \
+  -F "workers=4"
+'''
+# 并行解密目录中的所有信封，以 NDJSON 流式返回，每完成一个信封输出一行
+@app.post("/decrypt_folder")
+def decrypt_folder(
+    input_dir: str = Form(...),
+    output_dir: str = Form(...),
+    client_id: str = Form(...),
+    approval_token: Optional[str] = Form(None),
+    workers: Optional[int] = Form(None),
+):
+    try:
+        input_dir = resolve_data_path(input_dir)
+        output_dir = resolve_data_path(output_dir)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    reject_if_overloaded()
+    # 跳过指向 TEE_DATA_DIR 之外的符号链接
+    base = os.path.realpath(TEE_DATA_DIR)
+    envelope_paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(input_dir)
+        for name in names
+        if name.endswith(".zip") and _within(base, os.path.realpath(os.path.join(root, name)))
+    )
+    if not envelope_paths:
+        raise HTTPException(status_code=404, detail="目录中没有信封文件")
+    return ndjson_response(lambda: iter_decrypt_envelopes(
+        envelope_paths, output_dir, client_id, approval_token, workers, base_dir=input_dir
+    ))
+
+def ndjson_response(make_results) -> StreamingResponse:
+    """把逐个完成的解密结果以 NDJSON 流式返回，最后一行为汇总"""
+    try:
+        results = make_results()
+        # 先取第一条结果，让密钥请求失败时能返回错误状态码
+        first = next(results)
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"批量解密出错: {str(e)}")
+
+    def stream():
+        ok = failed = 0
+        for item in itertools.chain([first], results):
+            if item["status"] == "ok":
+                ok += 1
+            else:
+                failed += 1
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+        yield json.dumps({"status": "done", "ok": ok, "failed": failed}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# ---------- 按 ID 获取信封 ----------
+@tracing.traced("tee.fetch_envelope")
+def fetch_envelope(envelope_id: str) -> str:
+    """从提供方的信封仓库下载信封到本地缓存，边下载边校验内容摘要，返回本地路径"""
+    if len(envelope_id) != 64 or any(ch not in "0123456789abcdef" for ch in envelope_id):
+        raise ValueError(f"非法的信封 ID: {envelope_id}")
+    path = os.path.join(ENVELOPE_CACHE_DIR, f"{envelope_id}.zip")
+    if os.path.exists(path):
+        return path
+    os.makedirs(ENVELOPE_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    try:
+        with requests.get(f"{VAULT_PROVIDER_ENVELOPE_URL}/{envelope_id}", stream=True,
+                          headers=tracing.inject()) as resp:
+            if resp.status_code != 200:
+                raise RuntimeError(f"下载信封失败: {resp.text}")
+            with open(tmp_path, "wb") as f:
+                for block in resp.iter_content(1024 * 1024):
+                    f.write(block)
+                    digest.update(block)
+        if digest.hexdigest() != envelope_id:
+            raise ValueError(f"信封 {envelope_id} 内容摘要不一致")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+def iter_decrypt_stored(envelope_ids: List[str], output_dir: str, client_id: str,
+                        approval_token: Optional[str] = None, workers: Optional[int] = None) -> Iterator[dict]:
+    """并行下载信封仓库中的信封（已缓存的跳过）后批量解密，输出文件名为信封 ID"""
+    workers = max(1, min(workers or DECRYPT_WORKERS, len(envelope_ids)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, fetch_envelope, i) for i in envelope_ids]
+        paths = [f.result() for f in futures]
+    yield from iter_decrypt_envelopes(paths, output_dir, client_id, approval_token, workers,
+                                      base_dir=ENVELOPE_CACHE_DIR)
+
+'''示例
+curl -N -X POST http://192.168.216.130:1000/decrypt_stored \
+  -F "envelope_ids=3f2a...,9c1b..." \
+  -F "output_dir=decrypted_output" \
+  -F "client_id=client_001"
+'''
+# 按信封 ID 从提供方的信封仓库取信封并并行解密，结果以 NDJSON 流式返回
+@app.post("/decrypt_stored")
+def decrypt_stored(
+    envelope_ids: str = Form(...),                  # 逗号分隔的信封 ID
+    output_dir: str = Form(...),
+    client_id: str = Form(...),
+    approval_token: Optional[str] = Form(None),
+    workers: Optional[int] = Form(None),
+):
+    ids = list(dict.fromkeys(i.strip() for i in envelope_ids.split(",") if i.strip()))
+    if not ids:
+        raise HTTPException(status_code=400, detail="没有指定信封 ID")
+    try:
+        output_dir = resolve_data_path(output_dir)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    reject_if_overloaded()
+    return ndjson_response(lambda: iter_decrypt_stored(ids, output_dir, client_id, approval_token, workers))
+
+'''示例
+curl -X GET http://192.168.216.130:1000/admission
+'''
+# 查看内存预算的使用情况和排队深度
+@app.get("/admission")
+def admission_stats():
+    return memory_budget.stats()
@@ -1,12 +1,42 @@
+import hashlib
+import json
 import os
+import uuid
 import requests
 from pathlib import Path
 from tqdm import tqdm
 
 SERVER_URL = "http://192.168.216.128:5000"  # 修改为服务端地址
-ENCRYPT_ENDPOINT = f"{SERVER_URL}/envelope/encrypt"
+# 数据/函数提供方（data_function_provider）的地址：批次主密钥和去重只有它的 /vault/encrypt_file 支持
+PROVIDER_URL = "http://192.168.216.128:9001"
+ENCRYPT_ENDPOINT = f"{PROVIDER_URL}/vault/encrypt_file"
 DECRYPT_ENDPOINT = f"{SERVER_URL}/envelope/decrypt"
 
+# 读取信封中记录的明文摘要：分块 AEAD 信封在 envelope.json 中，LUKS 信封在 digest.json 中
+# 带密钥的摘要（keyed）需要 DEK 才能校验，客户端拿不到 DEK，由 tee 解密时校验，这里只校验旧信封中不带密钥的摘要
+def read_digest(zip_ref):
+    names = zip_ref.namelist()
+    digest = None
+    if "envelope.json" in names:
+        digest = json.loads(zip_ref.read("envelope.json")).get("digest")
+    elif "digest.json" in names:
+        digest = json.loads(zip_ref.read("digest.json"))
+    if digest and digest.get("keyed"):
+        return None
+    return digest
+
+# 信封格式：有 envelope.json 的是分块 AEAD（aead-chunked）或去重（cdc-recipe）信封，否则是 LUKS 信封
+def envelope_format(zip_ref):
+    if "envelope.json" in zip_ref.namelist():
+        return json.loads(zip_ref.read("envelope.json")).get("format")
+    return "luks"
+
+def new_digest(algorithm):
+    if algorithm == "blake3":
+        import blake3
+        return blake3.blake3()
+    return hashlib.new(algorithm)
+
 # 遍历所有文件，找出最大文件
 def find_largest_file_size(root_dir):
     max_size = 0
@@ -18,7 +48,9 @@ def find_largest_file_size(root_dir):
                 max_size = size
     return max_size
 
-def encrypt_folder(input_dir, output_dir, key_name):
+# dedup=True 时使用去重模式：服务端按内容分块，已加密过的分块不再加密，返回的信封中只有分块清单，
+# 同一模型的多个 checkpoint 版本只需保存一份相同的分块（服务端需配置分块仓库，去重信封在 tee 中解密）
+def encrypt_folder(input_dir, output_dir, key_name, dedup=False):
     input_dir = Path(input_dir)
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -27,6 +59,15 @@ def encrypt_folder(input_dir, output_dir, key_name):
     max_size = find_largest_file_size(input_dir)
     print(f"最大文件尺寸：{max_size / 1024**2:.2f} MB")
 
+    # 同一次加密的文件属于同一批次，服务端对整批文件只申请一次主密钥（仅分块 AEAD 格式支持批次）
+    # 去重模式使用根密钥的仓库 DEK，不能带批次
+    data = {"sym_key_name": key_name, "format": "aead"}
+    if dedup:
+        data["dedup"] = "true"
+    else:
+        data["batch_id"] = uuid.uuid4().hex
+    total_bytes = new_bytes = 0
+
     # 遍历所有文件并上传加密
     for root, _, files in os.walk(input_dir):
         for file in tqdm(files, desc="加密文件"):
@@ -36,12 +77,15 @@ def encrypt_folder(input_dir, output_dir, key_name):
                 response = requests.post(
                     ENCRYPT_ENDPOINT,
                     files={"file": (file, f)},
-                    data={"sym_key_name": key_name},
+                    data=data,
                     stream=True
                 )
                 if response.status_code != 200:
                     print(f"[失败] 加密失败: {rel_path} => {response.text}")
                     continue
+                if dedup:
+                    total_bytes += input_file_path.stat().st_size
+                    new_bytes += int(response.headers.get("X-Dedup-New-Bytes", 0))
 
                 out_zip_path = output_dir / rel_path.with_suffix(".zip")
                 out_zip_path.parent.mkdir(parents=True, exist_ok=True)
@@ -50,11 +94,17 @@ def encrypt_folder(input_dir, output_dir, key_name):
                     for chunk in response.iter_content(chunk_size=8192):
                         out_f.write(chunk)
 
+    if dedup and total_bytes:
+        print(f"去重：共 {total_bytes / 1024**2:.2f} MB，新加密 {new_bytes / 1024**2:.2f} MB"
+              f"（{new_bytes / total_bytes:.1%}）")
+
+# 只有 LUKS 信封可以通过 /envelope/decrypt 解密；分块 AEAD 信封和去重信封需要审批后在 tee 中解密（/decrypt_folder）
 def decrypt_folder(encrypted_dir, output_dir):
     # 提取文件所在的目录
     encrypted_dir = Path(encrypted_dir)
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
+    skipped = 0
 
     # 遍历目录中的zip文件(加密后输出为zip文件)
     for root, _, files in os.walk(encrypted_dir):
@@ -67,7 +117,14 @@ def decrypt_folder(encrypted_dir, output_dir):
             # 解压临时保存
             from zipfile import ZipFile
             with ZipFile(zip_path, 'r') as zip_ref:
+                fmt = envelope_format(zip_ref)
+                if fmt != "luks":
+                    kind = "去重信封" if fmt == "cdc-recipe" else "分块 AEAD 信封"
+                    print(f"[跳过] {kind}需要在 tee 中解密: {rel_path}")
+                    skipped += 1
+                    continue
                 key_name = zip_ref.read("key_name.txt").decode("utf-8").strip()  # 解码并去除空格
+                expected = read_digest(zip_ref)
                 files_needed = {
                     name: zip_ref.read(name)
                     for name in ['data.bin', 'luks_header.bin', 'encrypted_key.txt']
@@ -91,7 +148,17 @@ def decrypt_folder(encrypted_dir, output_dir):
             out_file_path = output_dir / recovered_rel_path
             out_file_path.parent.mkdir(parents=True, exist_ok=True)
 
+            # 边写出明文边计算摘要，不需要再读一遍文件
+            hasher = new_digest(expected["algorithm"]) if expected else None
             with open(out_file_path, "wb") as out_f:
                 for chunk in response.iter_content(chunk_size=8192):
                     out_f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+            if hasher is not None and hasher.hexdigest() != expected["value"]:
+                print(f"[失败] 明文摘要不一致: {rel_path}")
+                os.remove(out_file_path)
+
+    if skipped:
+        print(f"{skipped} 个信封不是 LUKS 格式，未在本地解密，请通过 tee 的 /decrypt_folder 解密")
                     
\ No newline at end of file
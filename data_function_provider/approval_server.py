@@ -1,16 +1,77 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, HTTPException, Response
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timedelta
 import os, requests
+import asyncio
+import itertools
 import sqlite3
-from typing import Literal
+import uuid
+from typing import Literal, List, Optional
 from config import VAULT_ADDR, VAULT_TOKEN, DB_PATH
+import shared_path  # noqa: F401  共用模块在仓库根目录的 shared/ 中
+from fast_json import FastJSONResponse
+import fast_json
+import outbox
+import retention
+import tracing
 
 app = APIRouter()
 
+# 已审批记录在热表中保留的天数，超过后移入归档文件；不设置或为 0 时不归档。
+# 不携带审批令牌的解密请求要在本地数据库中查到审批记录，归档后这些记录只能用审批令牌解密，因此默认不归档
+RETENTION_DAYS = int(os.environ.get("APPROVAL_RETENTION_DAYS", "0"))
+# 归档任务的执行间隔（秒）
+RETENTION_INTERVAL = float(os.environ.get("APPROVAL_RETENTION_INTERVAL", "3600"))
+# 归档文件目录
+ARCHIVE_DIR = os.environ.get("APPROVAL_ARCHIVE_DIR", "./approval_archive")
+
+_retention_task = None
+
+# ---------- 审批列表缓存 ----------
+# 前端每隔几秒轮询一次审批列表，而列表很少变化。审批表每次写入（收到审批请求、提交审批结果、归档）后
+# 变更计数加一，序列化好的响应按 (type, page, page_size) 缓存到下一次写入为止；
+# 响应带 ETag（进程启动标识 + 变更计数），带 If-None-Match 的请求在没有写入时直接返回 304，不访问数据库。
+# 变更计数只在本进程内有效，审批表只能由本服务写入
+
+# 最多缓存的页数
+APPROVALS_CACHE_SIZE = 256
+# 进程启动标识，服务重启后旧的 ETag 不再匹配
+_boot_id = uuid.uuid4().hex[:8]
+_version_counter = itertools.count(1)
+_approvals_version = 0
+# (type, page, page_size) -> (变更计数, 序列化后的响应体)
+_approvals_cache = {}
+# 审批列表返回的字段
+APPROVAL_COLUMNS = ["client_id", "content", "base_apiurl", "timestart", "result", "status"]
+
+def bump_approvals_version():
+    """审批表写入提交后调用；next() 是原子操作，归档线程和事件循环同时写入也不会丢失计数"""
+    global _approvals_version
+    _approvals_version = next(_version_counter)
+    _approvals_cache.clear()
+
+def approvals_etag(version: int, key: tuple) -> str:
+    return '"{}-{}-{}"'.format(_boot_id, version, "-".join(str(part) for part in key))
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否命中 etag：逗号分隔的多个标签逐个比较（弱比较，忽略 W/ 前缀），* 匹配任意 ETag"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
 # 启动时初始化数据库
 def init_db():
     conn = sqlite3.connect(DB_PATH)
+    # 新数据库开启增量 VACUUM，归档删除记录后可以逐步归还空闲页（已有数据库见 shared/retention.py 的维护命令）
+    retention.init_incremental_vacuum(conn)
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS approvals (
@@ -19,14 +80,81 @@ def init_db():
             base_apiurl TEXT,
             timestart TEXT,
             result TEXT,
-            status INTEGER DEFAULT 0
+            status INTEGER DEFAULT 0,
+            decided_at TEXT,
+            traceparent TEXT
         )
     ''')
+    # 兼容旧版本数据库：补齐审批时间列和链路上下文列
+    c.execute("PRAGMA table_info(approvals)")
+    columns = {row[1] for row in c.fetchall()}
+    for column in ("decided_at", "traceparent"):
+        if column not in columns:
+            c.execute(f"ALTER TABLE approvals ADD COLUMN {column} TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_approvals_status ON approvals (status)")
+    # 待转发给协调器的审批结果
+    outbox.init_outbox(c)
     conn.commit()
     conn.close()
 
 init_db()
 
+# 将超过保留期的已审批记录移入归档文件，并清理已送达的发件箱消息
+def archive_approvals():
+    if RETENTION_DAYS <= 0:
+        return
+    cutoff = (datetime.now() - timedelta(days=RETENTION_DAYS)).isoformat()
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    archived = 0
+    while True:
+        c.execute('''
+            SELECT client_id, content, base_apiurl, timestart, result, status, decided_at,
+                   COALESCE(decided_at, timestart) AS finished_at
+            FROM approvals
+            WHERE status = 1 AND COALESCE(decided_at, timestart) < ?
+            LIMIT ?
+        ''', (cutoff, retention.ARCHIVE_BATCH_SIZE))
+        columns = [d[0] for d in c.description]
+        rows = [dict(zip(columns, row)) for row in c.fetchall()]
+        if not rows:
+            break
+        # 先落盘归档文件再删除，中途失败最多导致重复归档，不会丢数据
+        retention.write_archive(ARCHIVE_DIR, "approvals", rows, "finished_at")
+        c.executemany("DELETE FROM approvals WHERE client_id = ?", [(r["client_id"],) for r in rows])
+        conn.commit()
+        archived += len(rows)
+        bump_approvals_version()
+    c.execute("DELETE FROM outbox WHERE delivered = 1 AND created_at < ?", (cutoff,))
+    conn.commit()
+    retention.incremental_vacuum(conn)
+    conn.close()
+    if archived:
+        print(f"已归档 {archived} 条审批记录")
+
+# 启动时拉起发件箱的发送协程和归档任务
+@app.on_event("startup")
+async def start_background_tasks():
+    global _retention_task
+    outbox.start_dispatcher()
+    if RETENTION_DAYS > 0 and (_retention_task is None or _retention_task.done()):
+        conn = sqlite3.connect(DB_PATH)
+        if not retention.is_incremental_vacuum(conn):
+            print(f"{DB_PATH} 未开启增量 VACUUM，归档释放的空间不会归还给文件系统，"
+                  f"可停服后执行 python {retention.__file__} enable-incremental-vacuum {DB_PATH}")
+        conn.close()
+        _retention_task = asyncio.get_running_loop().create_task(
+            retention.run_periodically(archive_approvals, RETENTION_INTERVAL, "审批记录归档")
+        )
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    global _retention_task
+    await outbox.stop_dispatcher()
+    if _retention_task is not None:
+        _retention_task.cancel()
+        _retention_task = None
+
 # 协调器会发来的数据格式
 class ApprovalContent(BaseModel):
     client_id: str
@@ -36,6 +164,15 @@ class ApprovalContent(BaseModel):
 class ApprovalResult(BaseModel):
     client_id: str
     result: str
+# 前端批量发送审批结果的数据格式
+class ApprovalResults(BaseModel):
+    decisions: List[ApprovalResult]
+# 协调器批量发来的审批请求
+class ApprovalContents(BaseModel):
+    approvals: List[ApprovalContent]
+
+# IN 查询每批最多携带的参数个数（SQLite 对单条语句的参数个数有限制）
+SQL_BATCH_SIZE = 500
 
 # 审批服务器接收协调器发来的请求
 @app.post("/approval")
@@ -43,48 +180,99 @@ async def receive_approval(
     data: ApprovalContent,
 ):
     timestart = datetime.now().isoformat()
+    # 记下协调器请求所在的链路，之后的审批决定接在同一条链路上
+    traceparent = tracing.current_traceparent()
 
     # 写入 SQLite 数据库
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO approvals (client_id, content, base_apiurl, timestart)
-        VALUES (?, ?, ?, ?)
-    ''', (data.client_id, data.content, data.base_apiurl, timestart))
-    conn.commit()
-    conn.close()
+    with tracing.span("db.insert_approval"):
+        conn = sqlite3.connect(DB_PATH)
+        c = conn.cursor()
+        c.execute('''
+            INSERT INTO approvals (client_id, content, base_apiurl, timestart, traceparent)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (data.client_id, data.content, data.base_apiurl, timestart, traceparent))
+        conn.commit()
+        conn.close()
+    bump_approvals_version()
 
     print(f"收到来自 {data.client_id} 的审批请求：{data.content}")
     return {"status": "received", "message": "审批请求已保存"}
 
+'''示例
+curl -X POST "http://localhost:8000/approvals" \
+  -H "Content-Type: application/json" \
+  -d '{
+        "approvals": [
+          {"client_id": "client_001", "content": "申请访问内部系统", "base_apiurl": "http://127.0.0.1:8000/"},
+          {"client_id": "client_002", "content": "申请访问内部系统", "base_apiurl": "http://127.0.0.1:8000/"}
+        ]
+      }'
+'''
+# 批量接收协调器发来的审批请求，一个事务内写入；已存在的 client_id 跳过，协调器重发时不会报错
+@app.post("/approvals")
+async def receive_approvals(
+    data: ApprovalContents,
+):
+    timestart = datetime.now().isoformat()
+    traceparent = tracing.current_traceparent()
+    with tracing.span("db.insert_approvals", count=len(data.approvals)):
+        conn = sqlite3.connect(DB_PATH)
+        c = conn.cursor()
+        c.executemany('''
+            INSERT OR IGNORE INTO approvals (client_id, content, base_apiurl, timestart, traceparent)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(a.client_id, a.content, a.base_apiurl, timestart, traceparent) for a in data.approvals])
+        received = c.rowcount
+        conn.commit()
+        conn.close()
+    bump_approvals_version()
+
+    print(f"收到 {received} 条审批请求")
+    return {"status": "received", "received": received, "duplicates": len(data.approvals) - received}
+
 '''示例
 curl -X GET "http://localhost:8000/get_approvals?type=pending"
+# 分页（page 从 1 开始）
+curl -X GET "http://localhost:8000/get_approvals?type=approved&page=2&page_size=100"
+# 带上次响应的 ETag，审批表没有变化时返回 304
+curl -i -X GET "http://localhost:8000/get_approvals?type=pending" -H 'If-None-Match: "3f9c1a2b-42-pending-None-100"'
 '''
 # 接收前端的数据库查看请求
 @app.get("/get_approvals")
-async def get_approvals(type: Literal["pending", "approved"]):
+async def get_approvals(
+    request: Request,
+    type: Literal["pending", "approved"],
+    page: Optional[int] = None,     # 不指定时返回全部记录
+    page_size: int = 100,
+):
+    if (page is not None and page < 1) or page_size < 1:
+        raise HTTPException(status_code=400, detail="page 和 page_size 必须大于 0")
+    key = (type, page, page_size)
+    # 先取变更计数再查询：查询期间有写入时，缓存的结果会被下一次写入作废
+    version = _approvals_version
+    etag = approvals_etag(version, key)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    cached = _approvals_cache.get(key)
+    if cached and cached[0] == version:
+        return Response(cached[1], media_type="application/json", headers=headers)
+
+    sql = "SELECT client_id, content, base_apiurl, timestart, result, status FROM approvals WHERE status = ?"
+    params = [0 if type == "pending" else 1]
+    if page is not None:
+        sql += " ORDER BY timestart, client_id LIMIT ? OFFSET ?"
+        params += [page_size, (page - 1) * page_size]
+    # 由 SQLite 直接生成 JSON，不逐行构造字典
     conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    if type == "pending":
-        c.execute("SELECT * FROM approvals WHERE status = 0")
-    else:
-        c.execute("SELECT * FROM approvals WHERE status = 1")
-    rows = c.fetchall()
+    body = fast_json.listing_body(conn, APPROVAL_COLUMNS, sql, params)
     conn.close()
-    
-    # 将结果封装成字典列表
-    result = []
-    for row in rows:
-        result.append({
-            "client_id": row[0],
-            "content": row[1],
-            "base_apiurl": row[2],
-            "timestart": row[3],
-            "result": row[4],
-            "status": row[5],
-        })
-    
-    return {"count": len(result), "data": result}
+
+    if version == _approvals_version:
+        if len(_approvals_cache) >= APPROVALS_CACHE_SIZE:
+            _approvals_cache.clear()
+        _approvals_cache[key] = (version, body)
+    return Response(body, media_type="application/json", headers=headers)
 
 '''示例
 curl -X POST "http://localhost:8000/submit_result" \
@@ -105,30 +293,143 @@ async def submit_result(
     # 向本地数据库写入审批结果
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
+    # 查询与写入在同一个写事务中，多个进程同时提交同一审批时只有一个生效
+    c.execute("BEGIN IMMEDIATE")
     # 提取协调器地址
     c.execute('''
-        SELECT base_apiurl FROM approvals WHERE client_id = ?
+        SELECT base_apiurl, traceparent, status, result FROM approvals WHERE client_id = ?
         ''', (data.client_id,))
     row = c.fetchone()
-    url = row[0]
-    url = url + "receive_result"
+    if not row:
+        conn.close()
+        raise HTTPException(status_code=404, detail=f"未找到 {data.client_id} 的审批请求")
+    base_apiurl = row[0]
+    # 审批决定提交后不能更改：协调器只采纳每个审批服务器的第一次答复，重复提交相同的决定不再转发
+    if row[2] == 1:
+        conn.close()
+        if row[3] != data.result:
+            raise HTTPException(status_code=409, detail=f"{data.client_id} 已审批为 {row[3]}，不能更改")
+        return {"status": "ok", "message": f"审批结果已是：{data.result}"}
 
-    c.execute('''
+    # 审批决定记录在协调器发起审批的链路上
+    with tracing.span("approval.decision", row[1], client_id=data.client_id, result=data.result,
+                      request_trace_id=tracing.current_trace_id()) as decision:
+        c.execute('''
+            UPDATE approvals
+            SET result = ?, status = 1, decided_at = ?
+            WHERE client_id = ?
+        ''', (data.result, datetime.now().isoformat(), data.client_id))
+        # 与审批结果在同一事务中写入发件箱，由后台协程转发给协调器
+        outbox.enqueue(c, [(base_apiurl, data.client_id, server_url, data.result, decision.traceparent)])
+        conn.commit()
+        conn.close()
+    bump_approvals_version()
+    outbox.notify()
+    return {"status": "ok", "message": f"审批结果已更新为：{data.result}"}
+
+'''示例
+curl -X POST "http://localhost:8000/submit_decisions" \
+  -H "Content-Type: application/json" \
+  -d '{
+        "decisions": [
+          {"client_id": "client_001", "result": "yes"},
+          {"client_id": "client_002", "result": "no"}
+        ]
+      }'
+'''
+# 接收前端批量审批请求：一个事务内写入全部结果，由发件箱按协调器地址分组批量转发
+@app.post("/submit_decisions")
+async def submit_results(
+    data: ApprovalResults,
+    request: Request,
+):
+    server_url = str(request.base_url)
+    # 同一 client_id 重复提交时以最后一次为准
+    decisions = {d.client_id: d.result for d in data.decisions}
+    client_ids = list(decisions)
+
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    # 批量提取协调器地址；已审批的记录不再更改（与 submit_decision 相同）
+    base_urls = {}
+    traceparents = {}
+    found = set()
+    conflicts = []
+    for i in range(0, len(client_ids), SQL_BATCH_SIZE):
+        part = client_ids[i:i + SQL_BATCH_SIZE]
+        marks = ",".join("?" * len(part))
+        c.execute(f'''
+            SELECT client_id, base_apiurl, traceparent, status, result FROM approvals WHERE client_id IN ({marks})
+        ''', part)
+        for cid, base_apiurl, traceparent, status, result in c.fetchall():
+            found.add(cid)
+            if status == 1:
+                if result != decisions[cid]:
+                    conflicts.append(cid)
+                continue
+            base_urls[cid] = base_apiurl
+            traceparents[cid] = traceparent
+
+    # 每个审批决定记录在各自审批请求的链路上
+    request_trace_id = tracing.current_trace_id()
+    decision_spans = {
+        cid: tracing.start_span("approval.decision", traceparents[cid], client_id=cid, result=decisions[cid],
+                                request_trace_id=request_trace_id, batch_size=len(base_urls))
+        for cid in base_urls
+    }
+
+    decided_at = datetime.now().isoformat()
+    c.executemany('''
         UPDATE approvals
-        SET result = ?, status = 1
+        SET result = ?, status = 1, decided_at = ?
         WHERE client_id = ?
-    ''', (data.result, data.client_id))
+    ''', [(decisions[cid], decided_at, cid) for cid in base_urls])
+    # 与审批结果在同一事务中写入发件箱，发送协程会按协调器地址合并成批量请求
+    outbox.enqueue(c, [
+        (base_apiurl, cid, server_url, decisions[cid], decision_spans[cid].traceparent)
+        for cid, base_apiurl in base_urls.items()
+    ])
     conn.commit()
     conn.close()
-    # 将审批数据发给协调器
-    # 构造发送给协调器的数据
-    headers = {
-        "client_id": data.client_id,
-        "server_url": server_url,
-        "result": data.result
+    bump_approvals_version()
+    for decision in decision_spans.values():
+        decision.end()
+    outbox.notify()
+
+    missing = [cid for cid in client_ids if cid not in found]
+    return {
+        "status": "ok",
+        "updated": len(base_urls),
+        "missing": missing,
+        "conflicts": conflicts,
+        "message": f"已更新 {len(base_urls)} 条审批结果"
     }
-    r = requests.post(url, json=headers)
-    if r.status_code != 200:
-        raise RuntimeError(f"发送审批结果失败，协调器返回: {r.text}")
-    # Vault 返回的 plaintext 是 base64 编码过的，要解码成真正的 bytes 密钥
-    return {"status": "ok", "message": f"审批结果已更新为：{data.result}"}
\ No newline at end of file
+
+'''示例
+curl -X GET "http://localhost:8000/outbox"
+'''
+# 查看发件箱中尚未送达协调器的审批结果数量，以及被协调器拒绝、不再重试的数量
+@app.get("/outbox")
+async def get_outbox():
+    return {
+        "pending": await asyncio.to_thread(outbox.pending_count),
+        "rejected": await asyncio.to_thread(outbox.pending_count, outbox.REJECTED),
+    }
+
+'''示例
+curl -X GET "http://localhost:8000/get_archived?client_id=client_001&date_from=2025-01-01&date_to=2025-03-31"
+'''
+# 查询已归档的审批记录，日期为审批完成日期（YYYY-MM-DD）
+@app.get("/get_archived")
+async def get_archived(
+    client_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = 1000,
+):
+    filters = {"client_id": client_id} if client_id else {}
+    rows = await asyncio.to_thread(
+        retention.query_archive, ARCHIVE_DIR, "approvals", filters, date_from, date_to, limit
+    )
+    return FastJSONResponse({"count": len(rows), "data": rows})
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import uuid
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from config import DB_PATH
+
+# ---------- 去重分块仓库 ----------
+# 去重模式（encrypt_file 的 dedup 参数）下，文件按内容切分成分块，每个分块单独加密后保存在仓库目录中：
+#   {仓库目录}/{ID 前两位}/{ID}
+# 分块 ID 由仓库 DEK 对明文计算得到，同一根密钥下内容相同的分块只保存一份，数字信封中只有分块清单。
+# 每个根密钥对应一个长期不变的仓库 DEK，其 Vault 加密形式和加密算法保存在 SQLite 中；
+# 分块的元数据（明文长度、密文长度）也保存在 SQLite 中，用于统计。
+# 分块可能被多个信封引用，删除信封时不删除分块
+
+# 仓库目录，为空时不启用去重模式
+STORE_DIR = os.environ.get("ENVELOPE_CHUNK_STORE_DIR", "")
+
+def enabled() -> bool:
+    return bool(STORE_DIR)
+
+def init_store():
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS dedup_keys (
+            key_name TEXT PRIMARY KEY,
+            encrypted_key TEXT,
+            backend TEXT,
+            created_at TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chunks (
+            chunk_id TEXT PRIMARY KEY,
+            key_name TEXT,
+            size INTEGER,
+            stored_size INTEGER,
+            created_at TEXT
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+def chunk_path(chunk_id: str) -> str:
+    return os.path.join(STORE_DIR, chunk_id[:2], chunk_id)
+
+def valid_id(chunk_id: str) -> bool:
+    return len(chunk_id) == 64 and all(ch in "0123456789abcdef" for ch in chunk_id)
+
+def has(chunk_id: str) -> bool:
+    return os.path.exists(chunk_path(chunk_id))
+
+def put(chunk_id: str, blob: bytes):
+    """写入一个分块密文；先写临时文件再改名，读者不会看到写了一半的分块"""
+    dest = chunk_path(chunk_id)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = f"{dest}.{uuid.uuid4().hex}.part"
+    with open(tmp, "wb") as f:
+        f.write(blob)
+    os.replace(tmp, dest)
+
+def read(chunk_id: str) -> bytes:
+    with open(chunk_path(chunk_id), "rb") as f:
+        return f.read()
+
+def record_chunks(key_name: str, chunks: List[Tuple[str, int, int]]):
+    """一次事务记录新写入分块的 (分块 ID, 明文长度, 密文长度)"""
+    if not chunks:
+        return
+    now = datetime.now().isoformat()
+    conn = sqlite3.connect(DB_PATH)
+    conn.executemany('''
+        INSERT OR IGNORE INTO chunks (chunk_id, key_name, size, stored_size, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(chunk_id, key_name, size, stored_size, now) for chunk_id, size, stored_size in chunks])
+    conn.commit()
+    conn.close()
+
+def load_key(key_name: str) -> Optional[Tuple[str, str]]:
+    """返回根密钥对应的 (Vault 加密的仓库 DEK, 加密算法)，尚未创建时返回 None"""
+    conn = sqlite3.connect(DB_PATH)
+    row = conn.execute("SELECT encrypted_key, backend FROM dedup_keys WHERE key_name = ?", (key_name,)).fetchone()
+    conn.close()
+    return (row[0], row[1]) if row else None
+
+def save_key(key_name: str, encrypted_key: str, backend: str) -> Tuple[str, str]:
+    """保存新的仓库 DEK；其他进程已抢先保存时以已有的为准，返回最终使用的 (加密的仓库 DEK, 加密算法)"""
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute('''
+        INSERT OR IGNORE INTO dedup_keys (key_name, encrypted_key, backend, created_at)
+        VALUES (?, ?, ?, ?)
+    ''', (key_name, encrypted_key, backend, datetime.now().isoformat()))
+    conn.commit()
+    row = conn.execute("SELECT encrypted_key, backend FROM dedup_keys WHERE key_name = ?", (key_name,)).fetchone()
+    conn.close()
+    return row[0], row[1]
+
+def stats(key_name: Optional[str] = None) -> dict:
+    conn = sqlite3.connect(DB_PATH)
+    if key_name:
+        row = conn.execute('''
+            SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM chunks WHERE key_name = ?
+        ''', (key_name,)).fetchone()
+    else:
+        row = conn.execute('''
+            SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM chunks
+        ''').fetchone()
+    conn.close()
+    return {"chunks": row[0], "plaintext_bytes": row[1], "stored_bytes": row[2]}
+
+if enabled():
+    init_store()
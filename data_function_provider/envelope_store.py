@@ -0,0 +1,134 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import zipfile
+from datetime import datetime
+from typing import List, Optional
+
+import shared_path  # noqa: F401  共用模块在仓库根目录的 shared/ 中
+import envelope_format
+from config import DB_PATH
+
+# ---------- 服务端信封仓库 ----------
+# 加密结果可以不随响应返回，而是保存在服务端的仓库目录中，只返回信封 ID：
+#   {仓库目录}/{ID 前两位}/{ID}.zip
+# ID 为信封文件的 sha256，下载方可以据此校验内容，相同的信封只保存一份；
+# 元数据（根密钥名、大小、格式等）保存在 SQLite 中。下载使用 FileResponse，
+# tee 按 ID 直接取信封，大文件不再经过客户端上传下载两次
+
+# 仓库目录，为空时不启用
+STORE_DIR = os.environ.get("ENVELOPE_STORE_DIR", "")
+# 计算信封 ID 时每次读取的大小
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def enabled() -> bool:
+    return bool(STORE_DIR)
+
+def init_store():
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS envelopes (
+            envelope_id TEXT PRIMARY KEY,
+            key_name TEXT,
+            filename TEXT,
+            format TEXT,
+            size INTEGER,
+            plaintext_size INTEGER,
+            created_at TEXT
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+def envelope_path(envelope_id: str) -> str:
+    return os.path.join(STORE_DIR, envelope_id[:2], f"{envelope_id}.zip")
+
+def valid_id(envelope_id: str) -> bool:
+    return len(envelope_id) == 64 and all(ch in "0123456789abcdef" for ch in envelope_id)
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def put(zip_path: str, filename: Optional[str] = None) -> dict:
+    """
+    把已写好的信封移入仓库（zip_path 会被移走），返回元数据
+    信封刚写完仍在页缓存中，计算 ID 的这次读取不会再访问磁盘
+    """
+    if not enabled():
+        raise RuntimeError("未配置 ENVELOPE_STORE_DIR，信封仓库未启用")
+    envelope_id = file_digest(zip_path)
+    with zipfile.ZipFile(zip_path, "r") as z:
+        manifest = envelope_format.read_manifest(z)
+        key_name = z.read("key_name.txt").decode().strip()
+        plaintext_size = manifest["plaintext_size"] if manifest else None
+    record = {
+        "envelope_id": envelope_id,
+        "key_name": key_name,
+        "filename": filename,
+        "format": manifest["format"] if manifest else "luks2",
+        "size": os.path.getsize(zip_path),
+        "plaintext_size": plaintext_size,
+        "created_at": datetime.now().isoformat(),
+    }
+    dest = envelope_path(envelope_id)
+    if os.path.exists(dest):
+        # 内容相同的信封已经存在
+        os.remove(zip_path)
+    else:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # 先移到同目录下的临时名再改名，读者不会看到写了一半的文件
+        tmp = dest + ".part"
+        shutil.move(zip_path, tmp)
+        os.replace(tmp, dest)
+
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute('''
+        INSERT OR IGNORE INTO envelopes
+        (envelope_id, key_name, filename, format, size, plaintext_size, created_at)
+        VALUES (:envelope_id, :key_name, :filename, :format, :size, :plaintext_size, :created_at)
+    ''', record)
+    conn.commit()
+    conn.close()
+    return record
+
+def get(envelope_id: str) -> Optional[dict]:
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT * FROM envelopes WHERE envelope_id = ?", (envelope_id,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def list_envelopes(key_name: Optional[str] = None, limit: int = 100, offset: int = 0) -> List[dict]:
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    if key_name:
+        rows = conn.execute('''
+            SELECT * FROM envelopes WHERE key_name = ? ORDER BY created_at DESC LIMIT ? OFFSET ?
+        ''', (key_name, limit, offset)).fetchall()
+    else:
+        rows = conn.execute('''
+            SELECT * FROM envelopes ORDER BY created_at DESC LIMIT ? OFFSET ?
+        ''', (limit, offset)).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def delete(envelope_id: str) -> bool:
+    conn = sqlite3.connect(DB_PATH)
+    deleted = conn.execute("DELETE FROM envelopes WHERE envelope_id = ?", (envelope_id,)).rowcount
+    conn.commit()
+    conn.close()
+    path = envelope_path(envelope_id)
+    if os.path.exists(path):
+        os.remove(path)
+    return bool(deleted)
+
+if enabled():
+    init_store()
@@ -1,6 +1,8 @@
 from fastapi import FastAPI
 from approval_server import app as approval_router
 from vault_server import app as vault_router
+import shared_path  # noqa: F401  共用模块在仓库根目录的 shared/ 中
+import tracing
 
 import uvicorn
 
@@ -9,3 +11,5 @@ app = FastAPI()
 # 挂载两个模块，分别加上前缀
 app.include_router(approval_router, prefix="/approval", tags=["Approval Service"])
 app.include_router(vault_router, prefix="/vault", tags=["Vault Service"])
+# 链路追踪：记录每个请求并提供 /traces 查看接口
+tracing.install(app, "provider")
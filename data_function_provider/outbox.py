@@ -0,0 +1,227 @@
+import asyncio
+import random
+import sqlite3
+import time
+import traceback
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import httpx
+from config import DB_PATH
+import shared_path  # noqa: F401  共用模块在仓库根目录的 shared/ 中
+import tracing
+
+# ---------- 审批结果发件箱 ----------
+# 审批结果与发件箱记录在同一个事务中写入，由后台协程异步转发给协调器，
+# 协调器不可达时按指数退避重试，审批接口本身不再等待协调器。
+# 每个审批决定只提交一次（见 approval_server 的 submit_decision），消息按写入顺序全部转发，
+# 协调器对每个审批服务器只采纳第一次答复，结果不受消息被分在哪一批发送影响。
+# 协调器以 4xx 拒绝整批消息时逐条重发，仍被拒绝的消息标记为死信（delivered = 2），不再重试。
+# 发送协程中的数据库读写都放到线程池中执行，不阻塞事件循环
+
+# 每次最多取出的待发送消息数
+DISPATCH_BATCH_SIZE = 500
+# 没有新消息时的轮询间隔（秒）
+POLL_INTERVAL = 5.0
+# 退避时间的基数和上限（秒）
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 300.0
+# 单次请求协调器的超时时间（秒）
+REQUEST_TIMEOUT = 10.0
+# 消息状态：待发送、已送达、被协调器拒绝（死信）
+PENDING, DELIVERED, REJECTED = 0, 1, 2
+
+_wakeup = None
+_dispatcher_task = None
+
+def init_outbox(c: sqlite3.Cursor):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            base_apiurl TEXT,
+            client_id TEXT,
+            server_url TEXT,
+            result TEXT,
+            created_at TEXT,
+            attempts INTEGER DEFAULT 0,
+            next_attempt REAL DEFAULT 0,
+            last_error TEXT,
+            delivered INTEGER DEFAULT 0,
+            traceparent TEXT
+        )
+    ''')
+    # 兼容旧版本数据库：补齐链路上下文列
+    c.execute("PRAGMA table_info(outbox)")
+    if "traceparent" not in {row[1] for row in c.fetchall()}:
+        c.execute("ALTER TABLE outbox ADD COLUMN traceparent TEXT")
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (delivered, next_attempt)
+    ''')
+
+def enqueue(c: sqlite3.Cursor, messages: List[Tuple[str, str, str, str, Optional[str]]]):
+    """
+    在调用方的事务中写入待发送消息，messages 为 (base_apiurl, client_id, server_url, result, traceparent)
+    traceparent 随消息转发给协调器，使协调器的处理接在审批决定的链路上
+    需要调用方自行 commit，提交后再调用 notify() 唤醒发送协程
+    """
+    created_at = datetime.now().isoformat()
+    c.executemany('''
+        INSERT INTO outbox (base_apiurl, client_id, server_url, result, traceparent, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [m + (created_at,) for m in messages])
+
+def notify():
+    """唤醒发送协程，让刚提交的消息立即发送"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+def pending_count(state: int = PENDING) -> int:
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*) FROM outbox WHERE delivered = ?", (state,))
+    count = c.fetchone()[0]
+    conn.close()
+    return count
+
+def _load_due(now: float):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('''
+        SELECT id, base_apiurl, client_id, server_url, result, attempts, traceparent FROM outbox
+        WHERE delivered = 0 AND next_attempt <= ?
+        ORDER BY id
+        LIMIT ?
+    ''', (now, DISPATCH_BATCH_SIZE))
+    rows = c.fetchall()
+    conn.close()
+    return rows
+
+def _next_due() -> float:
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("SELECT MIN(next_attempt) FROM outbox WHERE delivered = 0")
+    row = c.fetchone()
+    conn.close()
+    return row[0]
+
+def _mark_delivered(ids: List[int]):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.executemany("UPDATE outbox SET delivered = 1 WHERE id = ?", [(i,) for i in ids])
+    conn.commit()
+    conn.close()
+
+def _mark_failed(rows, error: str):
+    now = time.time()
+    updates = []
+    for row_id, attempts in rows:
+        # 指数退避并加入随机抖动，避免协调器恢复时被同时涌入的重试压垮
+        delay = min(BACKOFF_BASE * (2 ** attempts), BACKOFF_MAX)
+        delay = delay * (0.5 + random.random() / 2)
+        updates.append((now + delay, error[:500], row_id))
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.executemany('''
+        UPDATE outbox
+        SET attempts = attempts + 1, next_attempt = ?, last_error = ?
+        WHERE id = ?
+    ''', updates)
+    conn.commit()
+    conn.close()
+
+def _mark_rejected(ids: List[int], error: str):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.executemany('''
+        UPDATE outbox
+        SET attempts = attempts + 1, delivered = ?, last_error = ?
+        WHERE id = ?
+    ''', [(REJECTED, error[:500], i) for i in ids])
+    conn.commit()
+    conn.close()
+
+def _is_rejected(status_code: int) -> bool:
+    """请求本身有误（4xx），重试也不会成功；超时和限流除外"""
+    return 400 <= status_code < 500 and status_code not in (408, 429)
+
+async def _send(client: httpx.AsyncClient, base_apiurl: str, rows: list):
+    """把一组消息作为一次批量请求发给协调器，并按结果更新消息状态"""
+    results = [
+        {"client_id": row[2], "server_url": row[3], "result": row[4], "traceparent": row[6]}
+        for row in rows
+    ]
+    try:
+        with tracing.span("outbox.dispatch", coordinator=base_apiurl, messages=len(results)):
+            r = await client.post(base_apiurl + "receive_results", json={"results": results},
+                                  headers=tracing.inject())
+    except Exception as e:
+        print(f"发送审批结果到 {base_apiurl} 失败，稍后重试: {e}")
+        await asyncio.to_thread(_mark_failed, [(row[0], row[5]) for row in rows], f"{type(e).__name__}: {e}")
+        return
+    if r.status_code == 200:
+        await asyncio.to_thread(_mark_delivered, [row[0] for row in rows])
+        return
+    error = f"协调器返回 {r.status_code}: {r.text}"
+    if not _is_rejected(r.status_code):
+        print(f"发送审批结果到 {base_apiurl} 失败，稍后重试: {error}")
+        await asyncio.to_thread(_mark_failed, [(row[0], row[5]) for row in rows], error)
+    elif len(rows) > 1:
+        # 找出被拒绝的消息，其余消息照常送达
+        for row in rows:
+            await _send(client, base_apiurl, [row])
+    else:
+        print(f"协调器 {base_apiurl} 拒绝了 {rows[0][2]} 的审批结果，不再重试: {error}")
+        await asyncio.to_thread(_mark_rejected, [rows[0][0]], error)
+
+async def _dispatch_once(client: httpx.AsyncClient) -> int:
+    rows = await asyncio.to_thread(_load_due, time.time())
+    if not rows:
+        return 0
+
+    # 按协调器地址合并消息，组内保持写入顺序
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[1], []).append(row)
+    for base_apiurl, group in groups.items():
+        await _send(client, base_apiurl, group)
+    return len(rows)
+
+async def _dispatcher():
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
+        while True:
+            try:
+                sent = await _dispatch_once(client)
+                # 本轮取满说明还有积压，立即继续
+                if sent >= DISPATCH_BATCH_SIZE:
+                    continue
+                next_due = await asyncio.to_thread(_next_due)
+            except Exception:
+                traceback.print_exc()
+                next_due = None
+            timeout = POLL_INTERVAL
+            if next_due is not None:
+                timeout = min(max(next_due - time.time(), 0.0), POLL_INTERVAL)
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+
+def start_dispatcher():
+    """在事件循环中启动发送协程（重复调用只会启动一个）"""
+    global _wakeup, _dispatcher_task
+    if _dispatcher_task is not None and not _dispatcher_task.done():
+        return
+    _wakeup = asyncio.Event()
+    _dispatcher_task = asyncio.get_running_loop().create_task(_dispatcher())
+
+async def stop_dispatcher():
+    global _dispatcher_task
+    if _dispatcher_task is None:
+        return
+    _dispatcher_task.cancel()
+    try:
+        await _dispatcher_task
+    except asyncio.CancelledError:
+        pass
+    _dispatcher_task = None
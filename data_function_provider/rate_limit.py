@@ -0,0 +1,193 @@
+import asyncio
+import collections
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# ---------- Vault 请求限速 ----------
+# 所有发往 Vault Transit 的请求先从令牌桶中取令牌：一个总令牌桶限制发往 Vault 的总速率，
+# 每个优先级类别还可以有自己的令牌桶限制该类别的速率。
+# 令牌不足时请求按类别排队，有令牌时先放行高优先级类别（同一类别内按到达顺序），
+# 批量加密最多用到自己类别的速率，不会挤占 tee 取密钥（decrypt_key）这类交互请求的额度。
+# 排队在协程中进行，不占用线程池，等待的批量请求不会让交互请求拿不到线程。
+# 各类别的排队时间（平均、p50、p95、最大）用于观察限速是否合适
+
+# 优先级类别，排在前面的优先
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = [INTERACTIVE, BULK]
+# 计算排队时间分位数时保留的最近样本数
+WAIT_SAMPLES = 1024
+
+class TokenBucket:
+    """rate 为每秒补充的令牌数，0 表示不限速；burst 为桶容量，默认为 1 秒的令牌"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self) -> bool:
+        return not self.rate or self.tokens >= 1
+
+    def take(self):
+        if self.rate:
+            self.tokens -= 1
+
+    def delay(self) -> float:
+        """距离有下一个令牌还需要的秒数"""
+        return 0.0 if self.ready() else (1 - self.tokens) / self.rate
+
+class _Waiter:
+    def __init__(self, wake):
+        self.wake = wake
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+class PriorityRateLimiter:
+    def __init__(self, rate: float = 0, burst: Optional[float] = None,
+                 classes: Optional[List[Tuple[str, float]]] = None):
+        """rate/burst 为总速率；classes 为按优先级从高到低排列的 (类别, 速率)，速率为 0 表示只受总速率限制"""
+        classes = classes or [(name, 0) for name in PRIORITIES]
+        self.total = TokenBucket(rate, burst)
+        self.buckets: Dict[str, TokenBucket] = {name: TokenBucket(r) for name, r in classes}
+        self._queues: Dict[str, collections.deque] = {name: collections.deque() for name, _ in classes}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._timer_at = None
+        self._stats = {
+            name: {"granted": 0, "queued": 0, "wait_s": 0.0, "max_wait_s": 0.0,
+                   "recent": collections.deque(maxlen=WAIT_SAMPLES)}
+            for name, _ in classes
+        }
+
+    def enabled(self) -> bool:
+        return bool(self.total.rate or any(b.rate for b in self.buckets.values()))
+
+    # 以下方法需在持有 _lock 时调用
+    def _refill(self):
+        now = time.monotonic()
+        self.total.refill(now)
+        for bucket in self.buckets.values():
+            bucket.refill(now)
+
+    def _eligible(self, name: str) -> bool:
+        return self.total.ready() and self.buckets[name].ready()
+
+    def _grant(self, name: str, waited: float):
+        self.total.take()
+        self.buckets[name].take()
+        stats = self._stats[name]
+        stats["granted"] += 1
+        stats["wait_s"] += waited
+        stats["max_wait_s"] = max(stats["max_wait_s"], waited)
+        stats["recent"].append(waited)
+
+    def _dispatch(self):
+        """按优先级放行排队的请求，还有排队时安排下一次放行的定时器"""
+        self._refill()
+        granted = True
+        while granted:
+            granted = False
+            for name, queue in self._queues.items():
+                if queue and self._eligible(name):
+                    waiter = queue.popleft()
+                    self._grant(name, time.monotonic() - waiter.enqueued)
+                    waiter.granted = True
+                    waiter.wake()
+                    granted = True
+                    break
+        delays = [max(self.total.delay(), self.buckets[name].delay()) for name, q in self._queues.items() if q]
+        if not delays:
+            return
+        at = time.monotonic() + min(delays)
+        if self._timer is None or at < self._timer_at:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(max(at - time.monotonic(), 0), self._on_timer)
+            self._timer.daemon = True
+            self._timer_at = at
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _enter(self, name: str, wake) -> Optional[_Waiter]:
+        """令牌充足且没有更高或同等优先级的请求排队时立即放行并返回 None，否则排队"""
+        if name not in self._queues:
+            raise ValueError(f"未知的优先级类别: {name}，可用: {list(self._queues)}")
+        with self._lock:
+            self._refill()
+            ahead = False
+            for other, queue in self._queues.items():
+                ahead = ahead or bool(queue)
+                if other == name:
+                    break
+            if not ahead and self._eligible(name):
+                self._grant(name, 0.0)
+                return None
+            waiter = _Waiter(wake)
+            self._queues[name].append(waiter)
+            self._stats[name]["queued"] += 1
+            self._dispatch()
+            return waiter
+
+    def _abandon(self, name: str, waiter: _Waiter):
+        with self._lock:
+            if not waiter.granted:
+                self._queues[name].remove(waiter)
+
+    def acquire(self, name: str = BULK):
+        """在线程中取一个令牌，必要时阻塞等待"""
+        event = threading.Event()
+        if self._enter(name, event.set) is not None:
+            event.wait()
+
+    async def acquire_async(self, name: str = BULK):
+        """在协程中取一个令牌，排队时不占用线程"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enter(name, wake)
+        if waiter is None:
+            return
+        try:
+            await future
+        except asyncio.CancelledError:
+            self._abandon(name, waiter)
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refill()
+            classes = {}
+            for name, stats in self._stats.items():
+                recent = sorted(stats["recent"])
+                classes[name] = {
+                    "rate": self.buckets[name].rate,
+                    "queue_depth": len(self._queues[name]),
+                    "granted": stats["granted"],
+                    "queued": stats["queued"],
+                    "avg_wait_ms": round(stats["wait_s"] / stats["granted"] * 1000, 2) if stats["granted"] else 0.0,
+                    "p50_wait_ms": round(recent[len(recent) // 2] * 1000, 2) if recent else 0.0,
+                    "p95_wait_ms": round(recent[int(len(recent) * 0.95)] * 1000, 2) if recent else 0.0,
+                    "max_wait_ms": round(stats["max_wait_s"] * 1000, 2),
+                }
+            return {
+                "enabled": self.enabled(),
+                "rate": self.total.rate,
+                "burst": self.total.burst,
+                "tokens": round(self.total.tokens, 2),
+                "classes": classes,
+            }
@@ -0,0 +1,11 @@
+import os
+import sys
+
+# 各服务共用的模块（admission、envelope_format、fast_json、luks_profiles、retention、tracing）只有一份，
+# 放在仓库根目录的 shared/ 中；导入这些模块之前先 import shared_path，把 shared/ 加入模块搜索路径。
+# 单独部署某个服务时需要一并带上 shared/ 目录，或用 SHARED_MODULES_DIR 指定它的位置
+SHARED_DIR = os.environ.get("SHARED_MODULES_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shared"
+)
+if SHARED_DIR not in sys.path:
+    sys.path.insert(0, SHARED_DIR)
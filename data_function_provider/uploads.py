@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import traceback
+import uuid
+import zipfile
+from typing import Dict, Optional
+
+import shared_path  # noqa: F401  共用模块在仓库根目录的 shared/ 中
+import envelope_format
+
+# ---------- 可续传的分块上传 ----------
+# 参照 tus 协议：先创建上传会话，再用若干次 PATCH 按偏移量追加数据，最后 finalize 取回数字信封。
+# 收到的数据立即分块加密写入会话的 zip 文件，服务端只保留不足一块的明文；
+# 连接中断时已收到的部分仍然计入偏移量，客户端查询偏移量后从断点继续上传。
+# 会话保存在进程内存中，服务重启后未完成的上传需要重新开始
+
+# 会话文件目录
+UPLOAD_DIR = os.environ.get("VAULT_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "vault_uploads"))
+# 会话在最后一次写入后保留的时间（秒），超过后视为放弃并删除
+UPLOAD_EXPIRY = float(os.environ.get("VAULT_UPLOAD_EXPIRY", "86400"))
+# PATCH 请求体累积到该大小后交给线程池加密写入
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+# 清理过期会话的间隔（秒）
+UPLOAD_REAP_INTERVAL = float(os.environ.get("VAULT_UPLOAD_REAP_INTERVAL", "600"))
+
+class UploadError(Exception):
+    """上传请求与会话状态不符，status_code 为返回给客户端的状态码"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+class UploadSession:
+    def __init__(self, encryptor: envelope_format.ChunkEncryptor, key_name: str, ciphertext_dek: str,
+                 length: Optional[int] = None):
+        self.id = uuid.uuid4().hex
+        self.key_name = key_name
+        self.ciphertext_dek = ciphertext_dek
+        self.length = length
+        self.offset = 0
+        self.created_at = time.time()
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.stream = envelope_format.IncrementalEncryptor(encryptor)
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        self.path = os.path.join(UPLOAD_DIR, f"{self.id}.zip")
+        self.zip = zipfile.ZipFile(self.path, "w", zipfile.ZIP_STORED)
+        self.data = self.zip.open(envelope_format.DATA_NAME, "w", force_zip64=True)
+
+    def write(self, data: bytes):
+        """加密并写入一段数据（在线程池中调用），返回新的偏移量"""
+        if self.length is not None and self.offset + len(data) > self.length:
+            raise UploadError(413, f"数据超出声明的长度 {self.length}")
+        self.data.write(self.stream.update(data))
+        self.offset += len(data)
+        self.updated_at = time.monotonic()
+        return self.offset
+
+    def finish(self) -> str:
+        """加密最后一块并写入信封头，返回数字信封路径"""
+        if self.length is not None and self.offset != self.length:
+            raise UploadError(409, f"上传未完成：已收到 {self.offset} 字节，共 {self.length} 字节")
+        self.data.write(self.stream.finish())
+        self.data.close()
+        manifest = self.stream.encryptor.manifest()
+        self.zip.writestr(envelope_format.MANIFEST_NAME, json.dumps(manifest))
+        self.zip.writestr("encrypted_key.txt", self.ciphertext_dek)
+        self.zip.writestr("key_name.txt", self.key_name)
+        self.zip.close()
+        return self.path
+
+    def discard(self):
+        for handle in (self.data, self.zip):
+            try:
+                handle.close()
+            except Exception:
+                pass
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def status(self) -> dict:
+        return {
+            "upload_id": self.id,
+            "key_name": self.key_name,
+            "offset": self.offset,
+            "length": self.length,
+            "created_at": self.created_at,
+            "expires_in": round(UPLOAD_EXPIRY - (time.monotonic() - self.updated_at), 1),
+        }
+
+_sessions: Dict[str, UploadSession] = {}
+_reaper_task = None
+
+def add_session(session: UploadSession) -> UploadSession:
+    _sessions[session.id] = session
+    return session
+
+def get_session(upload_id: str) -> UploadSession:
+    session = _sessions.get(upload_id)
+    if session is None:
+        raise UploadError(404, "上传会话不存在或已过期")
+    return session
+
+def remove_session(upload_id: str, discard: bool = True):
+    session = _sessions.pop(upload_id, None)
+    if session is not None and discard:
+        session.discard()
+
+def expire_sessions():
+    """删除超过 UPLOAD_EXPIRY 没有写入的会话，正在写入的会话不受影响"""
+    now = time.monotonic()
+    for upload_id, session in list(_sessions.items()):
+        if not session.lock.locked() and now - session.updated_at > UPLOAD_EXPIRY:
+            remove_session(upload_id)
+            print(f"上传会话 {upload_id} 已过期，已删除")
+
+async def _reap_periodically():
+    while True:
+        try:
+            expire_sessions()
+        except Exception:
+            traceback.print_exc()
+        await asyncio.sleep(UPLOAD_REAP_INTERVAL)
+
+def start_reaper():
+    global _reaper_task
+    if _reaper_task is None or _reaper_task.done():
+        _reaper_task = asyncio.get_running_loop().create_task(_reap_periodically())
+
+def stop_reaper():
+    global _reaper_task
+    if _reaper_task is not None:
+        _reaper_task.cancel()
+        _reaper_task = None
+    for upload_id in list(_sessions):
+        remove_session(upload_id)
@@ -1,10 +1,28 @@
-from fastapi import APIRouter, File, Form, UploadFile, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import APIRouter, File, Form, UploadFile, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from starlette.background import BackgroundTask
+from starlette.requests import ClientDisconnect
 import requests, base64, io, os, zipfile
 from config import VAULT_ADDR, VAULT_TOKEN, DB_PATH
 import subprocess
 import tempfile
 import sqlite3
+import asyncio
+import contextvars
+import hashlib, hmac, json, threading, time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import BinaryIO, List, Optional
+from pydantic import BaseModel
+import shared_path  # noqa: F401  共用模块在仓库根目录的 shared/ 中
+import admission
+import chunk_store
+import envelope_format
+import envelope_store
+import luks_profiles
+import rate_limit
+import tracing
+import uploads
 # 调试包
 import traceback
 
@@ -12,19 +30,386 @@ app = APIRouter()
 VAULT_TRANSIT_PATH = "transit"
 HEADERS = {"X-Vault-Token": VAULT_TOKEN}
 
+# 审批令牌签名密钥（与协调器共享），未配置时只能通过本地数据库校验审批结果
+APPROVAL_TOKEN_SECRET = os.environ.get("APPROVAL_TOKEN_SECRET", "")
+# 从数据库同步吊销记录的间隔（秒），即吊销在其他副本上生效的最长延迟
+REVOCATION_SYNC_INTERVAL = float(os.environ.get("TOKEN_REVOCATION_SYNC_INTERVAL", "5"))
+# 本地的已吊销令牌：jti -> 过期时间，令牌过期后自然失效，无需继续保存
+_revoked_tokens = {}
+# 已同步到的吊销记录 rowid 和同步时间
+_revocation_sync = {"rowid": 0, "at": 0.0}
+_revocation_lock = threading.Lock()
+
+# encrypt_file 默认的信封格式：luks（默认，旧版本的解密方都能读取）、aead、auto（有可用的 AEAD 算法时使用分块 AEAD）。
+# 分块 AEAD 信封需要已升级的解密方（tee、archive 客户端），可以通过环境变量或请求中的 format 参数开启
+ENVELOPE_FORMAT = os.environ.get("ENVELOPE_FORMAT", "luks")
+ENVELOPE_FORMATS = ("luks", "aead", "auto")
+# 指定 AEAD 算法和分块大小，不设置时使用启动自检选出的最快组合
+ENVELOPE_BACKEND = os.environ.get("ENVELOPE_BACKEND", "")
+ENVELOPE_CHUNK_SIZE = int(os.environ.get("ENVELOPE_CHUNK_SIZE", "0"))
+# 加密前的压缩算法（zstd、zlib），为空表示不压缩，可被请求中的 compression 参数覆盖
+ENVELOPE_COMPRESSION = os.environ.get("ENVELOPE_COMPRESSION", "")
+ENVELOPE_COMPRESSION_LEVEL = os.environ.get("ENVELOPE_COMPRESSION_LEVEL")
+# 明文摘要算法：sha256、blake3（需安装 blake3），none 表示不记录摘要
+ENVELOPE_DIGEST = os.environ.get("ENVELOPE_DIGEST", envelope_format.DEFAULT_DIGEST)
+# Transit 密钥元数据缓存的有效期（秒），过期后再次使用时重新向 Vault 查询
+KEY_CACHE_TTL = float(os.environ.get("VAULT_KEY_CACHE_TTL", "300"))
+
+# 批次主密钥：同一批次内的文件共用一个 Vault 签发的主 DEK，文件密钥在本地用 HKDF 派生。
+# 请求带 batch_id 时按批次共用；ENVELOPE_MASTER_KEY_EPOCH 大于 0 时，没有 batch_id 的请求按时间窗口（秒）共用
+MASTER_KEY_EPOCH = float(os.environ.get("ENVELOPE_MASTER_KEY_EPOCH", "0"))
+# 主 DEK 在内存中保留的最长时间（秒），过期后同一批次会重新向 Vault 申请
+MASTER_KEY_TTL = float(os.environ.get("ENVELOPE_MASTER_KEY_TTL", "3600"))
+
+# 去重模式的平均分块大小（字节），最小、最大分块分别为其 1/4 和 4 倍；0 表示使用默认值（1MiB）
+DEDUP_AVG_CHUNK_SIZE = int(os.environ.get("ENVELOPE_DEDUP_AVG_CHUNK_SIZE", "0"))
+
+# 加解密请求共用的内存预算（字节）：超过后新请求排队，排队请求达到上限或等待超时返回 429
+MEMORY_BUDGET = int(os.environ.get("VAULT_MEMORY_BUDGET", str(1024 ** 3)))
+ADMISSION_MAX_QUEUE = int(os.environ.get("VAULT_ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_MAX_WAIT = float(os.environ.get("VAULT_ADMISSION_MAX_WAIT", "30"))
+# LUKS 加密时明文、LUKS 镜像读回的密文和拼接后的密文同时在内存中，按文件大小的倍数估算
+LUKS_MEMORY_FACTOR = 3
+
+memory_budget = admission.MemoryBudget(MEMORY_BUDGET, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT, "vault")
+
+# 发往 Vault 的请求速率（次/秒），0 表示不限速；interactive 为 tee 取密钥，bulk 为加密时申请 DEK、查询和创建密钥
+VAULT_RATE_LIMIT = float(os.environ.get("VAULT_RATE_LIMIT", "0"))
+VAULT_RATE_BURST = float(os.environ.get("VAULT_RATE_BURST", "0"))
+VAULT_RATE_LIMIT_INTERACTIVE = float(os.environ.get("VAULT_RATE_LIMIT_INTERACTIVE", "0"))
+VAULT_RATE_LIMIT_BULK = float(os.environ.get("VAULT_RATE_LIMIT_BULK", "0"))
+
+vault_limiter = rate_limit.PriorityRateLimiter(VAULT_RATE_LIMIT, VAULT_RATE_BURST or None, [
+    (rate_limit.INTERACTIVE, VAULT_RATE_LIMIT_INTERACTIVE),
+    (rate_limit.BULK, VAULT_RATE_LIMIT_BULK),
+])
+
+# 启动自检结果
+crypto_state = {"benchmark": [], "selected": None, "benchmarked_at": None}
+
+# 批量解密 DEK 的请求格式
+class EncryptedKey(BaseModel):
+    key_name: str
+    encrypted_key: str
+
+class DecryptKeysRequest(BaseModel):
+    client_id: str
+    approval_token: Optional[str] = None
+    keys: List[EncryptedKey]
+
+# ---------- 审批令牌 ----------
+def _b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def parse_approval_token(token: str) -> dict:
+    """校验签名并返回令牌载荷，签名不正确时抛出 ValueError"""
+    if not APPROVAL_TOKEN_SECRET:
+        raise ValueError("未配置审批令牌密钥")
+    try:
+        body, sig = token.split(".")
+        expected = hmac.new(APPROVAL_TOKEN_SECRET.encode(), body.encode(), hashlib.sha256).digest()
+        sig_ok = hmac.compare_digest(_b64url_decode(sig), expected)
+    except Exception:
+        raise ValueError("审批令牌格式错误")
+    if not sig_ok:
+        raise ValueError("审批令牌签名无效")
+    return json.loads(_b64url_decode(body))
+
+def verify_approval_token(token: str, client_id: str, key_name: str):
+    """本地校验审批令牌，返回拒绝原因，校验通过时返回 None"""
+    try:
+        payload = parse_approval_token(token)
+    except ValueError as e:
+        return str(e)
+    if payload.get("cid") != client_id:
+        return "审批令牌与 client_id 不匹配"
+    if payload.get("exp", 0) < time.time():
+        return "审批令牌已过期"
+    keys = payload.get("keys", [])
+    if "*" not in keys and key_name not in keys:
+        return "审批令牌不允许解密该密钥"
+    if is_token_revoked(payload.get("jti")):
+        return "审批令牌已被吊销"
+    return None
+
+# ---------- 审批令牌吊销 ----------
+# 吊销记录保存在审批数据库的 revoked_tokens 表中，共用同一审批数据库的各副本都能看到。
+# 校验令牌时不逐次查询数据库：每个进程在内存中保存未过期的吊销记录，
+# 每隔 REVOCATION_SYNC_INTERVAL 秒按 rowid 增量读取新增的记录
+def init_revocations():
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            jti TEXT PRIMARY KEY,
+            exp REAL,
+            revoked_at TEXT
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+init_revocations()
+
+def sync_revocations(force: bool = False):
+    now = time.time()
+    if not force and now - _revocation_sync["at"] < REVOCATION_SYNC_INTERVAL:
+        return
+    with _revocation_lock:
+        conn = sqlite3.connect(DB_PATH)
+        rows = conn.execute(
+            "SELECT rowid, jti, exp FROM revoked_tokens WHERE rowid > ? ORDER BY rowid", (_revocation_sync["rowid"],)
+        ).fetchall()
+        conn.close()
+        for rowid, jti, exp in rows:
+            _revocation_sync["rowid"] = rowid
+            if exp >= now:
+                _revoked_tokens[jti] = exp
+        for jti, exp in list(_revoked_tokens.items()):
+            if exp < now:
+                del _revoked_tokens[jti]
+        _revocation_sync["at"] = now
+
+def is_token_revoked(jti: str) -> bool:
+    sync_revocations()
+    return jti in _revoked_tokens
+
+def revoke_approval_token(payload: dict):
+    now = time.time()
+    conn = sqlite3.connect(DB_PATH)
+    # 过期的令牌本身已失效，顺便清理其吊销记录
+    conn.execute("DELETE FROM revoked_tokens WHERE exp < ?", (now,))
+    conn.execute(
+        "INSERT OR IGNORE INTO revoked_tokens (jti, exp, revoked_at) VALUES (?, ?, ?)",
+        (payload["jti"], payload.get("exp", now), datetime.now().isoformat()),
+    )
+    conn.commit()
+    conn.close()
+    sync_revocations(force=True)
+
+def revocation_signature(jti: str) -> str:
+    """吊销请求的签名：HMAC-SHA256(审批令牌密钥, "revoke:" + jti)，只有持有密钥的协调器或管理员能吊销令牌"""
+    sig = hmac.new(APPROVAL_TOKEN_SECRET.encode(), f"revoke:{jti}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(sig).rstrip(b"=").decode()
+
+# 检查审批结果，返回拒绝原因，允许解密时返回 None
+@tracing.traced("approval.check")
+def check_approval(client_id: str, key_names: List[str], approval_token: Optional[str] = None):
+    if approval_token:
+        # 携带审批令牌时直接在本地校验，不再查询数据库
+        for key_name in key_names:
+            reason = verify_approval_token(approval_token, client_id, key_name)
+            if reason:
+                return reason
+        return None
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("SELECT result FROM approvals WHERE client_id = ?", (client_id,))
+    row = c.fetchone()
+    conn.close()
+    if not row:
+        return "未找到审批记录"
+    if (row[0] or "").lower() != "yes":
+        return "审批未通过"
+    return None
+
 # ---------- Vault 工具函数 ----------
-def create_key(key_name: str, key_type="aes256-gcm96", exportable=False):
-    """创建 Transit 密钥（存在则忽略）"""
+@tracing.traced("vault.read_key")
+def read_key(key_name: str) -> Optional[dict]:
+    """读取 Transit 密钥的元数据，不存在时返回 None，令牌没有读权限时抛出 PermissionError"""
+    url = f"{VAULT_ADDR}/v1/{VAULT_TRANSIT_PATH}/keys/{key_name}"
+    r = vault_request(requests.get, url)
+    if r.status_code == 404:
+        return None
+    if r.status_code == 403:
+        raise PermissionError(f"read_key denied: {r.text}")
+    if r.status_code != 200:
+        raise RuntimeError(f"read_key failed: {r.text}")
+    data = r.json()["data"]
+    return {"name": key_name, "type": data.get("type"), "latest_version": data.get("latest_version")}
+
+@tracing.traced("vault.create_key")
+def create_key(key_name: str, key_type="aes256-gcm96", exportable=False) -> dict:
+    """
+    创建 Transit 密钥（存在则忽略），返回密钥元数据
+    令牌策略没有 transit/keys/* 的读权限时与改版前一样直接创建，元数据中的版本号未知（None）
+    """
+    try:
+        info = read_key(key_name)
+    except PermissionError:
+        readable = False
+    else:
+        if info is not None:
+            return info
+        readable = True
     url = f"{VAULT_ADDR}/v1/{VAULT_TRANSIT_PATH}/keys/{key_name}"
     payload = {"type": key_type, "exportable": exportable}
-    r = requests.post(url, headers=HEADERS, json=payload)
+    r = vault_request(requests.post, url, json=payload)
+    # 并发创建时可能已被其他进程抢先创建
     if r.status_code not in (200, 204) and "already exists" not in r.text:
         raise RuntimeError(f"create_key failed: {r.text}")
+    if not readable:
+        return {"name": key_name, "type": key_type, "latest_version": None}
+    return read_key(key_name) or {"name": key_name, "type": key_type, "latest_version": 1}
+
+# ---------- Vault 请求限速 ----------
+# 当前线程中 Vault 操作的 [优先级类别, 已预取的令牌数]，由 vault_call 设置
+_vault_budget = contextvars.ContextVar("vault_budget", default=None)
+
+def vault_request(method, url: str, **kwargs):
+    """发出一次 Vault 请求，每次请求取一个令牌：先用 vault_call 预取的令牌，不够时在当前线程中排队"""
+    budget = _vault_budget.get()
+    if budget is not None and budget[1] > 0:
+        budget[1] -= 1
+    else:
+        priority = budget[0] if budget is not None else rate_limit.BULK
+        with tracing.span("vault.rate_limit", priority=priority):
+            vault_limiter.acquire(priority)
+    return method(url, headers=HEADERS, **kwargs)
+
+def _run_with_budget(priority: str, fn, args, kwargs):
+    token = _vault_budget.set([priority, 1])
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _vault_budget.reset(token)
+
+async def vault_call(priority: str, fn, *args, **kwargs):
+    """
+    按优先级类别取得 Vault 请求令牌后在线程池中执行 fn
+    第一个令牌在协程中排队取得，不占用线程；fn 中经 vault_request 发出的后续请求（如 create_key 的查询、创建、再查询）各自再取一个令牌
+    """
+    with tracing.span("vault.rate_limit", priority=priority):
+        await vault_limiter.acquire_async(priority)
+    return await asyncio.to_thread(_run_with_budget, priority, fn, args, kwargs)
+
+# ---------- 密钥元数据缓存 ----------
+async def single_flight(inflight: dict, key, stats: dict, fn, *args, priority: str = rate_limit.BULK):
+    """
+    限速后在线程池中执行 Vault 操作 fn(*args)；相同 key 的并发调用合并为一次，其余调用等待同一结果
+    操作在独立的任务中执行，所有调用方（包括发起的那个）都通过 shield 等待，任何一个请求被取消都不影响其他等待者
+    """
+    task = inflight.get(key)
+    if task is not None:
+        stats["coalesced"] += 1
+    else:
+        stats["misses"] += 1
+        task = asyncio.get_running_loop().create_task(vault_call(priority, fn, *args))
+        inflight[key] = task
+        task.add_done_callback(lambda t: _single_flight_done(inflight, key, t))
+    return await asyncio.shield(task)
 
+def _single_flight_done(inflight: dict, key, task: asyncio.Task):
+    if inflight.get(key) is task:
+        del inflight[key]
+    if not task.cancelled():
+        task.exception()  # 等待者都已取消时也视为已取走异常，避免告警
+
+# 密钥名 -> (元数据, 查询时间)；同一密钥的并发查询合并为一次 Vault 请求
+_key_cache = {}
+_key_inflight = {}
+key_cache_stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+async def ensure_key(key_name: str) -> dict:
+    """确保 Transit 密钥存在并返回其元数据，缓存未过期时不访问 Vault"""
+    cached = _key_cache.get(key_name)
+    if cached and time.monotonic() - cached[1] < KEY_CACHE_TTL:
+        key_cache_stats["hits"] += 1
+        return cached[0]
+    # 失败不写入缓存，下一次请求重新查询
+    info = await single_flight(_key_inflight, key_name, key_cache_stats, create_key, key_name)
+    _key_cache[key_name] = (info, time.monotonic())
+    return info
+
+def invalidate_key(key_name: Optional[str] = None):
+    """密钥在 Vault 中被删除或轮换后清除缓存，不指定密钥名时清空全部"""
+    if key_name is None:
+        _key_cache.clear()
+        _master_keys.clear()
+        _dedup_keys.clear()
+    else:
+        _key_cache.pop(key_name, None)
+        _dedup_keys.pop(key_name, None)
+        for cache_key in [k for k in _master_keys if k[0] == key_name]:
+            del _master_keys[cache_key]
+
+# ---------- 批次主密钥 ----------
+# (根密钥名, 批次) -> (明文主 DEK, Vault 加密的主 DEK, 申请时间)
+_master_keys = {}
+_master_inflight = {}
+master_key_stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+def master_key_batch(batch_id: Optional[str]) -> Optional[str]:
+    """返回请求所属的批次，不使用主密钥派生时返回 None"""
+    if batch_id:
+        return f"batch:{batch_id}"
+    if MASTER_KEY_EPOCH > 0:
+        return f"epoch:{int(time.time() // MASTER_KEY_EPOCH)}"
+    return None
+
+async def get_master_key(key_name: str, batch: str):
+    """返回批次的 (明文主 DEK, Vault 加密的主 DEK)，同一批次只向 Vault 申请一次"""
+    now = time.monotonic()
+    for cache_key in [k for k, v in _master_keys.items() if now - v[2] >= MASTER_KEY_TTL]:
+        del _master_keys[cache_key]
+    cached = _master_keys.get((key_name, batch))
+    if cached:
+        master_key_stats["hits"] += 1
+        return cached[0], cached[1]
+    plaintext, ciphertext = await single_flight(
+        _master_inflight, (key_name, batch), master_key_stats, datakey_plain, key_name
+    )
+    _master_keys.setdefault((key_name, batch), (plaintext, ciphertext, time.monotonic()))
+    plaintext, ciphertext, _ = _master_keys[(key_name, batch)]
+    return plaintext, ciphertext
+
+# ---------- 去重仓库密钥 ----------
+# 根密钥名 -> (DedupKey, Vault 加密的仓库 DEK)；仓库 DEK 长期不变，解开后一直保留在内存中
+_dedup_keys = {}
+_dedup_inflight = {}
+dedup_key_stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+def load_dedup_key(key_name: str):
+    """读取根密钥的仓库 DEK（第一次使用时向 Vault 申请并保存），返回 (DedupKey, Vault 加密的仓库 DEK)"""
+    saved = chunk_store.load_key(key_name)
+    if saved is None:
+        plaintext, ciphertext = datakey_plain(key_name)
+        saved = chunk_store.save_key(key_name, ciphertext, selected_backend()[0])
+        if saved[0] == ciphertext:
+            return envelope_format.DedupKey(plaintext, saved[1]), ciphertext
+    # 已有仓库 DEK（或被其他进程抢先创建），请 Vault 解开
+    ciphertext, backend = saved
+    plaintext = base64.b64decode(decrypt_datakeys(key_name, [ciphertext])[0])
+    return envelope_format.DedupKey(plaintext, backend), ciphertext
+
+async def get_dedup_key(key_name: str):
+    cached = _dedup_keys.get(key_name)
+    if cached:
+        dedup_key_stats["hits"] += 1
+        return cached
+    result = await single_flight(_dedup_inflight, key_name, dedup_key_stats, load_dedup_key, key_name)
+    _dedup_keys[key_name] = result
+    return result
+
+@tracing.traced("vault.decrypt_batch")
+def decrypt_datakeys(key_name: str, ciphertexts: List[str]) -> List[str]:
+    """使用 Transit 的 batch_input 一次解密同一根密钥下的多个 DEK，返回 base64 明文列表"""
+    url = f"{VAULT_ADDR}/v1/{VAULT_TRANSIT_PATH}/decrypt/{key_name}"
+    r = vault_request(requests.post, url, json={
+        "batch_input": [{"ciphertext": ct} for ct in ciphertexts]
+    })
+    if r.status_code != 200:
+        raise RuntimeError(f"decrypt_datakeys failed: {r.text}")
+    results = r.json()["data"]["batch_results"]
+    errors = [item["error"] for item in results if item.get("error")]
+    if errors:
+        raise RuntimeError(f"decrypt_datakeys failed: {errors[0]}")
+    return [item["plaintext"] for item in results]
+
+@tracing.traced("vault.datakey")
 def datakey_plain(sym_key_name: str):
     """返回 (plaintext_DEK_bytes, ciphertext_DEK_str)"""
     url = f"{VAULT_ADDR}/v1/{VAULT_TRANSIT_PATH}/datakey/plaintext/{sym_key_name}"
-    r = requests.post(url, headers=HEADERS)
+    r = vault_request(requests.post, url)
     if r.status_code != 200:
         raise RuntimeError(f"datakey_plain failed: {r.text}")
     data = r.json()["data"]
@@ -32,9 +417,11 @@ def datakey_plain(sym_key_name: str):
     return base64.b64decode(data["plaintext"]), data["ciphertext"]
 
 # ---------- Luks加密 ----------
-def encrypt_large_file(dek: bytes, plaintext: bytes):
+@tracing.traced("crypto.luks_encrypt")
+def encrypt_large_file(dek: bytes, plaintext: bytes, profile: luks_profiles.Profile):
     """
     使用 LUKS 加密大文件（不使用 losetup，避免对齐和额外空间），返回密文和独立 header
+    format 参数（PBKDF、加密算法、扇区大小）由 profile 决定，并记录在 header 中
     """
     with tempfile.TemporaryDirectory() as tmpdir:
         plain_path = os.path.join(tmpdir, "plain_data.bin")
@@ -46,39 +433,24 @@ def encrypt_large_file(dek: bytes, plaintext: bytes):
             f.write(plaintext)
         file_size = len(plaintext)
 
-        # 创建与明文等长的密文块设备，并手动512字节对齐
-        remainder = file_size % 512
-        if remainder != 0:
-            padding = 512 - remainder
-        else:
-            padding = 0
-
+        # 创建按扇区大小补齐的密文块设备；稀疏文件，不在内存中构造全零数据
         with open(luks_data_path, "wb") as f:
-            f.write(b"\x00" * (file_size + padding))
+            f.truncate(profile.padded_size(file_size))
 
         # 1. 初始化 luksFormat，直接作用于文件
-        subprocess.run([
-            "cryptsetup", "luksFormat",
-            "--type", "luks2",
-            "--header", luks_header_path,
-            "--batch-mode",
-            luks_data_path,
-            "--key-file", "-"
-        ], input=dek, check=True)
-
-        # 2. 打开 luks 文件
-        subprocess.run([
-            "cryptsetup", "open",
-            "--header", luks_header_path,
-            luks_data_path, "luks_tmp",
-            "--key-file", "-"
-        ], input=dek, check=True)
-
-        # 3. 写入明文
-        subprocess.run(["dd", f"if={plain_path}", "of=/dev/mapper/luks_tmp", "bs=1M", "status=none"], check=True)
-
-        # 4. 关闭 luks 设备
-        subprocess.run(["cryptsetup", "close", "luks_tmp"], check=True)
+        luks_profiles.luks_format(profile, luks_data_path, luks_header_path, dek)
+
+        # 2. 打开 luks 文件（LUKS 加密在线程中执行，并发请求使用不同的映射名）
+        mapper_name = luks_profiles.new_mapper_name()
+        luks_profiles.luks_open(luks_data_path, luks_header_path, mapper_name, dek)
+
+        try:
+            # 3. 写入明文
+            subprocess.run(["dd", f"if={plain_path}", f"of=/dev/mapper/{mapper_name}", "bs=1M", "status=none"],
+                           check=True)
+        finally:
+            # 4. 关闭 luks 设备
+            luks_profiles.luks_close(mapper_name)
 
         # 5. 读取密文和 header
         with open(luks_data_path, "rb") as f:
@@ -90,6 +462,174 @@ def encrypt_large_file(dek: bytes, plaintext: bytes):
         encrypted_data = file_size.to_bytes(8, byteorder="big") + encrypted_data
         return encrypted_data, header_data
 
+# ---------- 分块 AEAD 加密 ----------
+def use_aead_format(requested: Optional[str] = None) -> bool:
+    """requested 为请求指定的格式，不指定时使用 ENVELOPE_FORMAT；格式未知或不可用时抛出 ValueError"""
+    name = requested or ENVELOPE_FORMAT
+    if name not in ENVELOPE_FORMATS:
+        raise ValueError(f"未知的信封格式: {name}，可用: {', '.join(ENVELOPE_FORMATS)}")
+    if name == "luks":
+        return False
+    if name == "aead" and not envelope_format.available_backends():
+        raise ValueError("未安装 cryptography，无法使用 AEAD 信封格式")
+    return bool(envelope_format.available_backends())
+
+def selected_backend():
+    """返回新信封使用的 (算法, 分块大小)，自检完成前使用第一个可用算法和默认分块"""
+    selected = crypto_state["selected"] or {}
+    backend = ENVELOPE_BACKEND or selected.get("backend") or envelope_format.available_backends()[0]
+    chunk_size = ENVELOPE_CHUNK_SIZE or selected.get("chunk_size") or envelope_format.DEFAULT_CHUNK_SIZE
+    return backend, chunk_size
+
+def run_crypto_benchmark():
+    results = envelope_format.benchmark()
+    crypto_state["benchmark"] = results
+    crypto_state["selected"] = envelope_format.select_best(results)
+    crypto_state["benchmarked_at"] = datetime.now().isoformat()
+    print(f"加密算法自检完成，选用: {crypto_state['selected']}")
+
+def make_compressor(compression: Optional[str], level: Optional[int]):
+    """根据请求参数或环境变量创建分块压缩器，"none" 表示不压缩"""
+    codec = compression if compression is not None else ENVELOPE_COMPRESSION
+    if not codec or codec == "none":
+        return None
+    if level is None and ENVELOPE_COMPRESSION_LEVEL:
+        level = int(ENVELOPE_COMPRESSION_LEVEL)
+    return envelope_format.ChunkCompressor(codec, level)
+
+def select_digest(digest: Optional[str]) -> Optional[str]:
+    """根据请求参数或环境变量选择明文摘要算法，"none" 表示不记录摘要"""
+    name = digest if digest is not None else ENVELOPE_DIGEST
+    if not name or name == "none":
+        return None
+    envelope_format.new_digest(name)  # 提前检查算法是否可用
+    return name
+
+def new_chunk_encryptor(dek: bytes, compressor: Optional[envelope_format.ChunkCompressor] = None,
+                        digest: Optional[str] = envelope_format.DEFAULT_DIGEST,
+                        derive: bool = False) -> envelope_format.ChunkEncryptor:
+    """
+    按当前选用的算法和分块大小创建加密器
+    derive 为 True 时 dek 是批次主 DEK，文件密钥由其派生，派生参数由加密器写入信封头
+    """
+    backend, chunk_size = selected_backend()
+    derivation = None
+    if derive:
+        dek, derivation = envelope_format.derive_file_key(dek, envelope_format.get_backend(backend).key_size)
+    return envelope_format.ChunkEncryptor(dek, backend, chunk_size, compressor, digest, derivation)
+
+async def envelope_dek(key_name: str, batch_id: Optional[str], aead: bool):
+    """返回新信封使用的 (明文 DEK, Vault 加密的 DEK, 是否由主 DEK 派生)"""
+    # 批次模式（仅分块 AEAD 格式）下取批次主 DEK，文件密钥在本地派生
+    batch = master_key_batch(batch_id) if aead else None
+    if batch:
+        plaintext_dek, ciphertext_dek = await get_master_key(key_name, batch)
+        return plaintext_dek, ciphertext_dek, True
+    plaintext_dek, ciphertext_dek = await vault_call(rate_limit.BULK, datakey_plain, key_name)
+    return plaintext_dek, ciphertext_dek, False
+
+@tracing.traced("crypto.encrypt")
+def write_aead_envelope(zip_path: str, dek: bytes, ciphertext_dek: str, key_name: str, src: BinaryIO,
+                        compressor: Optional[envelope_format.ChunkCompressor] = None,
+                        digest: Optional[str] = envelope_format.DEFAULT_DIGEST,
+                        derive: bool = False):
+    """流式加密 src 并打包成数字信封，压缩（如开启）在加密前逐块进行，zip 中不再压缩"""
+    encryptor = new_chunk_encryptor(dek, compressor, digest, derive)
+    stream = envelope_format.IncrementalEncryptor(encryptor)
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as z:
+        with z.open(envelope_format.DATA_NAME, "w", force_zip64=True) as dst:
+            while True:
+                block = src.read(encryptor.chunk_size)
+                if not block:
+                    break
+                dst.write(stream.update(block))
+            dst.write(stream.finish())
+        manifest = encryptor.manifest()
+        z.writestr(envelope_format.MANIFEST_NAME, json.dumps(manifest))
+        z.writestr("encrypted_key.txt", ciphertext_dek)
+        z.writestr("key_name.txt", key_name)
+    return manifest
+
+def dedup_chunker() -> envelope_format.CDCChunker:
+    if DEDUP_AVG_CHUNK_SIZE:
+        return envelope_format.CDCChunker(DEDUP_AVG_CHUNK_SIZE // 4, DEDUP_AVG_CHUNK_SIZE, DEDUP_AVG_CHUNK_SIZE * 4)
+    return envelope_format.CDCChunker()
+
+@tracing.traced("crypto.dedup_encrypt")
+def write_recipe_envelope(zip_path: str, dedup: envelope_format.DedupKey, ciphertext_key: str, key_name: str,
+                          src: BinaryIO, compressor: Optional[envelope_format.ChunkCompressor] = None,
+                          digest: Optional[str] = envelope_format.DEFAULT_DIGEST):
+    """按内容分块，只加密、保存仓库中还没有的分块，数字信封中只写入分块清单，返回 (信封头, 统计)"""
+    new_chunks = []
+
+    def put_chunk(chunk_id: str, blob: bytes, size: int):
+        chunk_store.put(chunk_id, blob)
+        new_chunks.append((chunk_id, size, len(blob)))
+
+    manifest, recipe, stats = envelope_format.encrypt_recipe(
+        dedup, src, chunk_store.has, put_chunk, dedup_chunker(), compressor, digest
+    )
+    chunk_store.record_chunks(key_name, new_chunks)
+    # 分块清单主要是十六进制 ID，压缩存储
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr(envelope_format.MANIFEST_NAME, json.dumps(manifest))
+        z.writestr(envelope_format.RECIPE_NAME, recipe)
+        z.writestr("encrypted_key.txt", ciphertext_key)
+        z.writestr("key_name.txt", key_name)
+    return manifest, stats
+
+# 启动时在后台线程中进行加密算法自检，不阻塞服务启动
+_benchmark_started = False
+
+@app.on_event("startup")
+async def start_crypto_benchmark():
+    global _benchmark_started
+    if _benchmark_started or not envelope_format.available_backends():
+        return
+    _benchmark_started = True
+    asyncio.get_running_loop().run_in_executor(None, run_crypto_benchmark)
+
+@app.on_event("startup")
+async def start_upload_reaper():
+    uploads.start_reaper()
+
+@app.on_event("shutdown")
+async def stop_upload_reaper():
+    uploads.stop_reaper()
+
+# ---------- 内存预算 ----------
+def upload_size(file: UploadFile) -> int:
+    if file.size is not None:
+        return file.size
+    pos = file.file.tell()
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(pos)
+    return size
+
+def encrypt_memory_cost(size: int, dedup: bool, aead: bool, profile: Optional[luks_profiles.Profile] = None) -> int:
+    """估算一次加密请求占用的内存：流式格式只与分块大小有关，LUKS 格式与文件大小成正比，另加 PBKDF 的内存"""
+    if dedup:
+        # 读入的数据、与上次剩余数据拼接后的缓冲区和当前分块
+        return 2 * envelope_format.CDC_READ_SIZE + dedup_chunker().max_size
+    if aead:
+        # 明文块、压缩结果和密文块
+        return 3 * selected_backend()[1]
+    return LUKS_MEMORY_FACTOR * size + (profile.kdf_memory() if profile else 0)
+
+@asynccontextmanager
+async def admitted(size: int):
+    """申请内存预算，预算不足时排队；排队已满或等待超时返回 429，建议的重试间隔在 Retry-After 中"""
+    try:
+        await memory_budget.acquire_async(size)
+    except admission.Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        memory_budget.release(size, time.monotonic() - started)
+
 # ---------- API ----------
 '''示例
 # 加密生成数字信封
@@ -97,39 +637,362 @@ curl -X POST http://localhost:5000/encrypt_file \
   -F "file=@bigfile.tar.gz" \
   -F "sym_key_name=my-sym-key" \
   --output digital_envelope.zip
+# 加密前先压缩（仅分块 AEAD 格式）
+curl -X POST http://localhost:5000/encrypt_file \
+  -F "file=@dataset.jsonl" \
+  -F "sym_key_name=my-sym-key" \
+  -F "format=aead" \
+  -F "compression=zstd" \
+  --output digital_envelope.zip
+# 使用 blake3 记录明文摘要
+curl -X POST http://localhost:5000/encrypt_file \
+  -F "file=@bigfile.tar.gz" \
+  -F "sym_key_name=my-sym-key" \
+  -F "digest=blake3" \
+  --output digital_envelope.zip
+# 使用分块 AEAD 格式（解密方需已升级）
+curl -X POST http://localhost:5000/encrypt_file \
+  -F "file=@dataset.jsonl" \
+  -F "sym_key_name=my-sym-key" \
+  -F "format=aead" \
+  --output digital_envelope.zip
+# 同一批次的文件共用一个主 DEK，只在批次的第一个文件时访问 Vault（仅 AEAD 格式）
+curl -X POST http://localhost:5000/encrypt_file \
+  -F "file=@part-0001.csv" \
+  -F "sym_key_name=my-sym-key" \
+  -F "format=aead" \
+  -F "batch_id=dataset-2024-06-01" \
+  --output part-0001.csv.zip
+# 去重模式：按内容分块，仓库中已有的分块不再加密，信封中只有分块清单（需配置 ENVELOPE_CHUNK_STORE_DIR）
+curl -X POST http://localhost:5000/encrypt_file \
+  -F "file=@model-step-2000.safetensors" \
+  -F "sym_key_name=my-sym-key" \
+  -F "dedup=true" \
+  --output model-step-2000.zip
+# LUKS 格式指定参数组（默认按 LUKS_KEY_PROFILES / LUKS_PROFILE 选择）
+curl -X POST http://localhost:5000/encrypt_file \
+  -F "file=@bigfile.tar.gz" \
+  -F "sym_key_name=my-sym-key" \
+  -F "luks_profile=argon2-light" \
+  --output digital_envelope.zip
 '''
 @app.post("/encrypt_file")
 async def encrypt_envelope(
     file: UploadFile = File(...),
-    sym_key_name: str = Form(...)
+    sym_key_name: str = Form(...),
+    compression: Optional[str] = Form(None),        # 压缩算法：zstd、zlib、none
+    compression_level: Optional[int] = Form(None),
+    digest: Optional[str] = Form(None),             # 明文摘要算法：sha256、blake3、none
+    batch_id: Optional[str] = Form(None),           # 批次 ID，同一批次的文件共用主 DEK
+    store: bool = Form(False),                      # 保存到服务端信封仓库，只返回信封 ID
+    dedup: bool = Form(False),                      # 去重模式，相同内容的分块只加密保存一次
+    luks_profile: Optional[str] = Form(None),       # LUKS 格式的参数组：fast、adiantum、argon2-light、compat
+    requested_format: Optional[str] = Form(None, alias="format"),  # 信封格式：luks、aead、auto，不填使用 ENVELOPE_FORMAT
 ):
+    if store and not envelope_store.enabled():
+        raise HTTPException(status_code=400, detail="未配置 ENVELOPE_STORE_DIR，信封仓库未启用")
+    if dedup and batch_id:
+        raise HTTPException(status_code=400, detail="去重模式使用根密钥的仓库 DEK，不支持批次，请去掉 batch_id 或 dedup")
+    if dedup and not chunk_store.enabled():
+        raise HTTPException(status_code=400, detail="未配置 ENVELOPE_CHUNK_STORE_DIR，去重模式未启用")
+    if dedup and not envelope_format.available_backends():
+        raise HTTPException(status_code=400, detail="未安装 cryptography，无法使用去重模式")
     try:
-        # 1. 对称根密钥
-        create_key(sym_key_name)
+        profile = luks_profiles.select_profile(sym_key_name, luks_profile)
+        aead = use_aead_format(requested_format)
+        digest = select_digest(digest)
+        # 压缩只用于分块 AEAD 信封和去重信封
+        compressor = make_compressor(compression, compression_level) if aead or dedup else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if batch_id and not aead:
+        raise HTTPException(status_code=400, detail="批次模式只支持分块 AEAD 信封格式，请指定 format=aead")
+    # 按预计占用的内存申请预算，预算不足时排队，避免并发的大文件把进程内存耗尽
+    async with admitted(encrypt_memory_cost(upload_size(file), dedup, aead, profile)):
+        try:
+            # 1. 对称根密钥（使用缓存的元数据，不再每次请求都访问 Vault）
+            await ensure_key(sym_key_name)
+
+            # 去重模式：使用根密钥的仓库 DEK，不再为每个文件申请 DEK
+            if dedup:
+                dedup_key, ciphertext_key = await get_dedup_key(sym_key_name)
+                fd, zip_path = tempfile.mkstemp(suffix=".zip")
+                os.close(fd)
+                try:
+                    manifest, stats = await asyncio.to_thread(
+                        write_recipe_envelope, zip_path, dedup_key, ciphertext_key, sym_key_name, file.file,
+                        compressor, digest
+                    )
+                except Exception:
+                    os.remove(zip_path)
+                    raise
+                if store:
+                    record = await asyncio.to_thread(envelope_store.put, zip_path, file.filename)
+                    return {**record, "dedup": stats}
+                headers = {
+                    "X-Dedup-Chunks": str(stats["chunks"]),
+                    "X-Dedup-New-Chunks": str(stats["new_chunks"]),
+                    "X-Dedup-New-Bytes": str(stats["new_bytes"]),
+                }
+                return FileResponse(zip_path, media_type="application/zip", filename="digital_envelope.zip",
+                                    headers=headers, background=BackgroundTask(os.remove, zip_path))
+
+            # 2. 派生 DEK
+            plaintext_dek, ciphertext_dek, derive = await envelope_dek(sym_key_name, batch_id, aead)
 
-        # 2. 派生 DEK
-        plaintext_dek, ciphertext_dek = datakey_plain(sym_key_name)
+            # 3. 分块 AEAD 格式：边读上传文件边加密，不把整个文件读入内存
+            if aead:
+                fd, zip_path = tempfile.mkstemp(suffix=".zip")
+                os.close(fd)
+                try:
+                    await asyncio.to_thread(
+                        write_aead_envelope, zip_path, plaintext_dek, ciphertext_dek, sym_key_name, file.file,
+                        compressor, digest, derive
+                    )
+                except Exception:
+                    os.remove(zip_path)
+                    raise
+                if store:
+                    return await asyncio.to_thread(envelope_store.put, zip_path, file.filename)
+                return FileResponse(zip_path, media_type="application/zip", filename="digital_envelope.zip",
+                                    background=BackgroundTask(os.remove, zip_path))
 
-        # 3. 大文件加密
-        # 因fastapi是异步框架，而大文件读取可能会花费很多时间，为不阻塞整个线程，加await
-        raw = await file.read()
-        cipher_file, header_data = encrypt_large_file(plaintext_dek, raw)
+            # 3. 大文件加密（LUKS 格式），在线程池中执行，不阻塞其他请求
+            # 因fastapi是异步框架，而大文件读取可能会花费很多时间，为不阻塞整个线程，加await
+            raw = await file.read()
+            cipher_file, header_data = await asyncio.to_thread(encrypt_large_file, plaintext_dek, raw, profile)
+            digest_info = None
+            if digest:
+                hasher = envelope_format.new_digest(digest, envelope_format.digest_key(plaintext_dek))
+                hasher.update(raw)
+                digest_info = envelope_format.describe_digest(hasher, digest)
+            del raw
 
-        # 4. 打包数字信封
-        buf = io.BytesIO()
-        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
-            z.writestr("data.bin", cipher_file)
-            z.writestr("luks_header.bin", header_data)
-            z.writestr("encrypted_key.txt", ciphertext_dek)
-            z.writestr("key_name.txt", sym_key_name)
-        buf.seek(0)
+            # 4. 打包数字信封（密文不可压缩，data.bin 直接存储）；写入临时文件，返回响应时不再占用内存
+            fd, zip_path = tempfile.mkstemp(suffix=".zip")
+            with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as z:
+                z.writestr("data.bin", cipher_file, compress_type=zipfile.ZIP_STORED)
+                z.writestr("luks_header.bin", header_data)
+                z.writestr("encrypted_key.txt", ciphertext_dek)
+                z.writestr("key_name.txt", sym_key_name)
+                if digest_info:
+                    z.writestr(envelope_format.DIGEST_NAME, json.dumps(digest_info))
+            del cipher_file
 
-        headers = {"Content-Disposition": "attachment; filename=digital_envelope.zip"}
-        return StreamingResponse(buf, media_type="application/zip", headers=headers)
+            if store:
+                return await asyncio.to_thread(envelope_store.put, zip_path, file.filename)
+            return FileResponse(zip_path, media_type="application/zip", filename="digital_envelope.zip",
+                                headers={"X-Luks-Profile": profile.name},
+                                background=BackgroundTask(os.remove, zip_path))
 
+        except Exception as e:
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {str(e)}")
+
+# ---------- 可续传上传 ----------
+def _upload_session(upload_id: str) -> uploads.UploadSession:
+    try:
+        return uploads.get_session(upload_id)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+def _offset_headers(session: uploads.UploadSession) -> dict:
+    headers = {"Upload-Offset": str(session.offset), "Cache-Control": "no-store"}
+    if session.length is not None:
+        headers["Upload-Length"] = str(session.length)
+    return headers
+
+'''示例
+# 1. 创建上传会话（upload_length 可选，声明后 finalize 时校验长度），返回 upload_id
+curl -X POST http://localhost:5000/uploads \
+  -F "sym_key_name=my-sym-key" \
+  -F "upload_length=21474836480"
+# 2. 从当前偏移量开始上传，可以分多次 PATCH，每次带上当前偏移量
+curl -X PATCH http://localhost:5000/uploads/<upload_id> \
+  -H "Upload-Offset: 0" \
+  -H "Content-Type: application/offset+octet-stream" \
+  --data-binary @bigfile.part1
+# 3. 连接中断后查询服务端已收到的字节数，从该位置继续上传
+curl -I http://localhost:5000/uploads/<upload_id>
+# 4. 全部上传后取回数字信封
+curl -X POST http://localhost:5000/uploads/<upload_id>/finalize --output digital_envelope.zip
+# 放弃上传
+curl -X DELETE http://localhost:5000/uploads/<upload_id>
+'''
+# 创建可续传的上传会话（仅分块 AEAD 格式），参数与 encrypt_file 相同
+@app.post("/uploads", status_code=201)
+async def create_upload(
+    request: Request,
+    response: Response,
+    sym_key_name: str = Form(...),
+    upload_length: Optional[int] = Form(None),      # 文件总长度（字节）
+    compression: Optional[str] = Form(None),
+    compression_level: Optional[int] = Form(None),
+    digest: Optional[str] = Form(None),
+    batch_id: Optional[str] = Form(None),
+):
+    # 可续传上传是新接口，总是生成分块 AEAD 信封，不受 ENVELOPE_FORMAT 影响
+    if not envelope_format.available_backends():
+        raise HTTPException(status_code=400, detail="未安装 cryptography，可续传上传只支持分块 AEAD 信封格式")
+    try:
+        digest = select_digest(digest)
+        compressor = make_compressor(compression, compression_level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        await ensure_key(sym_key_name)
+        plaintext_dek, ciphertext_dek, derive = await envelope_dek(sym_key_name, batch_id, True)
+        encryptor = new_chunk_encryptor(plaintext_dek, compressor, digest, derive)
+        session = uploads.add_session(
+            uploads.UploadSession(encryptor, sym_key_name, ciphertext_dek, upload_length)
+        )
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {str(e)}")
+    response.headers.update(_offset_headers(session))
+    response.headers["Location"] = f"{str(request.url).rstrip('/')}/{session.id}"
+    return session.status()
+
+# 查询已收到的字节数（tus 风格，结果在响应头 Upload-Offset 中）
+@app.head("/uploads/{upload_id}")
+async def upload_offset(upload_id: str):
+    return Response(headers=_offset_headers(_upload_session(upload_id)))
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    return _upload_session(upload_id).status()
+
+# 追加数据：Upload-Offset 必须等于服务端当前偏移量，收到的数据立即加密写入
+@app.patch("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request):
+    session = _upload_session(upload_id)
+    offset = request.headers.get("Upload-Offset", "")
+    if not offset.isdigit():
+        raise HTTPException(status_code=400, detail="缺少 Upload-Offset 请求头")
+    if session.lock.locked():
+        raise HTTPException(status_code=409, detail="该上传会话正在被其他请求写入")
+    # 收到的数据最多累积 WRITE_BUFFER_SIZE 后写入，另有一份交给线程池的副本
+    async with session.lock, admitted(2 * uploads.WRITE_BUFFER_SIZE):
+        if int(offset) != session.offset:
+            raise HTTPException(status_code=409, detail=f"偏移量不一致，服务端当前为 {session.offset}",
+                                headers=_offset_headers(session))
+        received = bytearray()
+        try:
+            try:
+                async for piece in request.stream():
+                    received += piece
+                    if len(received) >= uploads.WRITE_BUFFER_SIZE:
+                        await asyncio.to_thread(session.write, bytes(received))
+                        received.clear()
+            except ClientDisconnect:
+                # 连接中断时已收到的部分照常写入，客户端之后从新的偏移量继续
+                pass
+            if received:
+                await asyncio.to_thread(session.write, bytes(received))
+        except uploads.UploadError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e), headers=_offset_headers(session))
+        except Exception as e:
+            # 加密或写盘出错后会话状态不可信，直接删除
+            traceback.print_exc()
+            uploads.remove_session(upload_id)
+            raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {str(e)}")
+    return Response(status_code=204, headers=_offset_headers(session))
+
+# 结束上传：加密最后一块，返回数字信封；store=true 时保存到信封仓库，只返回信封 ID
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, store: bool = False):
+    if store and not envelope_store.enabled():
+        raise HTTPException(status_code=400, detail="未配置 ENVELOPE_STORE_DIR，信封仓库未启用")
+    session = _upload_session(upload_id)
+    if session.lock.locked():
+        raise HTTPException(status_code=409, detail="该上传会话正在被其他请求写入")
+    async with session.lock:
+        try:
+            zip_path = await asyncio.to_thread(session.finish)
+        except uploads.UploadError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e), headers=_offset_headers(session))
+        except Exception as e:
+            traceback.print_exc()
+            uploads.remove_session(upload_id)
+            raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {str(e)}")
+    uploads.remove_session(upload_id, discard=False)
+    if store:
+        return await asyncio.to_thread(envelope_store.put, zip_path)
+    return FileResponse(zip_path, media_type="application/zip", filename="digital_envelope.zip",
+                        background=BackgroundTask(os.remove, zip_path))
+
+@app.delete("/uploads/{upload_id}", status_code=204)
+async def abort_upload(upload_id: str):
+    _upload_session(upload_id)
+    uploads.remove_session(upload_id)
+    return Response(status_code=204)
+
+# ---------- 信封仓库 ----------
+def _stored_envelope(envelope_id: str) -> dict:
+    if not envelope_store.enabled():
+        raise HTTPException(status_code=404, detail="未配置 ENVELOPE_STORE_DIR，信封仓库未启用")
+    record = envelope_store.get(envelope_id) if envelope_store.valid_id(envelope_id) else None
+    if record is None or not os.path.exists(envelope_store.envelope_path(envelope_id)):
+        raise HTTPException(status_code=404, detail="信封不存在")
+    return record
+
+'''示例
+# 加密后保存在服务端，只返回信封 ID
+curl -X POST http://localhost:5000/encrypt_file \
+  -F "file=@bigfile.tar.gz" \
+  -F "sym_key_name=my-sym-key" \
+  -F "store=true"
+# 查看已保存的信封
+curl -X GET "http://localhost:5000/envelopes?key_name=my-sym-key&limit=20"
+# 下载信封
+curl -X GET http://localhost:5000/envelopes/<envelope_id> --output digital_envelope.zip
+# 删除信封
+curl -X DELETE http://localhost:5000/envelopes/<envelope_id>
+'''
+@app.get("/envelopes")
+async def list_envelopes(key_name: Optional[str] = None, limit: int = 100, offset: int = 0):
+    if not envelope_store.enabled():
+        raise HTTPException(status_code=404, detail="未配置 ENVELOPE_STORE_DIR，信封仓库未启用")
+    return await asyncio.to_thread(envelope_store.list_envelopes, key_name, limit, offset)
+
+# 下载信封：FileResponse 直接从文件发送，不经过内存中的生成器
+@app.get("/envelopes/{envelope_id}")
+async def download_envelope(envelope_id: str):
+    _stored_envelope(envelope_id)
+    return FileResponse(envelope_store.envelope_path(envelope_id), media_type="application/zip",
+                        filename=f"{envelope_id}.zip", headers={"ETag": f'"{envelope_id}"'})
+
+@app.delete("/envelopes/{envelope_id}")
+async def delete_envelope(envelope_id: str):
+    _stored_envelope(envelope_id)
+    await asyncio.to_thread(envelope_store.delete, envelope_id)
+    return {"status": "deleted", "envelope_id": envelope_id}
+
+# ---------- 去重分块仓库 ----------
+'''示例
+# 分块仓库统计（可按根密钥过滤）
+curl -X GET "http://localhost:5000/chunks?key_name=my-sym-key"
+# 下载一个分块的密文（tee 解密去重信封时按清单逐个取分块）
+curl -X GET http://localhost:5000/chunks/<chunk_id> --output chunk.bin
+'''
+@app.get("/chunks")
+async def chunk_store_stats(key_name: Optional[str] = None):
+    if not chunk_store.enabled():
+        raise HTTPException(status_code=404, detail="未配置 ENVELOPE_CHUNK_STORE_DIR，去重模式未启用")
+    return {
+        **await asyncio.to_thread(chunk_store.stats, key_name),
+        "chunker": dedup_chunker().describe(),
+        "numpy": envelope_format.numpy is not None,
+        "key_stats": dedup_key_stats,
+    }
+
+@app.get("/chunks/{chunk_id}")
+async def download_chunk(chunk_id: str):
+    if not chunk_store.enabled() or not chunk_store.valid_id(chunk_id) or not chunk_store.has(chunk_id):
+        raise HTTPException(status_code=404, detail="分块不存在")
+    # 分块内容不会改变，可以长期缓存
+    return FileResponse(chunk_store.chunk_path(chunk_id), media_type="application/octet-stream",
+                        headers={"ETag": f'"{chunk_id}"', "Cache-Control": "max-age=31536000, immutable"})
 
 '''示例
 curl -X POST http://localhost:5000/decrypt_key \
@@ -143,24 +1006,15 @@ async def decrypt_envelope(
     encrypted_key: UploadFile = File(...),        # 加密后的DEK
     key_name: str = Form(...),              # 根密钥名
     client_id: str = Form(...),
+    approval_token: Optional[str] = Form(None),  # 协调器签发的审批令牌（可选）
 ):
     try:
         # === 检查审批结果 ===
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT result FROM approvals WHERE client_id = ?", (client_id,))
-        row = c.fetchone()
-        conn.close()
-
-        if not row:
+        reason = check_approval(client_id, [key_name], approval_token)
+        if reason:
             return JSONResponse(status_code=200, content={
                 "status": "rejected",
-                "message": "未找到审批记录，无法解密"
-            })
-        if row[0].lower() != "yes":
-             return JSONResponse(status_code=200, content={
-                "status": "rejected",
-                "message": "审批未通过，无法解密"
+                "message": f"{reason}，无法解密"
             })
 
         # 获取加密后的对称密钥
@@ -168,7 +1022,10 @@ async def decrypt_envelope(
 
         # 解密出明文 DEK
         url = f"{VAULT_ADDR}/v1/{VAULT_TRANSIT_PATH}/decrypt/{key_name}"
-        resp = requests.post(url, headers=HEADERS, json={"ciphertext": encrypted_dek})
+        with tracing.span("vault.decrypt", key_name=key_name):
+            # tee 取密钥属于交互请求，优先于批量加密取得令牌
+            resp = await vault_call(rate_limit.INTERACTIVE, vault_request, requests.post, url,
+                                    json={"ciphertext": encrypted_dek})
         if resp.status_code != 200:
             raise HTTPException(status_code=500, detail=f"RSA解密失败: {resp.text}")
         plaintext_dek_b64 = resp.json()["data"]["plaintext"]
@@ -182,4 +1039,147 @@ async def decrypt_envelope(
         )
     except Exception as e:
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {str(e)}")
+
+'''示例
+curl -X POST http://localhost:5000/decrypt_keys \
+  -H "Content-Type: application/json" \
+  -d '{
+    "client_id": "client_001",
+    "keys": [
+      {"key_name": "my-sym-key", "encrypted_key": "vault:v1:..."},
+      {"key_name": "my-sym-key", "encrypted_key": "vault:v1:..."}
+    ]
+  }'
+'''
+# 批量解密 DEK：一次审批检查，同一根密钥下的 DEK 合并为一次 Vault 请求，按请求顺序返回 base64 明文
+@app.post("/decrypt_keys")
+async def decrypt_keys(
+    data: DecryptKeysRequest,
+):
+    try:
+        key_names = list(dict.fromkeys(k.key_name for k in data.keys))
+        reason = check_approval(data.client_id, key_names, data.approval_token)
+        if reason:
+            return JSONResponse(status_code=200, content={
+                "status": "rejected",
+                "message": f"{reason}，无法解密"
+            })
+
+        plaintexts = [None] * len(data.keys)
+        for key_name in key_names:
+            indexes = [i for i, k in enumerate(data.keys) if k.key_name == key_name]
+            results = await vault_call(
+                rate_limit.INTERACTIVE, decrypt_datakeys, key_name, [data.keys[i].encrypted_key for i in indexes]
+            )
+            for i, plaintext in zip(indexes, results):
+                plaintexts[i] = plaintext
+        return {"status": "ok", "keys": plaintexts}
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {str(e)}")
+
+'''示例
+# signature 为 base64url(HMAC-SHA256(APPROVAL_TOKEN_SECRET, "revoke:" + jti))
+curl -X POST http://localhost:5000/revoke_token \
+  -F "approval_token=eyJjaWQiOi..." \
+  -F "signature=Xc3q..."
+'''
+# 吊销审批令牌，令牌过期前的解密请求都会被拒绝（各副本最多延迟 REVOCATION_SYNC_INTERVAL 秒生效）
+@app.post("/revoke_token")
+async def revoke_token(
+    approval_token: str = Form(...),
+    signature: str = Form(...),
+):
+    try:
+        payload = parse_approval_token(approval_token)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not hmac.compare_digest(signature, revocation_signature(payload["jti"])):
+        raise HTTPException(status_code=403, detail="吊销签名无效")
+    await asyncio.to_thread(revoke_approval_token, payload)
+    return {"status": "revoked", "jti": payload["jti"]}
+
+'''示例
+curl -X GET http://localhost:5000/key_cache
+# 密钥轮换后清除缓存
+curl -X DELETE "http://localhost:5000/key_cache?key_name=my-sym-key"
+'''
+# 查看密钥元数据缓存
+@app.get("/key_cache")
+async def get_key_cache():
+    now = time.monotonic()
+    return {
+        "ttl": KEY_CACHE_TTL,
+        "stats": key_cache_stats,
+        "in_flight": list(_key_inflight),
+        "master_keys": {
+            "epoch": MASTER_KEY_EPOCH,
+            "ttl": MASTER_KEY_TTL,
+            "stats": master_key_stats,
+            "batches": [{"key_name": k, "batch": b} for k, b in _master_keys],
+        },
+        "keys": [
+            {**info, "age": round(now - fetched_at, 1)}
+            for info, fetched_at in _key_cache.values()
+        ],
+    }
+
+@app.delete("/key_cache")
+async def clear_key_cache(key_name: Optional[str] = None):
+    invalidate_key(key_name)
+    return {"status": "ok"}
+
+'''示例
+curl -X GET http://localhost:5000/rate_limit
+'''
+# 查看 Vault 请求限速：各优先级类别的速率、排队深度和排队时间
+@app.get("/rate_limit")
+async def rate_limit_stats():
+    return vault_limiter.stats()
+
+'''示例
+curl -X GET http://localhost:5000/admission
+'''
+# 查看内存预算的使用情况和排队深度
+@app.get("/admission")
+async def admission_stats():
+    return memory_budget.stats()
+
+'''示例
+curl -X GET http://localhost:5000/luks_profiles
+'''
+# 查看 LUKS 参数组、默认参数组和按根密钥指定的参数组
+@app.get("/luks_profiles")
+async def list_luks_profiles():
+    return {
+        "default": luks_profiles.DEFAULT_PROFILE,
+        "keys": luks_profiles.KEY_PROFILES,
+        "profiles": [
+            {**profile.describe(), "format_args": profile.format_args()}
+            for profile in luks_profiles.PROFILES.values()
+        ],
+    }
+
+'''示例
+curl -X GET http://localhost:5000/crypto_backends
+'''
+# 查看已注册的加密算法、启动自检结果和新信封当前使用的格式
+@app.get("/crypto_backends")
+async def crypto_backends():
+    aead = use_aead_format()
+    backend, chunk_size = selected_backend() if aead else (None, None)
+    return {
+        "format": envelope_format.FORMAT_NAME if aead else "luks2",
+        "backend": backend,
+        "chunk_size": chunk_size,
+        "registered": envelope_format.available_backends(),
+        "codecs": envelope_format.available_codecs(),
+        "compression": ENVELOPE_COMPRESSION or None,
+        "dedup": chunk_store.enabled(),
+        "luks_profile": luks_profiles.DEFAULT_PROFILE,
+        "digest": ENVELOPE_DIGEST,
+        "digests": envelope_format.available_digests(),
+        "benchmark": crypto_state["benchmark"],
+        "benchmarked_at": crypto_state["benchmarked_at"],
+    }
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+# 审批列表序列化基准：在临时数据库中写入 N 条待审批记录，比较 get_approvals 生成响应体的三种方式
+#   dict+JSONResponse  旧实现：逐行构造字典，再用 JSONResponse（标准库 json）编码
+#   dict+orjson        SQLite 不支持 JSON 函数时的退回路径（已安装 orjson 时）
+#   sqlite-json        当前实现：SQLite 的 json_group_array / json_object 直接生成 JSON
+# 各方式都包含查询时间，取多次运行中的最小值
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "shared"))
+
+from fastapi.responses import JSONResponse
+import fast_json
+
+SQL = "SELECT client_id, content, base_apiurl, timestart, result, status FROM approvals WHERE status = ?"
+COLUMNS = ["client_id", "content", "base_apiurl", "timestart", "result", "status"]
+
+def create_db(path: str, rows: int):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE approvals (
+            client_id TEXT PRIMARY KEY, content TEXT, base_apiurl TEXT, timestart TEXT,
+            result TEXT, status INTEGER
+        )
+    ''')
+    conn.executemany("INSERT INTO approvals VALUES (?, ?, ?, ?, NULL, 0)", [
+        (f"client_{i:07d}", f"申请访问内部系统 #{i}", "http://127.0.0.1:5000/", f"2025-01-01T00:00:{i % 60:02d}.{i:06d}")
+        for i in range(rows)
+    ])
+    conn.commit()
+    return conn
+
+def dict_jsonresponse(conn) -> bytes:
+    result = []
+    for row in conn.execute(SQL, (0,)).fetchall():
+        result.append({
+            "client_id": row[0],
+            "content": row[1],
+            "base_apiurl": row[2],
+            "timestart": row[3],
+            "result": row[4],
+            "status": row[5],
+        })
+    return JSONResponse({"count": len(result), "data": result}).body
+
+def dict_orjson(conn) -> bytes:
+    rows = conn.execute(SQL, (0,)).fetchall()
+    return fast_json.dumps({"count": len(rows), "data": [dict(zip(COLUMNS, row)) for row in rows]})
+
+def sqlite_json(conn) -> bytes:
+    return fast_json.listing_body(conn, COLUMNS, SQL, (0,))
+
+METHODS = [("dict+JSONResponse", dict_jsonresponse), ("dict+orjson", dict_orjson), ("sqlite-json", sqlite_json)]
+
+def best_of(fn, conn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(conn)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="审批列表序列化基准")
+    parser.add_argument("--rows", default="1000,10000,100000", help="逗号分隔的记录数")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    methods = [(name, fn) for name, fn in METHODS if name != "dict+orjson" or fast_json.orjson is not None]
+    if not fast_json.sqlite_has_json(sqlite3.connect(":memory:")):
+        print("当前 SQLite 不支持 JSON 函数，sqlite-json 的结果即为退回路径", file=sys.stderr)
+    report = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in [int(n) for n in args.rows.split(",")]:
+            conn = create_db(os.path.join(workdir, f"bench-{rows}.db"), rows)
+            # 三种方式的输出解码后应当相同
+            expected = json.loads(dict_jsonresponse(conn))
+            for name, fn in methods[1:]:
+                assert json.loads(fn(conn)) == expected, name
+            timings = {name: best_of(fn, conn, args.repeat) for name, fn in methods}
+            size = len(sqlite_json(conn))
+            conn.close()
+            baseline = timings["dict+JSONResponse"]
+            report.append({
+                "rows": rows,
+                "bytes": size,
+                **{name: {"ms": round(t * 1000, 2), "speedup": round(baseline / t, 2)} for name, t in timings.items()},
+            })
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    names = [name for name, _ in methods]
+    print(f"{'rows':>8} {'bytes':>11} " + " ".join(f"{name:>24}" for name in names))
+    for item in report:
+        cells = [f"{item[name]['ms']:>10.2f} ms ({item[name]['speedup']:>5.2f}x)" for name in names]
+        print(f"{item['rows']:>8} {item['bytes']:>11} " + " ".join(f"{c:>24}" for c in cells))
+
+'''示例
+python loadtest/bench_json.py
+python loadtest/bench_json.py --rows 1000,10000,100000 --repeat 5 --json
+'''
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+from fastapi import FastAPI, Request, Response
+import base64, os
+
+# 压测用的模拟 Vault：只实现 Transit 引擎中被 vault_server.py 用到的接口，
+# 数据密钥的“密文”只是带前缀的 base64 明文，不具备任何安全性，仅用于压测
+
+app = FastAPI()
+
+keys = {}
+
+@app.post("/v1/transit/keys/{name}")
+async def create_key(name: str, request: Request):
+    payload = await request.json() if await request.body() else {}
+    keys.setdefault(name, payload.get("type", "aes256-gcm96"))
+    return Response(status_code=204)
+
+@app.get("/v1/transit/keys/{name}")
+async def read_key(name: str):
+    if name not in keys:
+        return Response(status_code=404)
+    return {"data": {"name": name, "type": keys[name], "latest_version": 1}}
+
+@app.post("/v1/transit/datakey/plaintext/{name}")
+async def datakey_plaintext(name: str):
+    plaintext = base64.b64encode(os.urandom(32)).decode()
+    return {"data": {"plaintext": plaintext, "ciphertext": f"vault:v1:{plaintext}"}}
+
+@app.post("/v1/transit/decrypt/{name}")
+async def decrypt(name: str, request: Request):
+    payload = await request.json()
+    if "batch_input" in payload:
+        return {"data": {"batch_results": [
+            {"plaintext": item["ciphertext"].split(":", 2)[-1]} for item in payload["batch_input"]
+        ]}}
+    return {"data": {"plaintext": payload["ciphertext"].split(":", 2)[-1]}}
@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+# 端到端压测：在本地临时端口上启动模拟 Vault、协调器、N 个数据/函数提供方和 tee，
+# 模拟大量发起方并发走完 审批发起 -> 人工审批 -> 查询结果 -> tee 申请解密密钥 的完整流程，
+# 统计整体吞吐量、各环节延迟分位数和错误率
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROVIDER_DIR = os.path.join(ROOT, "data_function_provider")
+OTHER_PARTIES_DIR = os.path.join(ROOT, "Other parties")
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+HOPS = ["start_approval", "submit_decision", "get_results", "decrypt_datakey", "flow"]
+KEY_NAME = "loadtest-key"
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)
+    return values[k]
+
+class Cluster:
+    """管理压测用到的所有服务进程"""
+
+    def __init__(self, providers: int, workdir: str, token_secret: str, log_level: str):
+        self.providers = providers
+        self.workdir = workdir
+        self.token_secret = token_secret
+        self.log_level = log_level
+        self.procs = []
+        self.vault_url = None
+        self.coordinator_url = None
+        self.provider_urls = []
+        self.tee_url = None
+
+    def _spawn(self, name: str, module: str, cwd: str, pythonpath, env=None):
+        port = free_port()
+        proc_env = dict(os.environ)
+        proc_env["PYTHONPATH"] = os.pathsep.join(pythonpath)
+        proc_env["APPROVAL_TOKEN_SECRET"] = self.token_secret
+        proc_env.update(env or {})
+        log = open(os.path.join(self.workdir, f"{name}.log"), "w")
+        proc = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", module,
+            "--host", "127.0.0.1", "--port", str(port),
+            "--log-level", self.log_level,
+        ], cwd=cwd, env=proc_env, stdout=log, stderr=subprocess.STDOUT)
+        self.procs.append(proc)
+        return f"http://127.0.0.1:{port}"
+
+    def start(self):
+        self.vault_url = self._spawn("vault", "fake_vault:app", self.workdir, [LOADTEST_DIR])
+
+        coordinator_dir = os.path.join(self.workdir, "coordinator")
+        os.makedirs(coordinator_dir)
+        self.coordinator_url = self._spawn("coordinator", "coordinator:app", coordinator_dir, [OTHER_PARTIES_DIR])
+
+        for i in range(self.providers):
+            provider_dir = os.path.join(self.workdir, f"provider{i}")
+            os.makedirs(provider_dir)
+            # 每个提供方使用独立的 config.py 和数据库
+            with open(os.path.join(provider_dir, "config.py"), "w") as f:
+                f.write(f'VAULT_ADDR = "{self.vault_url}"\n')
+                f.write('VAULT_TOKEN = "loadtest"\n')
+                f.write(f'DB_PATH = {os.path.join(provider_dir, "approval.db")!r}\n')
+            self.provider_urls.append(
+                self._spawn(f"provider{i}", "main:app", provider_dir, [provider_dir, PROVIDER_DIR])
+            )
+
+        tee_dir = os.path.join(self.workdir, "tee")
+        os.makedirs(tee_dir)
+        self.tee_url = self._spawn("tee", "tee:app", tee_dir, [OTHER_PARTIES_DIR], {
+            "VAULT_PROVIDER_URL": self.provider_urls[0] + "/vault/decrypt_key",
+        })
+
+    async def wait_ready(self, timeout: float = 30.0):
+        urls = [self.vault_url, self.coordinator_url, self.tee_url] + self.provider_urls
+        deadline = time.time() + timeout
+        async with httpx.AsyncClient() as client:
+            for url in urls:
+                while True:
+                    try:
+                        await client.get(url + "/openapi.json")
+                        break
+                    except httpx.TransportError:
+                        if time.time() > deadline:
+                            raise RuntimeError(f"服务启动超时: {url}，日志见 {self.workdir}")
+                        await asyncio.sleep(0.2)
+
+    def stop(self):
+        for proc in self.procs:
+            proc.terminate()
+        for proc in self.procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+class Stats:
+    def __init__(self):
+        self.latencies = {hop: [] for hop in HOPS}
+        self.errors = {hop: 0 for hop in HOPS}
+        self.retries = {hop: 0 for hop in HOPS}
+
+    def report(self, elapsed: float, args) -> dict:
+        flows = len(self.latencies["flow"])
+        hops = {}
+        for hop in HOPS:
+            values = self.latencies[hop]
+            total = len(values) + self.errors[hop]
+            hops[hop] = {
+                "count": len(values),
+                "errors": self.errors[hop],
+                "error_rate": self.errors[hop] / total if total else 0.0,
+                "retries": self.retries[hop],
+                "p50_ms": percentile(values, 50),
+                "p90_ms": percentile(values, 90),
+                "p99_ms": percentile(values, 99),
+                "max_ms": max(values) if values else None,
+            }
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "config": {
+                "clients": args.clients,
+                "concurrency": args.concurrency,
+                "providers": args.providers,
+            },
+            "elapsed_s": elapsed,
+            "throughput_flows_per_s": flows / elapsed if elapsed else 0.0,
+            "hops": hops,
+        }
+
+async def timed(stats: Stats, hop: str, coro):
+    start = time.perf_counter()
+    try:
+        result = await coro
+    except Exception:
+        stats.errors[hop] += 1
+        raise
+    stats.latencies[hop].append((time.perf_counter() - start) * 1000)
+    return result
+
+async def run_flow(client: httpx.AsyncClient, cluster: Cluster, stats: Stats, client_id: str,
+                   encrypted_key: str, poll_interval: float, flow_timeout: float):
+    flow_start = time.perf_counter()
+    deadline = time.time() + flow_timeout
+
+    async def start():
+        r = await client.post(cluster.coordinator_url + "/start_approval", json={
+            "client_id": client_id,
+            "server_urls": cluster.provider_urls,
+            "content": "loadtest",
+            "key_names": [KEY_NAME],
+        })
+        r.raise_for_status()
+        return r.json()["result_secret"]
+
+    async def decide(provider_url: str):
+        # 审批通知由协调器在后台发送，提供方尚未收到时返回 404，稍后重试
+        while True:
+            r = await client.post(provider_url + "/approval/submit_decision", json={
+                "client_id": client_id, "result": "yes",
+            })
+            if r.status_code != 404:
+                r.raise_for_status()
+                return
+            if time.time() > deadline:
+                raise TimeoutError("等待审批请求送达超时")
+            stats.retries["submit_decision"] += 1
+            await asyncio.sleep(poll_interval)
+
+    async def results(result_secret):
+        # 审批结果由提供方的发件箱异步转发给协调器，轮询直到最终结果写入
+        while True:
+            r = await client.get(f"{cluster.coordinator_url}/get_results/{client_id}",
+                                 headers={"X-Result-Secret": result_secret})
+            r.raise_for_status()
+            body = r.json()
+            if body["results"] and body["results"][0] is not None:
+                return body.get("token")
+            if time.time() > deadline:
+                raise TimeoutError("等待审批最终结果超时")
+            stats.retries["get_results"] += 1
+            await asyncio.sleep(poll_interval)
+
+    async def decrypt(token):
+        data = {"key_name": KEY_NAME, "client_id": client_id}
+        if token:
+            data["approval_token"] = token
+        r = await client.post(cluster.tee_url + "/decrypt_datakey",
+                              files={"encrypted_key": ("encrypted_key.txt", encrypted_key.encode())},
+                              data=data)
+        r.raise_for_status()
+
+    try:
+        result_secret = await timed(stats, "start_approval", start())
+        await asyncio.gather(*[
+            timed(stats, "submit_decision", decide(url)) for url in cluster.provider_urls
+        ])
+        token = await timed(stats, "get_results", results(result_secret))
+        await timed(stats, "decrypt_datakey", decrypt(token))
+    except Exception:
+        stats.errors["flow"] += 1
+        return
+    stats.latencies["flow"].append((time.perf_counter() - flow_start) * 1000)
+
+async def run(args, cluster: Cluster) -> dict:
+    await cluster.wait_ready()
+    stats = Stats()
+    limits = httpx.Limits(max_connections=args.concurrency * (args.providers + 1))
+    async with httpx.AsyncClient(timeout=args.request_timeout, limits=limits) as client:
+        # 先向模拟 Vault 申请一个数据密钥，所有流程都用它的密文向 tee 申请解密
+        r = await client.post(f"{cluster.vault_url}/v1/transit/datakey/plaintext/{KEY_NAME}")
+        encrypted_key = r.json()["data"]["ciphertext"]
+
+        run_id = datetime.now().strftime("%H%M%S")
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(i):
+            async with semaphore:
+                await run_flow(client, cluster, stats, f"lt-{run_id}-{i}", encrypted_key,
+                               args.poll_interval, args.flow_timeout)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(args.clients)])
+        elapsed = time.perf_counter() - start
+    return stats.report(elapsed, args)
+
+def print_report(report: dict, baseline: dict = None):
+    print(f"\n并发客户端: {report['config']['clients']}  并发度: {report['config']['concurrency']}  "
+          f"提供方: {report['config']['providers']}")
+    line = f"耗时: {report['elapsed_s']:.2f}s  吞吐量: {report['throughput_flows_per_s']:.1f} 流程/s"
+    if baseline:
+        old = baseline["throughput_flows_per_s"]
+        if old:
+            line += f"  (基线 {old:.1f}，{(report['throughput_flows_per_s'] / old - 1) * 100:+.1f}%)"
+    print(line)
+    print(f"{'环节':<18}{'成功':>8}{'错误率':>9}{'重试':>8}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    fmt = lambda v: f"{v:>10.1f}" if v is not None else f"{'-':>10}"
+    for hop, h in report["hops"].items():
+        print(f"{hop:<18}{h['count']:>8}{h['error_rate'] * 100:>8.2f}%{h['retries']:>8}"
+              f"{fmt(h['p50_ms'])}{fmt(h['p90_ms'])}{fmt(h['p99_ms'])}{fmt(h['max_ms'])}")
+        if baseline and hop in baseline["hops"]:
+            old = baseline["hops"][hop]
+            print(f"{'  基线':<18}{old['count']:>8}{old['error_rate'] * 100:>8.2f}%{old['retries']:>8}"
+                  f"{fmt(old['p50_ms'])}{fmt(old['p90_ms'])}{fmt(old['p99_ms'])}{fmt(old['max_ms'])}")
+
+'''示例
+python loadtest/run_loadtest.py --clients 2000 --concurrency 200 --providers 3 --output report.json
+# 与上一次的结果对比
+python loadtest/run_loadtest.py --clients 2000 --concurrency 200 --providers 3 --compare report.json
+'''
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="审批 -> 协调器 -> 密钥释放 -> tee 全流程压测")
+    parser.add_argument("--clients", type=int, default=1000, help="模拟的发起方总数")
+    parser.add_argument("--concurrency", type=int, default=100, help="同时进行中的流程数")
+    parser.add_argument("--providers", type=int, default=3, help="数据/函数提供方实例个数")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="轮询间隔（秒）")
+    parser.add_argument("--flow-timeout", type=float, default=60.0, help="单个流程的超时时间（秒）")
+    parser.add_argument("--request-timeout", type=float, default=30.0, help="单个请求的超时时间（秒）")
+    parser.add_argument("--output", help="将结果写入 JSON 文件")
+    parser.add_argument("--compare", help="与之前输出的 JSON 结果对比")
+    parser.add_argument("--workdir", help="服务进程的工作目录（默认使用临时目录，结束后删除）")
+    parser.add_argument("--log-level", default="warning", help="各服务的 uvicorn 日志级别")
+    args = parser.parse_args()
+
+    tmp = None
+    workdir = args.workdir
+    if workdir is None:
+        tmp = tempfile.TemporaryDirectory(prefix="loadtest-")
+        workdir = tmp.name
+    os.makedirs(workdir, exist_ok=True)
+
+    cluster = Cluster(args.providers, workdir, "loadtest-secret", args.log_level)
+    try:
+        cluster.start()
+        report = asyncio.run(run(args, cluster))
+    finally:
+        cluster.stop()
+        if tmp is not None:
+            tmp.cleanup()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {args.output}")
@@ -0,0 +1,196 @@
+import asyncio
+import collections
+import math
+import threading
+import time
+from typing import Optional
+
+# ---------- 内存预算与准入控制 ----------
+# 进程内所有加解密请求共用一个内存预算：每个请求开始前按预计占用的内存申请字节数，
+# 预算不足时按到达顺序排队，排队人数达到上限或等待超时时拒绝（调用方返回 429 和 Retry-After），
+# 服务在高负载下变慢或拒绝新请求，而不是整个进程因内存耗尽被杀掉、丢失所有进行中的请求。
+# 单个请求超过整个预算时，在没有其他请求进行时仍允许执行，避免永远等待。
+# 同时支持协程（acquire_async）和线程（acquire）两种等待方式。
+
+# 估算 Retry-After 时使用的平均占用时间的平滑系数
+HOLD_TIME_SMOOTHING = 0.2
+
+class Overloaded(Exception):
+    """预算不足且无法排队，retry_after 为建议的重试间隔（秒）"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class _Waiter:
+    def __init__(self, size: int, wake):
+        self.size = size
+        self.wake = wake
+        self.granted = False
+
+class MemoryBudget:
+    def __init__(self, limit: int, max_queue: int = 64, max_wait: Optional[float] = 30.0, name: str = "memory"):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.name = name
+        self.in_flight = 0
+        self.active = 0
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+        self._hold_time = 0.0
+        self.stats_counters = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0, "max_wait_s": 0.0}
+
+    # 以下方法需在持有 _lock 时调用
+    def _fits(self, size: int) -> bool:
+        return self.in_flight == 0 or self.in_flight + size <= self.limit
+
+    def _admit(self, size: int):
+        self.in_flight += size
+        self.active += 1
+        self.stats_counters["admitted"] += 1
+
+    def _grant_waiters(self):
+        # 严格按到达顺序放行，排在前面的大请求不会被后来的小请求饿死
+        while self._waiters and self._fits(self._waiters[0].size):
+            waiter = self._waiters.popleft()
+            self._admit(waiter.size)
+            waiter.granted = True
+            waiter.wake()
+
+    def _retry_after(self) -> int:
+        # 按平均占用时间和排在前面的请求数粗略估计
+        estimate = self._hold_time * (len(self._waiters) + 1) / max(self.active, 1)
+        return max(1, min(60, math.ceil(estimate)))
+
+    def _enter(self, size: int, wake, bounded: bool) -> Optional[_Waiter]:
+        """能立即执行时返回 None，否则加入队列并返回等待者；bounded 为 True 且队列已满时抛出 Overloaded"""
+        with self._lock:
+            if not self._waiters and self._fits(size):
+                self._admit(size)
+                return None
+            if bounded and len(self._waiters) >= self.max_queue:
+                self.stats_counters["rejected"] += 1
+                raise Overloaded(f"{self.name} 预算已满，排队请求已达上限 {self.max_queue}", self._retry_after())
+            waiter = _Waiter(size, wake)
+            self._waiters.append(waiter)
+            self.stats_counters["queued"] += 1
+            return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """等待超时或被取消：仍在队列中时移出并返回 True；已被放行时返回 False"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._waiters.remove(waiter)
+            # 队首离开后后面的请求可能已经放得下
+            self._grant_waiters()
+            self.stats_counters["timeouts"] += 1
+            return True
+
+    def _waited(self, started: float):
+        waited = time.monotonic() - started
+        with self._lock:
+            self.stats_counters["max_wait_s"] = max(self.stats_counters["max_wait_s"], round(waited, 3))
+
+    def _timeout_error(self) -> Overloaded:
+        with self._lock:
+            retry_after = self._retry_after()
+        return Overloaded(f"{self.name} 预算已满，等待超过 {self.max_wait} 秒", retry_after)
+
+    def acquire(self, size: int, timeout: Optional[float] = -1, bounded: bool = True):
+        """
+        在线程中申请 size 字节，必要时阻塞排队；timeout 为 -1 时使用 max_wait，None 表示一直等待；
+        bounded 为 False 时不受排队人数限制，用于已经接受的请求中的后续工作
+        """
+        timeout = self.max_wait if timeout == -1 else timeout
+        event = threading.Event()
+        waiter = self._enter(size, event.set, bounded)
+        if waiter is None:
+            return
+        started = time.monotonic()
+        if not event.wait(timeout) and self._abandon(waiter):
+            raise self._timeout_error()
+        self._waited(started)
+
+    async def acquire_async(self, size: int, timeout: Optional[float] = -1, bounded: bool = True):
+        """在协程中申请 size 字节，排队时不占用线程"""
+        timeout = self.max_wait if timeout == -1 else timeout
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enter(size, wake, bounded)
+        if waiter is None:
+            return
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                raise self._timeout_error()
+        except asyncio.CancelledError:
+            # 客户端断开：还在排队就退出队列，已被放行则归还预算
+            if not self._abandon(waiter):
+                self.release(size)
+            raise
+        self._waited(started)
+
+    def release(self, size: int, held: Optional[float] = None):
+        with self._lock:
+            self.in_flight -= size
+            self.active -= 1
+            if held is not None:
+                self._hold_time += (held - self._hold_time) * HOLD_TIME_SMOOTHING
+            self._grant_waiters()
+
+    def overloaded(self) -> Optional[Overloaded]:
+        """排队请求已达上限时返回对应的异常（不申请预算），用于在开始流式响应前提前拒绝"""
+        with self._lock:
+            if len(self._waiters) >= self.max_queue:
+                self.stats_counters["rejected"] += 1
+                return Overloaded(f"{self.name} 预算已满，排队请求已达上限 {self.max_queue}", self._retry_after())
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "limit": self.limit,
+                "in_flight_bytes": self.in_flight,
+                "active": self.active,
+                "queue_depth": len(self._waiters),
+                "queued_bytes": sum(w.size for w in self._waiters),
+                "max_queue": self.max_queue,
+                "max_wait": self.max_wait,
+                "avg_hold_s": round(self._hold_time, 3),
+                **self.stats_counters,
+            }
+
+class Reservation:
+    """with / async with 方式使用预算，退出时归还并记录占用时间"""
+
+    def __init__(self, budget: MemoryBudget, size: int, timeout: Optional[float] = -1, bounded: bool = True):
+        self.budget = budget
+        self.size = size
+        self.timeout = timeout
+        self.bounded = bounded
+        self.started = None
+
+    def __enter__(self):
+        self.budget.acquire(self.size, self.timeout, self.bounded)
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.budget.release(self.size, time.monotonic() - self.started)
+
+    async def __aenter__(self):
+        await self.budget.acquire_async(self.size, self.timeout, self.bounded)
+        self.started = time.monotonic()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.budget.release(self.size, time.monotonic() - self.started)
@@ -0,0 +1,1081 @@
+import collections
+import hashlib
+import hmac
+import io
+import json
+import os
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, List, Optional
+
+# ---------- 分块 AEAD 数字信封 ----------
+# 数字信封 zip 包中的文件：
+#   envelope.json      信封头：格式、加密算法、分块大小、随机 nonce 前缀、明文长度等
+#   data.bin           密文帧序列（不压缩存储），每帧 = 帧头(密文长度 4 字节 + 标志 1 字节) + 密文(含 16 字节认证标签)
+#                      开启压缩时逐块先压缩再加密，压缩过的块带 FLAG_COMPRESSED 标志，不可压缩的块原样加密
+#   encrypted_key.txt  Vault 加密后的 DEK
+#   key_name.txt       Vault 根密钥名
+#   digest.json        （仅 LUKS 信封）明文摘要，AEAD 信封的明文摘要记录在 envelope.json 中
+# 第 i 帧的 nonce = nonce 前缀(4 字节) + i(8 字节大端)，附加认证数据 = 帧头 + i + 信封头绑定值，
+# 帧的顺序、截断和标志位都受认证保护；最后一帧带 FLAG_LAST 标志，防止整帧截断。
+# 信封头绑定值（版本 2 起）：每帧绑定加密前已确定的字段（算法、分块大小、nonce 前缀、压缩、密钥派生参数）的 SHA-256，
+# 最后一帧再绑定加密结束时才确定的字段（块数、明文长度、压缩统计、明文摘要），
+# 修改 envelope.json 中的任何字段都会导致认证失败；版本 2 的信封头不允许出现其他字段。
+# 每个信封使用独立的 DEK，nonce 不会重复。
+# 批次模式下 encrypted_key.txt 中是整批文件共用的主 DEK，信封头的 key_derivation 记录派生参数，
+# 每个文件的密钥 = HKDF-SHA256(主 DEK, salt=文件 ID, info)，解密方解开一次主 DEK 即可派生整批文件的密钥。
+# 加密时在同一遍读取中计算明文摘要（sha256 或 blake3），解密时边写出明文边校验，
+# 端到端校验不需要再读一遍文件；没有记录摘要的旧信封不校验。
+# 摘要是带密钥的（HMAC-SHA256 或 blake3 keyed 模式，密钥 = HKDF(文件密钥, info=DIGEST_KEY_INFO)），
+# 不掌握 DEK 无法由摘要确认明文内容，也无法为篡改后的明文伪造摘要；旧信封中不带密钥的摘要仍可校验。
+# 去重信封（cdc-recipe）不含密文，只有分块清单 recipe.json，分块密文保存在提供方的分块仓库中，见“内容定义分块去重”。
+# 没有 envelope.json 的信封是旧版 LUKS 格式。
+
+try:
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+except ImportError:  # 未安装 cryptography 时只能使用 LUKS 格式
+    AESGCM = ChaCha20Poly1305 = HKDF = None
+
+try:
+    import zstandard
+except ImportError:  # 未安装 zstandard 时只能使用 zlib 压缩
+    zstandard = None
+
+try:
+    import blake3
+except ImportError:  # 未安装 blake3 时只能使用 sha256 摘要
+    blake3 = None
+
+try:
+    import numpy
+except ImportError:  # 未安装 numpy 时内容定义分块逐字节计算滚动哈希（较慢）
+    numpy = None
+
+FORMAT_NAME = "aead-chunked"
+FORMAT_VERSION = 2
+MANIFEST_NAME = "envelope.json"
+DATA_NAME = "data.bin"
+DIGEST_NAME = "digest.json"
+
+FRAME_HEADER = struct.Struct(">IB")
+FLAG_LAST = 0x01
+FLAG_COMPRESSED = 0x02
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 4
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# 自检时测试的分块大小
+CHUNK_SIZES = [64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+# 自检时每个组合加密的数据量
+BENCHMARK_BYTES = 32 * 1024 * 1024
+# 吞吐量差距在此比例以内时优先选择更小的分块（占用内存更少）
+BENCHMARK_TOLERANCE = 0.05
+
+# 判断可压缩性时从每块中抽取的样本个数和样本大小
+SAMPLE_COUNT = 4
+SAMPLE_SIZE = 4096
+# 压缩后仍大于原大小的该比例时视为不可压缩，原样存储
+COMPRESS_MIN_RATIO = 0.9
+
+class Backend:
+    """一种 AEAD 加密算法"""
+
+    def __init__(self, name: str, key_size: int, factory: Callable[[bytes], object]):
+        self.name = name
+        self.key_size = key_size
+        self.factory = factory
+
+    def cipher(self, key: bytes):
+        if len(key) != self.key_size:
+            raise ValueError(f"{self.name} 需要 {self.key_size} 字节密钥，实际为 {len(key)} 字节")
+        return self.factory(key)
+
+# 已注册的加密算法，解密时按信封头中的名字查找
+BACKENDS: Dict[str, Backend] = {}
+
+def register_backend(backend: Backend):
+    BACKENDS[backend.name] = backend
+
+if AESGCM is not None:
+    register_backend(Backend("aes-256-gcm", 32, AESGCM))
+    register_backend(Backend("chacha20-poly1305", 32, ChaCha20Poly1305))
+
+def available_backends() -> List[str]:
+    return list(BACKENDS)
+
+def get_backend(name: str) -> Backend:
+    if name not in BACKENDS:
+        raise ValueError(f"不支持的加密算法: {name}，可用: {available_backends()}")
+    return BACKENDS[name]
+
+# ---------- 压缩 ----------
+class Codec:
+    """一种压缩算法，compressor(level) 返回压缩函数，decompress(data, max_size) 解压"""
+
+    def __init__(self, name: str, default_level: int, compressor: Callable, decompress: Callable):
+        self.name = name
+        self.default_level = default_level
+        self.compressor = compressor
+        self.decompress = decompress
+
+def _zlib_decompress(data: bytes, max_size: int) -> bytes:
+    d = zlib.decompressobj()
+    out = d.decompress(data, max_size)
+    if d.unconsumed_tail or not d.eof:
+        raise ValueError("解压结果超过分块大小")
+    return out
+
+def _zstd_compressor(level: int):
+    return zstandard.ZstdCompressor(level=level).compress
+
+def _zstd_decompress(data: bytes, max_size: int) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(data, max_output_size=max_size)
+
+# 已注册的压缩算法，解压时按信封头中的名字查找
+CODECS: Dict[str, Codec] = {}
+
+def register_codec(codec: Codec):
+    CODECS[codec.name] = codec
+
+register_codec(Codec("zlib", 6, lambda level: lambda data: zlib.compress(data, level), _zlib_decompress))
+if zstandard is not None:
+    register_codec(Codec("zstd", 3, _zstd_compressor, _zstd_decompress))
+
+def available_codecs() -> List[str]:
+    return list(CODECS)
+
+def get_codec(name: str) -> Codec:
+    if name not in CODECS:
+        raise ValueError(f"不支持的压缩算法: {name}，可用: {available_codecs()}")
+    return CODECS[name]
+
+# ---------- 密钥派生 ----------
+KDF_NAME = "hkdf-sha256"
+KDF_INFO = "envelope-file-key/v1"
+FILE_ID_SIZE = 16
+
+def _hkdf(master_key: bytes, derivation: dict, length: int) -> bytes:
+    if HKDF is None:
+        raise RuntimeError("未安装 cryptography，无法派生文件密钥")
+    if derivation.get("kdf") != KDF_NAME:
+        raise ValueError(f"不支持的密钥派生算法: {derivation.get('kdf')}")
+    return HKDF(
+        algorithm=hashes.SHA256(), length=length,
+        salt=bytes.fromhex(derivation["file_id"]), info=derivation["info"].encode(),
+    ).derive(master_key)
+
+def derive_file_key(master_key: bytes, length: int = 32, file_id: Optional[bytes] = None):
+    """由批次主 DEK 派生单个文件的密钥，返回 (文件密钥, 写入信封头的派生参数)"""
+    derivation = {
+        "kdf": KDF_NAME,
+        "file_id": (file_id or os.urandom(FILE_ID_SIZE)).hex(),
+        "info": KDF_INFO,
+    }
+    return _hkdf(master_key, derivation, length), derivation
+
+def envelope_key(key: bytes, manifest: dict) -> bytes:
+    """返回解密该信封使用的密钥：批次模式下 key 是主 DEK，需要先派生出文件密钥"""
+    derivation = manifest.get("key_derivation")
+    if not derivation:
+        return key
+    return _hkdf(key, derivation, get_backend(manifest["backend"]).key_size)
+
+# ---------- 明文摘要 ----------
+# 已注册的摘要算法：名字 -> 返回 hashlib 风格对象（update / hexdigest）的构造函数
+DIGESTS: Dict[str, Callable] = {"sha256": hashlib.sha256}
+if blake3 is not None:
+    DIGESTS["blake3"] = blake3.blake3
+
+# 带密钥的版本：名字 -> 以 32 字节密钥构造摘要对象的函数
+KEYED_DIGESTS: Dict[str, Callable] = {"sha256": lambda key: hmac.new(key, digestmod=hashlib.sha256)}
+if blake3 is not None:
+    KEYED_DIGESTS["blake3"] = lambda key: blake3.blake3(key=key)
+
+DEFAULT_DIGEST = "sha256"
+DIGEST_KEY_INFO = "envelope-digest-key/v1"
+
+def available_digests() -> List[str]:
+    return list(DIGESTS)
+
+def new_digest(name: str, key: Optional[bytes] = None):
+    """key 不为空时返回带密钥的摘要对象"""
+    if name not in DIGESTS:
+        raise ValueError(f"不支持的摘要算法: {name}，可用: {available_digests()}")
+    return DIGESTS[name]() if key is None else KEYED_DIGESTS[name](key)
+
+def digest_key(key: bytes) -> bytes:
+    """
+    由信封的文件密钥（LUKS 信封为 DEK）派生摘要密钥：HKDF-SHA256(key, salt 为空, info=DIGEST_KEY_INFO)，32 字节。
+    输出只有一轮 HMAC，用标准库实现，LUKS 信封不依赖 cryptography
+    """
+    prk = hmac.new(b"\0" * 32, key, hashlib.sha256).digest()
+    return hmac.new(prk, DIGEST_KEY_INFO.encode() + b"\x01", hashlib.sha256).digest()
+
+def describe_digest(hasher, name: str, keyed: bool = True) -> dict:
+    info = {"algorithm": name, "value": hasher.hexdigest()}
+    if keyed:
+        info["keyed"] = True
+    return info
+
+def read_digest(z, manifest: Optional[dict] = None) -> Optional[dict]:
+    """读取信封中记录的明文摘要：AEAD 信封在信封头中，LUKS 信封在 digest.json 中"""
+    if manifest is not None:
+        return manifest.get("digest")
+    if DIGEST_NAME in z.namelist():
+        return json.loads(z.read(DIGEST_NAME))
+    return None
+
+class DigestVerifier:
+    """
+    边输出明文边计算摘要，结束时与信封中记录的摘要比较；expected 为空时不校验
+    带密钥的摘要需要传入摘要密钥 key（见 digest_key）
+    """
+
+    def __init__(self, expected: Optional[dict], key: Optional[bytes] = None):
+        self.expected = expected
+        self.hasher = None
+        if expected:
+            if expected.get("keyed") and key is None:
+                raise ValueError("信封中的明文摘要带密钥，校验需要提供摘要密钥")
+            self.hasher = new_digest(expected["algorithm"], key if expected.get("keyed") else None)
+
+    def update(self, data):
+        if self.hasher is not None:
+            self.hasher.update(data)
+
+    def verify(self) -> bool:
+        """校验通过返回 True，信封中没有摘要返回 False，不一致时抛出 ValueError"""
+        if self.hasher is None:
+            return False
+        actual = self.hasher.hexdigest()
+        if not hmac.compare_digest(actual, self.expected["value"]):
+            raise ValueError(f"明文摘要不一致（{self.expected['algorithm']}）：信封中为 {self.expected['value']}，实际为 {actual}")
+        return True
+
+class ChunkCompressor:
+    """先抽样判断可压缩性，只压缩值得压缩的块"""
+
+    def __init__(self, codec: str, level: Optional[int] = None):
+        self.codec = get_codec(codec)
+        self.level = self.codec.default_level if level is None else level
+        self._compress = self.codec.compressor(self.level)
+
+    def _sample(self, chunk) -> bytes:
+        if len(chunk) <= SAMPLE_COUNT * SAMPLE_SIZE:
+            return bytes(chunk)
+        step = len(chunk) // SAMPLE_COUNT
+        return b"".join(bytes(chunk[i * step:i * step + SAMPLE_SIZE]) for i in range(SAMPLE_COUNT))
+
+    def compress(self, chunk) -> Optional[bytes]:
+        """返回压缩后的数据，不可压缩时返回 None"""
+        if not chunk:
+            return None
+        sample = self._sample(chunk)
+        if len(sample) < len(chunk) and len(self._compress(sample)) > len(sample) * COMPRESS_MIN_RATIO:
+            return None
+        compressed = self._compress(bytes(chunk))
+        if len(compressed) > len(chunk) * COMPRESS_MIN_RATIO:
+            return None
+        return compressed
+
+    def describe(self) -> dict:
+        return {"codec": self.codec.name, "level": self.level}
+
+def _nonce(prefix: bytes, index: int) -> bytes:
+    return prefix + index.to_bytes(8, "big")
+
+def _aad(header: bytes, index: int, binding: bytes = b"") -> bytes:
+    return header + index.to_bytes(8, "big") + binding
+
+# 信封头中加密前已确定的字段（绑定到每一帧）和加密结束时才确定的字段（绑定到最后一帧）
+HEADER_FIELDS = ("format", "version", "backend", "chunk_size", "nonce_prefix", "compression", "key_derivation")
+TRAILER_FIELDS = ("chunks", "plaintext_size", "compressed_chunks", "stored_size", "digest")
+
+def _fields_hash(manifest: dict, fields) -> bytes:
+    bound = {name: manifest[name] for name in fields if name in manifest}
+    return hashlib.sha256(json.dumps(bound, sort_keys=True, separators=(",", ":")).encode()).digest()
+
+def manifest_binding(manifest: dict):
+    """返回 (每帧的绑定值, 最后一帧额外的绑定值)，版本 1 的信封不绑定信封头"""
+    if manifest.get("version", 1) < 2:
+        return b"", b""
+    unknown = set(manifest) - set(HEADER_FIELDS) - set(TRAILER_FIELDS)
+    if unknown:
+        raise ValueError(f"信封头中有未认证的字段: {sorted(unknown)}")
+    return _fields_hash(manifest, HEADER_FIELDS), _fields_hash(manifest, TRAILER_FIELDS)
+
+# ---------- 加密 ----------
+class ChunkEncryptor:
+    """逐块加密，调用方负责按顺序提交分块并标记最后一块"""
+
+    def __init__(self, key: bytes, backend: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 compressor: Optional[ChunkCompressor] = None, digest: Optional[str] = DEFAULT_DIGEST,
+                 key_derivation: Optional[dict] = None):
+        """key 为文件密钥；批次模式下 key_derivation 是派生该密钥的参数，写入信封头并受认证保护"""
+        self.backend = get_backend(backend)
+        self.cipher = self.backend.cipher(key)
+        self.chunk_size = chunk_size
+        self.compressor = compressor
+        self.key_derivation = key_derivation
+        self.nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        self.index = 0
+        self.plaintext_size = 0
+        self.compressed_chunks = 0
+        self.stored_size = 0
+        self.digest = digest
+        self.hasher = new_digest(digest, digest_key(key)) if digest else None
+        self.binding = manifest_binding(self.manifest())[0]
+
+    def encrypt_chunk(self, chunk, last: bool) -> bytes:
+        flags = FLAG_LAST if last else 0
+        if self.hasher is not None:
+            self.hasher.update(chunk)
+        payload = chunk
+        if self.compressor is not None:
+            compressed = self.compressor.compress(chunk)
+            if compressed is not None:
+                payload = compressed
+                flags |= FLAG_COMPRESSED
+                self.compressed_chunks += 1
+        index = self.index
+        self.index += 1
+        self.plaintext_size += len(chunk)
+        self.stored_size += len(payload)
+        binding = self.binding
+        if last:
+            # 此时块数、明文长度和摘要都已确定，绑定到最后一帧
+            binding += manifest_binding(self.manifest())[1]
+        header = FRAME_HEADER.pack(len(payload) + TAG_SIZE, flags)
+        ciphertext = self.cipher.encrypt(_nonce(self.nonce_prefix, index), bytes(payload), _aad(header, index, binding))
+        return header + ciphertext
+
+    def manifest(self) -> dict:
+        manifest = {
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "backend": self.backend.name,
+            "chunk_size": self.chunk_size,
+            "nonce_prefix": self.nonce_prefix.hex(),
+            "chunks": self.index,
+            "plaintext_size": self.plaintext_size,
+        }
+        if self.compressor is not None:
+            manifest["compression"] = self.compressor.describe()
+            manifest["compressed_chunks"] = self.compressed_chunks
+            manifest["stored_size"] = self.stored_size
+        if self.key_derivation:
+            manifest["key_derivation"] = self.key_derivation
+        if self.hasher is not None:
+            manifest["digest"] = describe_digest(self.hasher, self.digest)
+        return manifest
+
+class IncrementalEncryptor:
+    """
+    增量加密：数据可以分多次、以任意长度送入，凑满一块且之后还有数据时才加密输出，
+    finish() 把剩余数据作为最后一块加密；输出的帧序列与 encrypt_stream 一致
+    """
+
+    def __init__(self, encryptor: ChunkEncryptor):
+        self.encryptor = encryptor
+        self.pending = bytearray()
+
+    def update(self, data) -> bytes:
+        self.pending += data
+        chunk_size = self.encryptor.chunk_size
+        frames = []
+        while len(self.pending) > chunk_size:
+            frames.append(self.encryptor.encrypt_chunk(bytes(self.pending[:chunk_size]), False))
+            del self.pending[:chunk_size]
+        return b"".join(frames)
+
+    def finish(self) -> bytes:
+        frame = self.encryptor.encrypt_chunk(bytes(self.pending), True)
+        self.pending.clear()
+        return frame
+
+def encrypt_stream(key: bytes, src: BinaryIO, dst: BinaryIO, backend: str,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE, compressor: Optional[ChunkCompressor] = None,
+                   digest: Optional[str] = DEFAULT_DIGEST, key_derivation: Optional[dict] = None) -> dict:
+    """从 src 流式读取明文，向 dst 写入密文帧，同时计算明文摘要，返回信封头"""
+    encryptor = ChunkEncryptor(key, backend, chunk_size, compressor, digest, key_derivation)
+    chunk = src.read(chunk_size)
+    while True:
+        # 预读下一块以判断当前块是否为最后一块（空文件也会写出一个空的最后帧）
+        next_chunk = src.read(chunk_size) if chunk else b""
+        last = not next_chunk
+        dst.write(encryptor.encrypt_chunk(chunk, last))
+        if last:
+            break
+        chunk = next_chunk
+    return encryptor.manifest()
+
+# ---------- 解密 ----------
+def read_manifest(z) -> Optional[dict]:
+    """读取 zip 中的信封头，旧版 LUKS 信封返回 None"""
+    if MANIFEST_NAME not in z.namelist():
+        return None
+    manifest = json.loads(z.read(MANIFEST_NAME))
+    versions = {FORMAT_NAME: FORMAT_VERSION, RECIPE_FORMAT: RECIPE_VERSION}
+    if manifest.get("format") not in versions:
+        raise ValueError(f"未知的信封格式: {manifest.get('format')}")
+    supported = versions[manifest["format"]]
+    if manifest.get("version", 0) > supported:
+        raise ValueError(f"信封版本 {manifest['version']} 高于当前支持的版本 {supported}")
+    return manifest
+
+class ChunkDecryptor:
+    """按帧序号解密，校验顺序、标志位和认证标签"""
+
+    def __init__(self, key: bytes, manifest: dict):
+        self.manifest = manifest
+        file_key = envelope_key(key, manifest)
+        self.cipher = get_backend(manifest["backend"]).cipher(file_key)
+        self.digest_key = digest_key(file_key)
+        self.nonce_prefix = bytes.fromhex(manifest["nonce_prefix"])
+        compression = manifest.get("compression")
+        self.codec = get_codec(compression["codec"]) if compression else None
+        self.binding, self.trailer_binding = manifest_binding(manifest)
+
+    def verifier(self) -> DigestVerifier:
+        return DigestVerifier(self.manifest.get("digest"), self.digest_key)
+
+    def _aad(self, header: bytes, index: int) -> bytes:
+        if FRAME_HEADER.unpack(header)[1] & FLAG_LAST:
+            return _aad(header, index, self.binding + self.trailer_binding)
+        return _aad(header, index, self.binding)
+
+    def decrypt_frame(self, index: int, header: bytes, ciphertext) -> bytes:
+        try:
+            plaintext = self.cipher.decrypt(_nonce(self.nonce_prefix, index), bytes(ciphertext), self._aad(header, index))
+        except Exception:
+            raise ValueError(f"第 {index} 块密文认证失败，信封可能被篡改或密钥错误")
+        if FRAME_HEADER.unpack(header)[1] & FLAG_COMPRESSED:
+            if self.codec is None:
+                raise ValueError(f"第 {index} 块标记为已压缩，但信封头中没有压缩算法")
+            plaintext = self.codec.decompress(plaintext, self.manifest["chunk_size"])
+        return plaintext
+
+    def decrypt_frame_into(self, index: int, header: bytes, ciphertext, out) -> int:
+        """
+        将一帧解密到可写缓冲区 out，返回写入的明文长度
+        未压缩的帧在支持 decrypt_into 的版本上直接解密到 out，不产生中间副本
+        """
+        flags = FRAME_HEADER.unpack(header)[1]
+        size = len(ciphertext) - TAG_SIZE
+        if not flags & FLAG_COMPRESSED and hasattr(self.cipher, "decrypt_into"):
+            if size > len(out):
+                raise ValueError(f"第 {index} 块明文超出输出缓冲区")
+            try:
+                self.cipher.decrypt_into(_nonce(self.nonce_prefix, index), ciphertext, self._aad(header, index),
+                                         out[:size])
+            except Exception:
+                raise ValueError(f"第 {index} 块密文认证失败，信封可能被篡改或密钥错误")
+            return size
+        plaintext = self.decrypt_frame(index, header, ciphertext)
+        if len(plaintext) > len(out):
+            raise ValueError(f"第 {index} 块明文超出输出缓冲区")
+        out[:len(plaintext)] = plaintext
+        return len(plaintext)
+
+def iter_frames(src: BinaryIO):
+    """依次返回 (帧头, 标志, 密文)"""
+    while True:
+        header = src.read(FRAME_HEADER.size)
+        if not header:
+            return
+        if len(header) != FRAME_HEADER.size:
+            raise ValueError("密文帧头不完整")
+        length, flags = FRAME_HEADER.unpack(header)
+        ciphertext = src.read(length)
+        if len(ciphertext) != length:
+            raise ValueError("密文帧不完整")
+        yield header, flags, ciphertext
+
+def decrypt_stream(key: bytes, manifest: dict, src: BinaryIO, dst: BinaryIO) -> int:
+    """从 src 流式读取密文帧，向 dst 写入明文并校验明文摘要，返回明文长度"""
+    decryptor = ChunkDecryptor(key, manifest)
+    verifier = decryptor.verifier()
+    size = 0
+    index = 0
+    last_seen = False
+    for header, flags, ciphertext in iter_frames(src):
+        if last_seen:
+            raise ValueError("最后一块之后仍有多余的密文")
+        plaintext = decryptor.decrypt_frame(index, header, ciphertext)
+        dst.write(plaintext)
+        verifier.update(plaintext)
+        size += len(plaintext)
+        index += 1
+        last_seen = bool(flags & FLAG_LAST)
+    if not last_seen:
+        raise ValueError("密文被截断：未读到最后一块")
+    if size != manifest["plaintext_size"]:
+        raise ValueError(f"明文长度不一致：信封头为 {manifest['plaintext_size']}，实际为 {size}")
+    verifier.verify()
+    return size
+
+def member_span(zip_path: str, name: str = DATA_NAME):
+    """返回 zip 中未压缩成员在文件中的 (起始偏移, 长度)，用于直接内存映射密文"""
+    with zipfile.ZipFile(zip_path, "r") as z:
+        info = z.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+        raise ValueError(f"{name} 经过压缩或加密，无法直接映射")
+    with open(zip_path, "rb") as f:
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+    if local_header[:4] != b"PK\x03\x04":
+        raise ValueError("zip 本地文件头损坏")
+    name_len, extra_len = struct.unpack("<HH", local_header[26:30])
+    return info.header_offset + 30 + name_len + extra_len, info.file_size
+
+def iter_frame_views(view: memoryview):
+    """在内存视图上依次返回 (帧头, 密文视图)，不复制密文"""
+    pos = 0
+    total = len(view)
+    while pos < total:
+        if pos + FRAME_HEADER.size > total:
+            raise ValueError("密文帧头不完整")
+        header = bytes(view[pos:pos + FRAME_HEADER.size])
+        length = FRAME_HEADER.unpack(header)[0]
+        start = pos + FRAME_HEADER.size
+        if start + length > total:
+            raise ValueError("密文帧不完整")
+        yield header, view[start:start + length]
+        pos = start + length
+
+def decrypt_into_buffer(key: bytes, manifest: dict, src: memoryview, dst: memoryview) -> int:
+    """
+    将内存视图 src 中的全部密文帧解密到预先分配好的 dst（长度为明文长度），返回明文长度
+    第 i 块明文固定写在 dst[i * chunk_size] 处，写入后趁页面仍在缓存中计算摘要
+    """
+    decryptor = ChunkDecryptor(key, manifest)
+    verifier = decryptor.verifier()
+    chunk_size = manifest["chunk_size"]
+    size = 0
+    index = 0
+    last_seen = False
+    for header, ciphertext in iter_frame_views(src):
+        if last_seen:
+            raise ValueError("最后一块之后仍有多余的密文")
+        offset = index * chunk_size
+        written = decryptor.decrypt_frame_into(index, header, ciphertext, dst[offset:offset + chunk_size])
+        verifier.update(dst[offset:offset + written])
+        last_seen = bool(FRAME_HEADER.unpack(header)[1] & FLAG_LAST)
+        if not last_seen and written != chunk_size:
+            raise ValueError(f"第 {index} 块明文长度与分块大小不一致")
+        size += written
+        index += 1
+    if not last_seen:
+        raise ValueError("密文被截断：未读到最后一块")
+    if size != manifest["plaintext_size"]:
+        raise ValueError(f"明文长度不一致：信封头为 {manifest['plaintext_size']}，实际为 {size}")
+    verifier.verify()
+    return size
+
+# ---------- 随机读取 ----------
+# EnvelopeReader 把分块 AEAD 信封包装成只读、可 seek 的文件对象（io.RawIOBase），模型加载等库可以直接读取，
+# 明文不写到磁盘。打开时读一遍帧头建立帧索引（每帧的密文位置），第 i 块明文固定对应 [i * 分块大小, (i + 1) * 分块大小)，
+# 压缩过的帧也一样；读取时只解密用到的分块，最近用过的分块保留在 LRU 缓存中，
+# 顺序读取时在后台线程提前解密后面 readahead 块。每块都有认证标签，读到的数据都已认证，打开时先认证最后一帧；
+# 从头到尾按顺序读完时还会校验信封头中的明文摘要。去重信封和 LUKS 信封不支持随机读取
+
+# LRU 缓存保留的明文分块数
+READER_CACHE_CHUNKS = 8
+# 顺序读取时提前解密的分块数，0 表示不预读
+READER_READAHEAD = 2
+
+class EnvelopeReader(io.RawIOBase):
+    def __init__(self, zip_path: str, key: bytes, cache_chunks: int = READER_CACHE_CHUNKS,
+                 readahead: int = READER_READAHEAD):
+        super().__init__()
+        self._file = None
+        self._zip = None
+        self._pool = None
+        self._pending = {}
+        try:
+            with zipfile.ZipFile(zip_path, "r") as z:
+                manifest = read_manifest(z)
+                info = z.getinfo(DATA_NAME) if manifest else None
+            if manifest is None or manifest["format"] != FORMAT_NAME:
+                raise ValueError("只有分块 AEAD 信封支持随机读取")
+            self.manifest = manifest
+            self.size = manifest["plaintext_size"]
+            self.chunk_size = manifest["chunk_size"]
+            self.cache_chunks = max(cache_chunks, 1)
+            self.readahead = readahead
+            self._decryptor = ChunkDecryptor(key, manifest)
+            if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+                # data.bin 未压缩时直接按偏移读取 zip 文件
+                self._base, self._length = member_span(zip_path)
+                self._file = open(zip_path, "rb")
+            else:
+                self._zip = zipfile.ZipFile(zip_path, "r")
+                self._file = self._zip.open(DATA_NAME)
+                self._base, self._length = 0, info.file_size
+            # 预读线程与调用方共用文件句柄，seek 和 read 需要一起完成
+            self._io_lock = threading.Lock()
+            self._frames = self._build_index()
+            # 打开时认证最后一帧（绑定了明文长度和摘要），防止截断或改动信封头中的明文长度
+            self._decrypt(len(self._frames) - 1)
+        except Exception:
+            self.close()
+            raise
+        self._pos = 0
+        self._cache = collections.OrderedDict()
+        self._last_chunk = -1
+        self._verifier = self._decryptor.verifier()
+        self._verified_chunks = 0
+        self.stats = {"decrypted": 0, "cache_hits": 0, "readahead_hits": 0}
+
+    def _read_at(self, offset: int, length: int) -> bytes:
+        with self._io_lock:
+            self._file.seek(self._base + offset)
+            return self._file.read(length)
+
+    def _build_index(self) -> List[tuple]:
+        """读取全部帧头，返回每帧的 (帧头, 密文偏移, 密文长度)"""
+        frames = []
+        pos = 0
+        while pos < self._length:
+            header = self._read_at(pos, FRAME_HEADER.size)
+            if len(header) != FRAME_HEADER.size:
+                raise ValueError("密文帧头不完整")
+            length, flags = FRAME_HEADER.unpack(header)
+            start = pos + FRAME_HEADER.size
+            if start + length > self._length:
+                raise ValueError("密文帧不完整")
+            frames.append((header, start, length))
+            pos = start + length
+            if flags & FLAG_LAST and pos != self._length:
+                raise ValueError("最后一块之后仍有多余的密文")
+        if not frames or not FRAME_HEADER.unpack(frames[-1][0])[1] & FLAG_LAST:
+            raise ValueError("密文被截断：未读到最后一块")
+        if len(frames) != max(-(-self.size // self.chunk_size), 1):
+            raise ValueError(f"密文帧数 {len(frames)} 与明文长度 {self.size} 不一致")
+        return frames
+
+    def _decrypt(self, index: int) -> bytes:
+        header, offset, length = self._frames[index]
+        plaintext = self._decryptor.decrypt_frame(index, header, self._read_at(offset, length))
+        if len(plaintext) != min(self.chunk_size, self.size - index * self.chunk_size):
+            raise ValueError(f"第 {index} 块明文长度与分块大小不一致")
+        return plaintext
+
+    def _schedule_readahead(self, index: int):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=min(self.readahead, os.cpu_count() or 1))
+        for i in range(index + 1, min(index + 1 + self.readahead, len(self._frames))):
+            if i not in self._cache and i not in self._pending:
+                self._pending[i] = self._pool.submit(self._decrypt, i)
+
+    def _cancel_readahead(self):
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    def _chunk(self, index: int) -> bytes:
+        plaintext = self._cache.get(index)
+        if plaintext is not None:
+            self._cache.move_to_end(index)
+            self.stats["cache_hits"] += 1
+        else:
+            future = self._pending.pop(index, None)
+            if future is not None:
+                plaintext = future.result()
+                self.stats["readahead_hits"] += 1
+            else:
+                plaintext = self._decrypt(index)
+            self.stats["decrypted"] += 1
+            self._cache[index] = plaintext
+            while len(self._cache) > self.cache_chunks:
+                self._cache.popitem(last=False)
+        if index != self._last_chunk:
+            if index == self._last_chunk + 1:
+                if self.readahead > 0:
+                    self._schedule_readahead(index)
+            else:
+                # 跳读时之前的预读已经没用
+                self._cancel_readahead()
+            self._last_chunk = index
+        if index == self._verified_chunks:
+            self._verifier.update(plaintext)
+            self._verified_chunks += 1
+            if self._verified_chunks == len(self._frames):
+                self._verifier.verify()
+        return plaintext
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        out = memoryview(b).cast("B")
+        n = 0
+        while n < len(out) and self._pos < self.size:
+            index, offset = divmod(self._pos, self.chunk_size)
+            plaintext = self._chunk(index)
+            count = min(len(plaintext) - offset, len(out) - n)
+            out[n:n + count] = plaintext[offset:offset + count]
+            n += count
+            self._pos += count
+        return n
+
+    def readall(self) -> bytes:
+        buf = bytearray(max(self.size - self._pos, 0))
+        n = self.readinto(buf)
+        return bytes(buf[:n])
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"不支持的 whence: {whence}")
+        if pos < 0:
+            raise ValueError(f"偏移量不能为负数: {pos}")
+        self._pos = pos
+        return pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        if self.closed:
+            return
+        self._cancel_readahead()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        for f in (self._file, self._zip):
+            if f is not None:
+                f.close()
+        super().close()
+
+# ---------- 内容定义分块去重 ----------
+# 去重信封 zip 包中的文件：envelope.json（format 为 cdc-recipe）、recipe.json、encrypted_key.txt、key_name.txt
+#   recipe.json  分块清单 [[分块 ID, 明文长度], ...]，按顺序拼接各分块的明文即为原文件
+# 分块边界由内容决定（FastCDC：32 字节窗口的 gear 滚动哈希 + 归一化分块），文件中插入或删除数据只影响附近的分块，
+# 同一模型相邻版本的 checkpoint 之间大部分分块都能复用，相同的分块只加密、保存一次。
+# 同一根密钥下的去重信封共用一个长期不变的仓库 DEK（encrypted_key.txt），由它派生：
+#   分块 ID   = BLAKE2b(明文, key=HKDF(仓库 DEK, info=CHUNK_ID_INFO))，不掌握仓库 DEK 无法由 ID 推测内容
+#   分块密钥  = HKDF(仓库 DEK, salt=分块 ID, info=CHUNK_KEY_INFO)，每个分块的密钥都不同
+#   清单 MAC  = BLAKE2b(recipe.json + 信封头其余字段, key=HKDF(仓库 DEK, info=RECIPE_MAC_INFO))，防止替换或重排分块、改动信封头
+#   明文摘要  带密钥，密钥 = HKDF(仓库 DEK, info=DIGEST_KEY_INFO)
+# 版本 1 的清单 MAC 只覆盖明文长度和摘要，摘要不带密钥，仍可解密
+# 分块密文 = 帧头(密文长度 4 字节 + 标志 1 字节) + 随机 nonce(12 字节) + 密文，附加认证数据 = 帧头 + 分块 ID；
+# 压缩过的分块先在压缩数据前加上压缩算法名（1 字节长度 + 名字）再加密。
+RECIPE_FORMAT = "cdc-recipe"
+RECIPE_VERSION = 2
+RECIPE_NAME = "recipe.json"
+
+CDC_MIN_SIZE = 256 * 1024
+CDC_AVG_SIZE = 1024 * 1024
+CDC_MAX_SIZE = 4 * 1024 * 1024
+# 归一化级别：未到平均大小时判断条件多 2 位、超过后少 2 位，分块大小更集中在平均值附近
+CDC_NORMALIZATION = 2
+# 32 位 gear 哈希每次左移一位，32 字节之前的数据已被移出，哈希只取决于最近 32 字节
+CDC_WINDOW = 32
+# 每次从输入读取的数据量
+CDC_READ_SIZE = 16 * 1024 * 1024
+# numpy 每次计算哈希的长度：数组放得进 CPU 缓存时最快，找到边界后不再计算后面的数据
+CDC_SEGMENT_SIZE = 64 * 1024
+
+CHUNK_ID_INFO = "dedup-chunk-id/v1"
+CHUNK_KEY_INFO = "dedup-chunk-key/v1"
+RECIPE_MAC_INFO = "dedup-recipe-mac/v1"
+CHUNK_NONCE_SIZE = 12
+
+_MASK32 = (1 << 32) - 1
+# gear 表由固定种子生成，加密方之间必须一致，否则同样的内容会切出不同的分块
+GEAR = [int.from_bytes(hashlib.sha256(b"fastcdc-gear" + bytes([i])).digest()[:4], "big") for i in range(256)]
+_GEAR_ARRAY = numpy.array(GEAR, dtype=numpy.uint32) if numpy is not None else None
+
+def _gear_hashes(data, start: int, end: int):
+    """
+    用 numpy 计算 data[start:end] 中每个位置的 gear 哈希（含该位置在内的最近 32 字节），
+    第 j 个位置的哈希 = sum(GEAR[data[j - k]] << k, k < 32)，按 1、2、4、8、16 倍增累加，与逐字节计算的结果相同
+    """
+    base = max(start - CDC_WINDOW + 1, 0)
+    h = _GEAR_ARRAY[numpy.frombuffer(data, dtype=numpy.uint8, count=end - base, offset=base)]
+    shift = 1
+    while shift < CDC_WINDOW:
+        h[shift:] += h[:-shift] << numpy.uint32(shift)
+        shift *= 2
+    return h[start - base:]
+
+class CDCChunker:
+    """FastCDC 分块：分块长度在 [min_size, max_size] 之间（最后一块可能更短），平均约为 avg_size"""
+
+    def __init__(self, min_size: int = CDC_MIN_SIZE, avg_size: int = CDC_AVG_SIZE, max_size: int = CDC_MAX_SIZE):
+        if not CDC_WINDOW <= min_size < avg_size < max_size:
+            raise ValueError(f"分块大小需满足 {CDC_WINDOW} <= min_size < avg_size < max_size")
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        # 哈希最高的若干位全为 0 时作为边界，即哈希小于对应的阈值
+        bits = avg_size.bit_length() - 1
+        self.threshold_s = 1 << (32 - bits - CDC_NORMALIZATION)
+        self.threshold_l = 1 << (32 - max(bits - CDC_NORMALIZATION, 1))
+
+    def describe(self) -> dict:
+        return {"algorithm": "fastcdc", "min_size": self.min_size, "avg_size": self.avg_size,
+                "max_size": self.max_size}
+
+    def _find_py(self, data, lo: int, mid: int, stop: int) -> Optional[int]:
+        """逐字节计算 gear 哈希，在候选位置 [lo, stop) 中查找边界"""
+        gear = GEAR
+        h = 0
+        # 从第一个候选位置之前 32 字节开始计算，之前的数据已不影响哈希
+        for j in range(lo - CDC_WINDOW + 1, lo):
+            h = ((h << 1) + gear[data[j]]) & _MASK32
+        for j in range(lo, mid):
+            h = ((h << 1) + gear[data[j]]) & _MASK32
+            if h < self.threshold_s:
+                return j + 1
+        for j in range(mid, stop):
+            h = ((h << 1) + gear[data[j]]) & _MASK32
+            if h < self.threshold_l:
+                return j + 1
+        return None
+
+    def _find_numpy(self, data, lo: int, mid: int, stop: int) -> Optional[int]:
+        """用 numpy 分段计算哈希，在候选位置 [lo, stop) 中查找边界"""
+        pos = lo
+        while pos < stop:
+            seg_end = min(pos + CDC_SEGMENT_SIZE, stop)
+            h = _gear_hashes(data, pos, seg_end)
+            split = min(max(mid - pos, 0), len(h))
+            found = numpy.flatnonzero(h[:split] < self.threshold_s)
+            if not len(found):
+                found = numpy.flatnonzero(h[split:] < self.threshold_l) + split
+            if len(found):
+                return pos + int(found[0]) + 1
+            pos = seg_end
+        return None
+
+    def cut_points(self, data, eof: bool) -> List[int]:
+        """
+        返回 data 中各个完整分块的结束位置；eof 为 False 时，最后一个边界之后不足以确定边界的数据
+        留给调用方与后续数据拼接，eof 为 True 时剩余数据作为最后一块
+        分块的前 min_size 字节不会成为边界，不计算哈希；位置 j 为边界时分块在 j + 1 处结束
+        """
+        find = self._find_numpy if numpy is not None else self._find_py
+        end = len(data)
+        points = []
+        start = 0
+        while start < end:
+            cut = None
+            if end - start > self.min_size:
+                cut = find(data, start + self.min_size - 1, min(start + self.avg_size - 1, end),
+                           min(start + self.max_size - 1, end))
+                if cut is None and end >= start + self.max_size:
+                    cut = start + self.max_size
+            if cut is None:
+                if not eof:
+                    break
+                cut = end
+            points.append(cut)
+            start = cut
+        return points
+
+def iter_cdc_chunks(src: BinaryIO, chunker: CDCChunker, read_size: int = CDC_READ_SIZE):
+    """从 src 流式读取数据，依次返回内容定义的分块（bytes），只在内存中保留一次读取的数据和未切完的尾部"""
+    buf = b""
+    eof = False
+    while not eof:
+        block = src.read(read_size)
+        eof = not block
+        buf = buf + block if buf else block
+        start = 0
+        for cut in chunker.cut_points(buf, eof):
+            yield buf[start:cut]
+            start = cut
+        buf = buf[start:]
+
+class DedupKey:
+    """由仓库 DEK 派生分块 ID、分块密钥和清单 MAC 密钥"""
+
+    def __init__(self, store_key: bytes, backend: str):
+        self.backend = get_backend(backend)
+        self.store_key = store_key
+        self.id_key = self._derive(b"", CHUNK_ID_INFO, 32)
+        self.mac_key = self._derive(b"", RECIPE_MAC_INFO, 32)
+        self.digest_key = digest_key(store_key)
+
+    def _derive(self, salt: bytes, info: str, length: int) -> bytes:
+        return _hkdf(self.store_key, {"kdf": KDF_NAME, "file_id": salt.hex(), "info": info}, length)
+
+    def chunk_id(self, data) -> str:
+        return hashlib.blake2b(data, key=self.id_key, digest_size=32).hexdigest()
+
+    def _cipher(self, chunk_id: str):
+        return self.backend.cipher(self._derive(bytes.fromhex(chunk_id), CHUNK_KEY_INFO, self.backend.key_size))
+
+    def seal(self, chunk_id: str, data, compressor: Optional[ChunkCompressor] = None) -> bytes:
+        """加密一个分块，返回保存到分块仓库中的密文"""
+        flags = 0
+        payload = data
+        if compressor is not None:
+            compressed = compressor.compress(data)
+            if compressed is not None:
+                name = compressor.codec.name.encode()
+                payload = bytes([len(name)]) + name + compressed
+                flags |= FLAG_COMPRESSED
+        header = FRAME_HEADER.pack(len(payload) + TAG_SIZE, flags)
+        nonce = os.urandom(CHUNK_NONCE_SIZE)
+        return header + nonce + self._cipher(chunk_id).encrypt(nonce, bytes(payload), header + bytes.fromhex(chunk_id))
+
+    def open(self, chunk_id: str, blob: bytes, max_size: int) -> bytes:
+        """解密一个分块并校验分块 ID 与明文一致"""
+        if len(blob) < FRAME_HEADER.size + CHUNK_NONCE_SIZE:
+            raise ValueError(f"分块 {chunk_id} 密文不完整")
+        header = blob[:FRAME_HEADER.size]
+        length, flags = FRAME_HEADER.unpack(header)
+        body = blob[FRAME_HEADER.size:]
+        if len(body) != CHUNK_NONCE_SIZE + length:
+            raise ValueError(f"分块 {chunk_id} 密文长度不一致")
+        try:
+            payload = self._cipher(chunk_id).decrypt(body[:CHUNK_NONCE_SIZE], body[CHUNK_NONCE_SIZE:],
+                                                     header + bytes.fromhex(chunk_id))
+        except Exception:
+            raise ValueError(f"分块 {chunk_id} 认证失败，分块可能被篡改或密钥错误")
+        if flags & FLAG_COMPRESSED:
+            name_len = payload[0]
+            codec = get_codec(payload[1:1 + name_len].decode())
+            payload = codec.decompress(payload[1 + name_len:], max_size)
+        if self.chunk_id(payload) != chunk_id:
+            raise ValueError(f"分块 {chunk_id} 内容与 ID 不一致")
+        return payload
+
+    def recipe_mac(self, recipe: bytes, manifest: dict) -> str:
+        if manifest.get("version", 1) < 2:
+            bound = json.dumps({"plaintext_size": manifest["plaintext_size"], "digest": manifest.get("digest")},
+                               sort_keys=True).encode()
+        else:
+            bound = json.dumps({k: v for k, v in manifest.items() if k != "recipe_mac"},
+                               sort_keys=True, separators=(",", ":")).encode()
+        return hashlib.blake2b(recipe + b"\n" + bound, key=self.mac_key, digest_size=32).hexdigest()
+
+def encrypt_recipe(dedup: DedupKey, src: BinaryIO, has_chunk: Callable[[str], bool],
+                   put_chunk: Callable[[str, bytes, int], None], chunker: Optional[CDCChunker] = None,
+                   compressor: Optional[ChunkCompressor] = None, digest: Optional[str] = DEFAULT_DIGEST):
+    """
+    对 src 做内容定义分块，仓库中没有的分块才加密并交给 put_chunk(分块 ID, 密文, 明文长度) 保存，
+    返回 (信封头, recipe.json 内容, 统计)
+    """
+    chunker = chunker or CDCChunker()
+    hasher = new_digest(digest, dedup.digest_key) if digest else None
+    recipe = []
+    seen = set()
+    stats = {"chunks": 0, "new_chunks": 0, "new_bytes": 0, "stored_bytes": 0}
+    plaintext_size = 0
+    for chunk in iter_cdc_chunks(src, chunker):
+        if hasher is not None:
+            hasher.update(chunk)
+        chunk_id = dedup.chunk_id(chunk)
+        # 同一文件内重复的分块只检查、写入一次
+        if chunk_id not in seen and not has_chunk(chunk_id):
+            blob = dedup.seal(chunk_id, chunk, compressor)
+            put_chunk(chunk_id, blob, len(chunk))
+            stats["new_chunks"] += 1
+            stats["new_bytes"] += len(chunk)
+            stats["stored_bytes"] += len(blob)
+        seen.add(chunk_id)
+        recipe.append([chunk_id, len(chunk)])
+        plaintext_size += len(chunk)
+    stats["chunks"] = len(recipe)
+    manifest = {
+        "format": RECIPE_FORMAT,
+        "version": RECIPE_VERSION,
+        "backend": dedup.backend.name,
+        "chunker": chunker.describe(),
+        "chunks": len(recipe),
+        "plaintext_size": plaintext_size,
+    }
+    if compressor is not None:
+        manifest["compression"] = compressor.describe()
+    if hasher is not None:
+        manifest["digest"] = describe_digest(hasher, digest)
+    recipe_bytes = json.dumps(recipe).encode()
+    manifest["recipe_mac"] = dedup.recipe_mac(recipe_bytes, manifest)
+    return manifest, recipe_bytes, stats
+
+def load_recipe(z) -> bytes:
+    return z.read(RECIPE_NAME)
+
+def recipe_entries(recipe: bytes) -> List[list]:
+    return json.loads(recipe)
+
+def decrypt_recipe(key: bytes, manifest: dict, recipe: bytes, blobs, dst: BinaryIO,
+                   on_verified: Optional[Callable[[str, bytes], None]] = None) -> int:
+    """
+    按分块清单解密去重信封：key 为仓库 DEK，blobs 按清单顺序给出各分块的密文，
+    每个分块认证通过后调用 on_verified(分块 ID, 密文)（例如写入本地缓存），返回明文长度
+    """
+    dedup = DedupKey(key, manifest["backend"])
+    if not hmac.compare_digest(dedup.recipe_mac(recipe, manifest), manifest.get("recipe_mac", "")):
+        raise ValueError("分块清单认证失败，信封可能被篡改或密钥错误")
+    verifier = DigestVerifier(manifest.get("digest"), dedup.digest_key)
+    max_size = manifest["chunker"]["max_size"]
+    entries = recipe_entries(recipe)
+    size = 0
+    blobs = iter(blobs)
+    for chunk_id, length in entries:
+        blob = next(blobs)
+        plaintext = dedup.open(chunk_id, blob, max_size)
+        if len(plaintext) != length:
+            raise ValueError(f"分块 {chunk_id} 明文长度与清单不一致")
+        if on_verified is not None:
+            on_verified(chunk_id, blob)
+        dst.write(plaintext)
+        verifier.update(plaintext)
+        size += len(plaintext)
+    if size != manifest["plaintext_size"]:
+        raise ValueError(f"明文长度不一致：信封头为 {manifest['plaintext_size']}，实际为 {size}")
+    verifier.verify()
+    return size
+
+# ---------- 启动自检 ----------
+def benchmark(total_bytes: int = BENCHMARK_BYTES, chunk_sizes: List[int] = CHUNK_SIZES) -> List[dict]:
+    """测试每种算法和分块大小组合的加密吞吐量（MB/s）"""
+    results = []
+    key = os.urandom(32)
+    data = os.urandom(max(chunk_sizes))
+    for name, backend in BACKENDS.items():
+        cipher = backend.cipher(key[:backend.key_size])
+        for chunk_size in chunk_sizes:
+            chunk = data[:chunk_size]
+            rounds = max(total_bytes // chunk_size, 1)
+            prefix = os.urandom(NONCE_PREFIX_SIZE)
+            start = time.perf_counter()
+            for i in range(rounds):
+                cipher.encrypt(_nonce(prefix, i), chunk, b"")
+            elapsed = time.perf_counter() - start
+            results.append({
+                "backend": name,
+                "chunk_size": chunk_size,
+                "mb_per_s": round(rounds * chunk_size / elapsed / 1024 / 1024, 1),
+            })
+    return results
+
+def select_best(results: List[dict]) -> Optional[dict]:
+    """选择吞吐量最高的组合，差距在 BENCHMARK_TOLERANCE 以内时选择更小的分块"""
+    if not results:
+        return None
+    best = max(r["mb_per_s"] for r in results)
+    candidates = [r for r in results if r["mb_per_s"] >= best * (1 - BENCHMARK_TOLERANCE)]
+    return min(candidates, key=lambda r: (r["chunk_size"], -r["mb_per_s"]))
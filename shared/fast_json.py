@@ -0,0 +1,58 @@
+import json
+import sqlite3
+from typing import Sequence, Tuple
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时使用标准库 json 编码（较慢）
+    orjson = None
+
+# ---------- 快速 JSON 响应 ----------
+# 大列表接口的耗时主要在序列化而不是查询：逐行构造字典，再经 FastAPI 的 jsonable_encoder 和标准库 json 编码。
+# 列表查询直接由 SQLite 的 JSON 函数（json_group_array / json_object）生成 JSON 数组，
+# Python 中不再为每行创建元组和字典；SQLite 未编译 JSON 函数时退回到逐行编码（优先使用 orjson）。
+# 接口直接返回 Response，FastAPI 不再对返回值做 jsonable_encoder 转换和校验。
+
+def dumps(obj) -> bytes:
+    """紧凑编码，非 ASCII 字符不转义，与 JSONResponse 的输出一致"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+class FastJSONResponse(JSONResponse):
+    """与 JSONResponse 用法相同，编码使用 orjson（已安装时）"""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+# SQLite 是否支持 JSON 函数，首次查询时检测
+_sqlite_json = None
+
+def sqlite_has_json(conn: sqlite3.Connection) -> bool:
+    global _sqlite_json
+    if _sqlite_json is None:
+        try:
+            conn.execute("SELECT json_object('a', 1)")
+            _sqlite_json = True
+        except sqlite3.OperationalError:
+            _sqlite_json = False
+    return _sqlite_json
+
+def query_json_array(conn: sqlite3.Connection, columns: Sequence[str], sql: str, params=()) -> Tuple[int, bytes]:
+    """
+    执行 sql（须选出 columns 中的各列），返回 (行数, JSON 数组)，数组元素是以 columns 为键的对象，顺序与 sql 的结果一致
+    """
+    if sqlite_has_json(conn):
+        fields = ", ".join(f"'{name}', \"{name}\"" for name in columns)
+        count, array = conn.execute(
+            f"SELECT count(*), json_group_array(json_object({fields})) FROM ({sql})", params
+        ).fetchone()
+        return count, array.encode()
+    rows = conn.execute(sql, params).fetchall()
+    return len(rows), dumps([dict(zip(columns, row)) for row in rows])
+
+def listing_body(conn: sqlite3.Connection, columns: Sequence[str], sql: str, params=()) -> bytes:
+    """列表接口的响应体 {"count": 行数, "data": [...]}"""
+    count, array = query_json_array(conn, columns, sql, params)
+    return b'{"count":%d,"data":%s}' % (count, array)
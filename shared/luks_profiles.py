@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import struct
+import subprocess
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional
+
+# ---------- LUKS 格式参数 ----------
+# LUKS 信封的 DEK 是 Vault 签发的 256 位随机密钥，不是口令，PBKDF 的口令加强没有意义：
+# cryptsetup 默认的 Argon2 每次 luksFormat 和 open 都要花费数秒和数百 MB 内存。
+# 这里把 PBKDF 类型与成本、加密算法、主密钥长度、扇区大小组合成命名的参数组（profile），
+# 加密时可以按根密钥或按请求选择；参数写在 LUKS header 中，解密方直接从 header 读取，不需要知道加密时用的参数组。
+# 4K 扇区的设备 I/O 次数是 512 字节扇区的 1/8，数据按扇区大小补齐。
+# 默认仍使用 cryptsetup 的默认参数（compat），解密方的 cryptsetup 版本和内核都不需要改变；
+# fast 等参数组需要通过 LUKS_PROFILE、LUKS_KEY_PROFILES 或请求中的 luks_profile 显式选择。
+
+# 默认参数组
+DEFAULT_PROFILE = os.environ.get("LUKS_PROFILE", "compat")
+# 按根密钥指定参数组，格式为 "key1=profile,key2=profile"
+KEY_PROFILES = dict(
+    item.split("=", 1) for item in os.environ.get("LUKS_KEY_PROFILES", "").split(",") if "=" in item
+)
+# 自定义参数组的 JSON 文件：{"名字": {"pbkdf": ..., "cipher": ...}}，同名时覆盖内置参数组
+PROFILES_FILE = os.environ.get("LUKS_PROFILES_FILE", "")
+# LUKS2 header 中 JSON 区域的起始位置
+LUKS2_JSON_OFFSET = 4096
+# cryptsetup 默认 Argon2 的内存上限（KiB），用于估算 compat 参数组的内存占用
+DEFAULT_ARGON2_MEMORY_KIB = 1024 * 1024
+
+class Profile:
+    """一组 luksFormat 参数，值为 None 的项使用 cryptsetup 的默认值"""
+
+    def __init__(self, name: str, description: str = "", pbkdf: Optional[str] = None,
+                 iterations: Optional[int] = None, memory_kib: Optional[int] = None,
+                 parallel: Optional[int] = None, hash: Optional[str] = None,
+                 cipher: Optional[str] = None, key_size: Optional[int] = None, sector_size: int = 512):
+        self.name = name
+        self.description = description
+        self.pbkdf = pbkdf
+        self.iterations = iterations
+        self.memory_kib = memory_kib
+        self.parallel = parallel
+        self.hash = hash
+        self.cipher = cipher
+        self.key_size = key_size
+        self.sector_size = sector_size
+
+    def format_args(self) -> List[str]:
+        args = ["--type", "luks2", "--sector-size", str(self.sector_size)]
+        if self.pbkdf:
+            args += ["--pbkdf", self.pbkdf]
+        if self.iterations:
+            # 固定迭代次数，不按 --iter-time 测速，format 耗时可预期
+            args += ["--pbkdf-force-iterations", str(self.iterations)]
+        if self.memory_kib:
+            args += ["--pbkdf-memory", str(self.memory_kib)]
+        if self.parallel:
+            args += ["--pbkdf-parallel", str(self.parallel)]
+        if self.hash:
+            args += ["--hash", self.hash]
+        if self.cipher:
+            args += ["--cipher", self.cipher]
+        if self.key_size:
+            args += ["--key-size", str(self.key_size)]
+        return args
+
+    def kdf_memory(self) -> int:
+        """打开设备时 PBKDF 占用的内存（字节）"""
+        if self.pbkdf == "pbkdf2":
+            return 0
+        return (self.memory_kib or DEFAULT_ARGON2_MEMORY_KIB) * 1024
+
+    def padded_size(self, size: int) -> int:
+        """数据按扇区大小补齐后的长度，空文件也至少占一个扇区"""
+        return max(-(-size // self.sector_size), 1) * self.sector_size
+
+    def describe(self) -> dict:
+        return {k: v for k, v in vars(self).items() if v is not None}
+
+# 已注册的参数组
+PROFILES: Dict[str, Profile] = {}
+
+def register_profile(profile: Profile):
+    PROFILES[profile.name] = profile
+
+# pbkdf2 的最少迭代次数为 1000；随机 DEK 不需要口令加强，取最小值
+register_profile(Profile("fast", "PBKDF2 最少迭代、AES-XTS 256、4K 扇区",
+                         pbkdf="pbkdf2", iterations=1000, hash="sha256",
+                         cipher="aes-xts-plain64", key_size=512, sector_size=4096))
+# 没有 AES 指令的 CPU 上 Adiantum 比 AES-XTS 快数倍
+register_profile(Profile("adiantum", "PBKDF2 最少迭代、Adiantum、4K 扇区，适合没有 AES 指令的 CPU",
+                         pbkdf="pbkdf2", iterations=1000, hash="sha256",
+                         cipher="xchacha12,aes-adiantum-plain64", key_size=256, sector_size=4096))
+# 仍使用 Argon2，但把内存和迭代限制在最小值附近
+register_profile(Profile("argon2-light", "Argon2id 最小成本（4 轮、32MiB、单线程）、AES-XTS 256、4K 扇区",
+                         pbkdf="argon2id", iterations=4, memory_kib=32 * 1024, parallel=1,
+                         cipher="aes-xts-plain64", key_size=512, sector_size=4096))
+# 与原来的行为相同：cryptsetup 默认参数、512 字节扇区
+register_profile(Profile("compat", "cryptsetup 默认参数（Argon2id 按耗时测速）、512 字节扇区（默认）"))
+
+def load_profiles_file(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for name, params in json.load(f).items():
+            register_profile(Profile(name, **params))
+
+if PROFILES_FILE:
+    load_profiles_file(PROFILES_FILE)
+
+def available_profiles() -> List[str]:
+    return list(PROFILES)
+
+def get_profile(name: str) -> Profile:
+    if name not in PROFILES:
+        raise ValueError(f"不支持的 LUKS 参数组: {name}，可用: {available_profiles()}")
+    return PROFILES[name]
+
+def select_profile(key_name: Optional[str] = None, requested: Optional[str] = None) -> Profile:
+    """请求中指定的参数组优先，其次是根密钥对应的参数组，最后是默认参数组"""
+    return get_profile(requested or KEY_PROFILES.get(key_name) or DEFAULT_PROFILE)
+
+# ---------- 读取 header ----------
+def read_header(header: bytes) -> dict:
+    """从 LUKS header 中读取加密参数（cipher、主密钥位数、扇区大小、PBKDF）"""
+    if header[:6] != b"LUKS\xba\xbe":
+        raise ValueError("不是 LUKS header")
+    version = struct.unpack(">H", header[6:8])[0]
+    if version == 1:
+        # LUKS1 固定 512 字节扇区、PBKDF2
+        cipher = header[8:40].rstrip(b"\0").decode() + "-" + header[40:72].rstrip(b"\0").decode()
+        key_bytes = struct.unpack(">I", header[108:112])[0]
+        return {"version": 1, "cipher": cipher, "key_size": key_bytes * 8, "sector_size": 512,
+                "pbkdf": "pbkdf2", "hash": header[72:104].rstrip(b"\0").decode()}
+    if version != 2:
+        raise ValueError(f"不支持的 LUKS 版本: {version}")
+    hdr_size = struct.unpack(">Q", header[8:16])[0]
+    if len(header) < hdr_size:
+        raise ValueError("LUKS header 不完整")
+    metadata = json.loads(header[LUKS2_JSON_OFFSET:hdr_size].rstrip(b"\0"))
+    segment = next(iter(metadata["segments"].values()))
+    keyslot = next(iter(metadata["keyslots"].values()), {})
+    kdf = keyslot.get("kdf", {})
+    return {
+        "version": 2,
+        "cipher": segment["encryption"],
+        "key_size": keyslot.get("key_size", 0) * 8,
+        "sector_size": segment["sector_size"],
+        "pbkdf": kdf.get("type"),
+        "iterations": kdf.get("iterations") or kdf.get("time"),
+        "memory_kib": kdf.get("memory"),
+        "parallel": kdf.get("cpus"),
+        "hash": kdf.get("hash"),
+    }
+
+# ---------- cryptsetup ----------
+def run_measured(cmd: List[str], input: Optional[bytes] = None):
+    """执行命令，返回 (耗时秒数, 子进程峰值内存 KiB)；命令失败时抛出 CalledProcessError"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE if input is not None else None)
+    if input is not None:
+        proc.stdin.write(input)
+        proc.stdin.close()
+    # wait4 返回这个子进程自己的资源占用
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return elapsed, usage.ru_maxrss
+
+def luks_format(profile: Profile, data_path: str, header_path: str, key: bytes):
+    return run_measured(
+        ["cryptsetup", "luksFormat", *profile.format_args(), "--header", header_path,
+         "--batch-mode", data_path, "--key-file", "-"],
+        input=key,
+    )
+
+def luks_open(data_path: str, header_path: str, mapper_name: str, key: bytes):
+    return run_measured(
+        ["cryptsetup", "open", "--header", header_path, data_path, mapper_name, "--key-file", "-"],
+        input=key,
+    )
+
+def luks_close(mapper_name: str):
+    subprocess.run(["cryptsetup", "close", mapper_name], check=True)
+
+def new_mapper_name() -> str:
+    """每次使用独立的映射名，并行加解密时互不冲突"""
+    return f"luks_{uuid.uuid4().hex[:12]}"
+
+# ---------- 性能测试 ----------
+def benchmark_profile(profile: Profile, size: int, write_block: int = 1024 * 1024) -> dict:
+    """测试一个参数组：luksFormat、open 的耗时和峰值内存，以及写入 size 字节的吞吐量（需要 root 和 cryptsetup）"""
+    key = os.urandom(32)
+    block = os.urandom(write_block)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data_path = os.path.join(tmpdir, "data.img")
+        header_path = os.path.join(tmpdir, "header.bin")
+        with open(data_path, "wb") as f:
+            f.truncate(profile.padded_size(size))
+        format_s, format_kib = luks_format(profile, data_path, header_path, key)
+        mapper_name = new_mapper_name()
+        open_s, open_kib = luks_open(data_path, header_path, mapper_name, key)
+        try:
+            start = time.perf_counter()
+            with open(f"/dev/mapper/{mapper_name}", "wb", buffering=0) as dev:
+                remaining = size
+                while remaining:
+                    n = dev.write(block[:min(remaining, write_block)])
+                    remaining -= n
+                os.fsync(dev.fileno())
+            write_s = time.perf_counter() - start
+        finally:
+            luks_close(mapper_name)
+        with open(header_path, "rb") as f:
+            header = read_header(f.read())
+    return {
+        "profile": profile.name,
+        "format_s": round(format_s, 3),
+        "format_peak_mib": round(format_kib / 1024, 1),
+        "open_s": round(open_s, 3),
+        "open_peak_mib": round(open_kib / 1024, 1),
+        "write_mb_per_s": round(size / write_s / 1024 / 1024, 1),
+        "header": header,
+    }
+
+'''示例（需要 root 和 cryptsetup）
+# 列出参数组
+python shared/luks_profiles.py list
+# 测试所有参数组，写入 256MiB
+python shared/luks_profiles.py bench --size 256
+# 只测试指定参数组，输出 JSON
+python shared/luks_profiles.py bench --profiles fast,compat --json
+'''
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LUKS 参数组")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="列出参数组")
+    p = sub.add_parser("bench", help="测试 format 耗时、写入吞吐量和内存")
+    p.add_argument("--size", type=int, default=256, help="写入的数据量（MiB）")
+    p.add_argument("--profiles", help="逗号分隔的参数组，默认全部")
+    p.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    if args.command == "list":
+        for name, profile in PROFILES.items():
+            flag = " (默认)" if name == DEFAULT_PROFILE else ""
+            print(f"{name}{flag}: {profile.description}")
+            print(f"    cryptsetup luksFormat {' '.join(profile.format_args())}")
+    else:
+        names = args.profiles.split(",") if args.profiles else available_profiles()
+        results = [benchmark_profile(get_profile(name), args.size * 1024 * 1024) for name in names]
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+        else:
+            print(f"{'参数组':<14}{'format(s)':>10}{'峰值(MiB)':>10}{'open(s)':>10}{'峰值(MiB)':>10}{'写入(MB/s)':>12}  cipher / 扇区")
+            for r in results:
+                print(f"{r['profile']:<14}{r['format_s']:>10}{r['format_peak_mib']:>10}{r['open_s']:>10}"
+                      f"{r['open_peak_mib']:>10}{r['write_mb_per_s']:>12}  "
+                      f"{r['header']['cipher']} / {r['header']['sector_size']}")
@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import os
+import sqlite3
+import traceback
+from typing import Callable, Dict, Iterable, List, Optional
+
+# ---------- 数据保留与归档 ----------
+# 已完成的审批记录超过保留期后，按完成日期追加写入压缩的归档文件：
+#   {归档目录}/{表名}/{YYYY-MM-DD}.jsonl.gz
+# 每行一条 JSON 记录，归档后从热表中删除，并用增量 VACUUM 归还空闲页。
+
+# 每批归档的最大行数，避免长时间占用写锁
+ARCHIVE_BATCH_SIZE = 5000
+# 每次增量 VACUUM 归还的最大页数
+VACUUM_PAGES = 2000
+
+def init_incremental_vacuum(conn: sqlite3.Connection):
+    """
+    新建的数据库在建表前开启增量 VACUUM（此时不需要重写文件）；
+    已有的数据库不做改动，需要时停服后用 enable_incremental_vacuum 转换
+    """
+    if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+def enable_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    """
+    将已有数据库转换为增量 VACUUM 模式，需要执行一次完整 VACUUM（重写整个文件并持有写锁），
+    只应在维护窗口通过命令行执行；已是增量模式时返回 False
+    """
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode == 2:
+        return False
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+def incremental_vacuum(conn: sqlite3.Connection, pages: int = VACUUM_PAGES):
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+
+def write_archive(archive_dir: str, table: str, rows: Iterable[Dict], date_key: str):
+    """按 date_key 字段的日期把记录追加到对应的归档文件"""
+    partitions = {}
+    for row in rows:
+        date = (row.get(date_key) or "unknown")[:10]
+        partitions.setdefault(date, []).append(row)
+    table_dir = os.path.join(archive_dir, table)
+    os.makedirs(table_dir, exist_ok=True)
+    for date, items in partitions.items():
+        path = os.path.join(table_dir, f"{date}.jsonl.gz")
+        # gzip 允许多个成员首尾相接，追加写入后仍可作为一个文件读取
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+def query_archive(archive_dir: str, table: str, filters: Optional[Dict] = None,
+                  date_from: Optional[str] = None, date_to: Optional[str] = None,
+                  limit: Optional[int] = None) -> List[Dict]:
+    """
+    查询归档记录：先按文件名中的日期筛选分区，再逐行匹配 filters 中的字段
+    date_from / date_to 为 YYYY-MM-DD，包含两端
+    """
+    filters = filters or {}
+    result = []
+    for path in sorted(glob.glob(os.path.join(archive_dir, table, "*.jsonl.gz"))):
+        date = os.path.basename(path)[:-len(".jsonl.gz")]
+        if (date_from and date < date_from) or (date_to and date > date_to):
+            continue
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                if all(row.get(k) == v for k, v in filters.items()):
+                    result.append(row)
+                    if limit and len(result) >= limit:
+                        return result
+    return result
+
+def is_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+async def run_periodically(job: Callable[[], None], interval: float, name: str):
+    """在线程池中定期执行归档任务，不阻塞事件循环"""
+    while True:
+        try:
+            await asyncio.to_thread(job)
+        except Exception:
+            print(f"{name} 执行失败")
+            traceback.print_exc()
+        await asyncio.sleep(interval)
+
+'''示例
+# 停服后将已有数据库转换为增量 VACUUM 模式（会执行一次完整 VACUUM）
+python shared/retention.py enable-incremental-vacuum ./approval.db
+'''
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="数据库维护工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("enable-incremental-vacuum", help="将已有数据库转换为增量 VACUUM 模式")
+    p.add_argument("paths", nargs="+", help="SQLite 数据库文件")
+    args = parser.parse_args()
+    if args.command == "enable-incremental-vacuum":
+        for path in args.paths:
+            conn = sqlite3.connect(path)
+            converted = enable_incremental_vacuum(conn)
+            conn.close()
+            print(f"{path}: {'已转换为增量 VACUUM 模式' if converted else '已是增量 VACUUM 模式'}")
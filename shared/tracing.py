@@ -0,0 +1,431 @@
+import argparse
+import atexit
+import collections
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException
+
+# ---------- 分布式链路追踪 ----------
+# 不依赖外部服务的轻量追踪：各服务之间通过 W3C traceparent 请求头传递链路上下文，
+#   traceparent: 00-{trace_id 32 位十六进制}-{span_id 16 位十六进制}-{01 采样 / 00 不采样}
+# 每个 HTTP 请求、数据库操作、Vault 调用和加解密都记录为一个 span，
+# 结束的 span 保存在进程内的环形缓冲区中，配置 TRACE_FILE 后同时追加写入 JSONL 文件
+# （span 结束时只放入队列，由后台线程成批编码、写入，文件保持打开，事件循环上不做文件 IO）；
+# 多个服务写入同一个文件时，查看接口和命令行工具可以拼出完整链路并计算关键路径。
+
+# 导出文件，为空时只保存在内存中
+TRACE_FILE = os.environ.get("TRACE_FILE", "")
+# 内存中保留的 span 个数
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "20000"))
+# 新链路的采样比例，下游服务沿用上游的采样决定
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "1.0"))
+# 服务名，install() 时设置
+SERVICE_NAME = os.environ.get("TRACE_SERVICE", "")
+# 等待写入导出文件的 span 个数上限，写文件跟不上时丢弃（内存中的环形缓冲区不受影响）
+TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", "10000"))
+# 后台线程每批最多写入的 span 个数
+EXPORT_BATCH_SIZE = 512
+# /traces 查看接口最多读取导出文件末尾的字节数（只看最近的链路），0 表示读取整个文件
+TRACE_VIEW_MAX_BYTES = int(os.environ.get("TRACE_VIEW_MAX_BYTES", str(64 * 1024 * 1024)))
+
+HEADER = "traceparent"
+
+_current = contextvars.ContextVar("tracing_span", default=None)
+_finished = collections.deque(maxlen=TRACE_BUFFER_SIZE)
+_export_queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+_exporter = None
+_exporter_lock = threading.Lock()
+export_stats = {"exported": 0, "dropped": 0}
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "sampled", "name", "service",
+                 "start", "_t0", "duration", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.name = name
+        self.service = SERVICE_NAME
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._t0
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self.sampled:
+            _record(self)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": self.service,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+def _record(span: Span):
+    item = span.to_dict()
+    _finished.append(item)
+    if TRACE_FILE:
+        _start_exporter()
+        try:
+            _export_queue.put_nowait(item)
+        except queue.Full:
+            export_stats["dropped"] += 1
+
+def _start_exporter():
+    global _exporter
+    if _exporter is not None:
+        return
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = threading.Thread(target=_export_loop, name="trace-exporter", daemon=True)
+            _exporter.start()
+            atexit.register(flush)
+
+def _export_loop():
+    """后台线程：取出队列中已有的 span，编码后一次写入导出文件"""
+    f = path = None
+    while True:
+        items = [_export_queue.get()]
+        while len(items) < EXPORT_BATCH_SIZE:
+            try:
+                items.append(_export_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            if f is None or path != TRACE_FILE:
+                if f is not None:
+                    f.close()
+                path = TRACE_FILE
+                f = open(path, "a", encoding="utf-8")
+            f.write("".join(json.dumps(item, ensure_ascii=False, default=str) + "\n" for item in items))
+            f.flush()
+            export_stats["exported"] += len(items)
+        except (OSError, ValueError):
+            # 文件暂时不可写：丢弃这一批，下一批重新打开文件
+            export_stats["dropped"] += len(items)
+            if f is not None:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+            f = None
+        finally:
+            for _ in items:
+                _export_queue.task_done()
+
+def flush():
+    """等待已结束的 span 写入导出文件（进程退出时自动调用）"""
+    if _exporter is not None:
+        _export_queue.join()
+
+def parse_traceparent(value: Optional[str]):
+    """解析 traceparent，返回 (trace_id, span_id, sampled)，格式不对时返回 None"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+
+def start_span(name: str, parent=None, **attributes) -> Span:
+    """
+    创建 span（不设为当前 span），需要调用方 end()
+    parent 可以是 Span、traceparent 字符串或 None（None 时使用当前 span，没有则开始新链路）
+    """
+    if parent is None:
+        parent = _current.get()
+    if isinstance(parent, Span):
+        return Span(name, parent.trace_id, parent.span_id, parent.sampled, attributes)
+    parsed = parse_traceparent(parent) if isinstance(parent, str) else None
+    if parsed:
+        trace_id, parent_id, sampled = parsed
+        return Span(name, trace_id, parent_id, sampled, attributes)
+    return Span(name, secrets.token_hex(16), None, random.random() < TRACE_SAMPLE_RATE, attributes)
+
+@contextmanager
+def span(name: str, parent=None, **attributes):
+    """在 with 块中记录一个 span，并设为当前 span，块内发出的请求会带上它的上下文"""
+    s = start_span(name, parent, **attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.end(e)
+        raise
+    finally:
+        _current.reset(token)
+        s.end()
+
+def traced(name: str):
+    """装饰器：把函数调用记录为一个 span，同步和异步函数都适用"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+def current_trace_id() -> Optional[str]:
+    s = _current.get()
+    return s.trace_id if s is not None else None
+
+def current_traceparent() -> Optional[str]:
+    s = _current.get()
+    return s.traceparent if s is not None else None
+
+def inject(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """在请求头中加入当前链路上下文"""
+    headers = dict(headers or {})
+    s = _current.get()
+    if s is not None:
+        headers[HEADER] = s.traceparent
+    return headers
+
+# ---------- 服务端中间件 ----------
+class TracingMiddleware:
+    """
+    为每个 HTTP 请求记录一个服务端 span，上游带了 traceparent 时接到上游链路上
+    span 在响应体发送完时结束，之后执行的后台任务不计入请求耗时
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # 查看接口本身不记录
+        if scope["type"] != "http" or scope.get("path", "").startswith("/traces"):
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or [])
+        parent = headers.get(HEADER.encode(), b"").decode("latin-1") or None
+        path = scope.get("path", "")
+        s = start_span(f"{scope['method']} {path}", parent, http_method=scope["method"], http_path=path)
+        token = _current.set(s)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                s.attributes["http_status"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(HEADER.encode(), s.traceparent.encode())]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                s.end()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            s.end(e)
+            raise
+        finally:
+            _current.reset(token)
+            s.end()
+
+def install(app, service: str, prefix: str = ""):
+    """为 FastAPI 应用启用追踪：设置服务名、加入中间件并挂载查看接口"""
+    global SERVICE_NAME
+    SERVICE_NAME = SERVICE_NAME or service
+    app.add_middleware(TracingMiddleware)
+    app.include_router(router, prefix=prefix, tags=["Tracing"])
+
+# ---------- 查看与分析 ----------
+def load_spans(path: Optional[str] = None, max_bytes: int = 0) -> List[dict]:
+    """
+    读取内存中的 span，以及导出文件（多个服务可写同一个文件）中的 span，按 span_id 去重；
+    max_bytes 大于 0 时只读取导出文件末尾的 max_bytes 字节
+    """
+    spans = {item["span_id"]: item for item in list(_finished)}
+    path = path if path is not None else TRACE_FILE
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if 0 < max_bytes < size:
+                f.seek(size - max_bytes)
+                # 丢弃不完整的第一行
+                f.readline()
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue
+                spans.setdefault(item["span_id"], item)
+    return list(spans.values())
+
+def summarize(spans: List[dict]) -> List[dict]:
+    traces = {}
+    for item in spans:
+        traces.setdefault(item["trace_id"], []).append(item)
+    result = []
+    for trace_id, items in traces.items():
+        start = min(i["start"] for i in items)
+        end = max(i["start"] + i["duration_ms"] / 1000 for i in items)
+        ids = {i["span_id"] for i in items}
+        roots = [i for i in items if i["parent_id"] not in ids]
+        root = min(roots or items, key=lambda i: i["start"])
+        result.append({
+            "trace_id": trace_id,
+            "root": root["name"],
+            "start": start,
+            "duration_ms": round((end - start) * 1000, 3),
+            "spans": len(items),
+            "services": sorted({i["service"] for i in items if i["service"]}),
+            "errors": sum(1 for i in items if i["error"]),
+        })
+    result.sort(key=lambda t: t["start"], reverse=True)
+    return result
+
+def critical_path(items: List[dict]) -> List[dict]:
+    """
+    关键路径：从最早的根 span 开始，每一层选结束最晚的子 span，
+    这些 span 决定了整条链路的结束时间；self_ms 为该 span 在关键路径上贡献的耗时，
+    即从它开始到关键子 span 开始之间的时间（后台任务等子 span 可能在父 span 结束后才完成）
+    """
+    if not items:
+        return []
+    children = {}
+    ids = {i["span_id"] for i in items}
+    for item in items:
+        children.setdefault(item["parent_id"], []).append(item)
+    roots = [i for i in items if i["parent_id"] not in ids]
+    node = min(roots or items, key=lambda i: i["start"])
+    path = []
+    while node is not None:
+        kids = children.get(node["span_id"], [])
+        nxt = max(kids, key=lambda i: i["start"] + i["duration_ms"] / 1000) if kids else None
+        path.append({
+            "name": node["name"],
+            "service": node["service"],
+            "span_id": node["span_id"],
+            "duration_ms": node["duration_ms"],
+            "self_ms": round(max(0.0, (nxt["start"] - node["start"]) * 1000) if nxt else node["duration_ms"], 3),
+        })
+        node = nxt
+    return path
+
+def trace_detail(trace_id: str, path: Optional[str] = None, max_bytes: int = 0) -> Optional[dict]:
+    items = [i for i in load_spans(path, max_bytes) if i["trace_id"] == trace_id]
+    if not items:
+        return None
+    items.sort(key=lambda i: i["start"])
+    t0 = items[0]["start"]
+    for item in items:
+        item["offset_ms"] = round((item["start"] - t0) * 1000, 3)
+    return {
+        "trace_id": trace_id,
+        "summary": summarize(items)[0],
+        "critical_path": critical_path(items),
+        "spans": items,
+    }
+
+router = APIRouter()
+
+'''示例
+curl -X GET "http://localhost:8000/traces?limit=20&min_duration_ms=100"
+curl -X GET http://localhost:8000/traces/<trace_id>
+'''
+# 查看接口要读取、解析导出文件，定义为普通函数，由 FastAPI 放到线程池中执行，不阻塞事件循环
+
+# 最近的链路列表，可按服务名和最小耗时过滤
+@router.get("/traces")
+def list_traces(limit: int = 50, service: Optional[str] = None, min_duration_ms: float = 0):
+    traces = summarize(load_spans(max_bytes=TRACE_VIEW_MAX_BYTES))
+    traces = [
+        t for t in traces
+        if t["duration_ms"] >= min_duration_ms and (not service or service in t["services"])
+    ]
+    return {"count": len(traces[:limit]), "traces": traces[:limit]}
+
+# 单条链路的全部 span 及关键路径
+@router.get("/traces/{trace_id}")
+def get_trace(trace_id: str):
+    detail = trace_detail(trace_id, max_bytes=TRACE_VIEW_MAX_BYTES)
+    if detail is None:
+        raise HTTPException(status_code=404, detail="未找到该链路")
+    return detail
+
+def print_trace(detail: dict):
+    """以瀑布图形式打印一条链路"""
+    summary = detail["summary"]
+    print(f"trace {detail['trace_id']}  {summary['duration_ms']:.1f}ms  {summary['spans']} spans")
+    scale = 60 / max(summary["duration_ms"], 0.001)
+    depth = {}
+    ids = {s["span_id"] for s in detail["spans"]}
+    for s in detail["spans"]:
+        depth[s["span_id"]] = depth.get(s["parent_id"], -1) + 1 if s["parent_id"] in ids else 0
+        bar = " " * int(s["offset_ms"] * scale) + "#" * max(1, int(s["duration_ms"] * scale))
+        label = "  " * depth[s["span_id"]] + f"{s['service']}:{s['name']}"
+        flag = " !" if s["error"] else ""
+        print(f"{label[:48]:<48} {s['duration_ms']:>10.1f}ms |{bar:<61}|{flag}")
+    print("关键路径:")
+    for step in detail["critical_path"]:
+        print(f"  {step['service']}:{step['name']}  {step['duration_ms']:.1f}ms (自身 {step['self_ms']:.1f}ms)")
+
+'''示例
+# 列出导出文件中最慢的链路
+python shared/tracing.py view traces.jsonl
+# 查看一条链路的瀑布图和关键路径
+python shared/tracing.py view traces.jsonl --trace <trace_id>
+'''
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查看追踪导出文件")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("view", help="查看链路")
+    p.add_argument("file")
+    p.add_argument("--trace", help="链路 ID，不指定时列出最慢的链路")
+    p.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+    if args.trace:
+        detail = trace_detail(args.trace, args.file)
+        if detail is None:
+            raise SystemExit("未找到该链路")
+        print_trace(detail)
+    else:
+        traces = sorted(summarize(load_spans(args.file)), key=lambda t: t["duration_ms"], reverse=True)
+        for t in traces[:args.limit]:
+            print(f"{t['trace_id']}  {t['duration_ms']:>10.1f}ms  {t['spans']:>4} spans  "
+                  f"{','.join(t['services'])}  {t['root']}")
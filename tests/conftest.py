@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+# 各服务按部署时的方式导入（模块在各自目录下直接 import），并在临时目录中运行：
+# 数据/函数提供方从 config.py 读取配置，协调器的数据库路径相对于当前目录
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="approval-tests-")
+
+with open(os.path.join(WORKDIR, "config.py"), "w") as f:
+    f.write(
+        'VAULT_ADDR = "http://127.0.0.1:8200"\n'
+        'VAULT_TOKEN = "test-token"\n'
+        f'DB_PATH = {os.path.join(WORKDIR, "provider.db")!r}\n'
+    )
+os.chdir(WORKDIR)
+sys.path[:0] = [
+    WORKDIR,
+    os.path.join(ROOT, "shared"),
+    os.path.join(ROOT, "data_function_provider"),
+    os.path.join(ROOT, "Other parties"),
+    os.path.join(ROOT, "loadtest"),
+]
+
+import pytest
+
+@pytest.fixture
+def fake_vault(monkeypatch):
+    """vault_server 发往 Vault 的请求改由 loadtest/fake_vault.py 处理"""
+    from fastapi.testclient import TestClient
+    import fake_vault as vault_app
+    import vault_server
+
+    client = TestClient(vault_app.app)
+
+    def route(method):
+        def call(url, **kwargs):
+            return client.request(method, url[url.index("/v1"):], json=kwargs.get("json"))
+        return call
+
+    monkeypatch.setattr(vault_server.requests, "get", route("GET"))
+    monkeypatch.setattr(vault_server.requests, "post", route("POST"))
+    return vault_app
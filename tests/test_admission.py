@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import admission
+import main
+import vault_server
+
+def test_waiters_are_admitted_in_arrival_order():
+    budget = admission.MemoryBudget(100)
+    order = []
+
+    async def take(size, tag):
+        await budget.acquire_async(size)
+        order.append(tag)
+
+    async def scenario():
+        await budget.acquire_async(60)
+        big = asyncio.create_task(take(60, "big"))
+        await asyncio.sleep(0)
+        # 放得下的小请求也排在先到的大请求后面，大请求不会被饿死
+        small = asyncio.create_task(take(10, "small"))
+        await asyncio.sleep(0.01)
+        assert order == []
+        assert budget.stats()["queue_depth"] == 2
+        budget.release(60)
+        await asyncio.wait_for(asyncio.gather(big, small), 1)
+
+    asyncio.run(scenario())
+    assert order == ["big", "small"]
+    assert budget.stats()["in_flight_bytes"] == 70
+
+def test_oversize_request_runs_when_idle():
+    budget = admission.MemoryBudget(100, max_wait=0.05)
+    budget.acquire(500)
+    assert budget.stats()["in_flight_bytes"] == 500
+    # 超出预算的请求进行时，其他请求排队直到超时
+    with pytest.raises(admission.Overloaded):
+        budget.acquire(1)
+    budget.release(500)
+    budget.acquire(500)
+    assert budget.stats()["active"] == 1
+
+def test_full_queue_is_rejected_with_retry_after():
+    budget = admission.MemoryBudget(100, max_queue=0)
+    budget.acquire(100)
+    budget.release(100, held=10.0)
+    budget.acquire(100)
+    with pytest.raises(admission.Overloaded) as e:
+        budget.acquire(1)
+    # 按平均占用时间估计：10 秒 × 平滑系数
+    assert e.value.retry_after == 2
+    assert budget.stats()["rejected"] == 1
+    assert budget.overloaded() is not None
+
+def test_cancelled_waiter_leaves_queue():
+    budget = admission.MemoryBudget(100)
+
+    async def scenario():
+        await budget.acquire_async(100)
+        waiter = asyncio.create_task(budget.acquire_async(50))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        budget.release(100)
+
+    asyncio.run(scenario())
+    assert budget.stats()["queue_depth"] == 0
+    assert budget.stats()["in_flight_bytes"] == 0
+
+@pytest.mark.parametrize("max_queue,max_wait", [(0, 30.0), (4, 0.05)])
+def test_encrypt_file_returns_429(fake_vault, monkeypatch, max_queue, max_wait):
+    budget = admission.MemoryBudget(100, max_queue, max_wait, "vault")
+    monkeypatch.setattr(vault_server, "memory_budget", budget)
+    budget.acquire(100)
+    r = TestClient(main.app).post("/vault/encrypt_file", files={"file": ("data.bin", b"hello")},
+                                  data={"sym_key_name": "test-key"})
+    assert r.status_code == 429
+    assert 1 <= int(r.headers["Retry-After"]) <= 60
+    budget.release(100)
+    assert budget.stats()["in_flight_bytes"] == 0
@@ -0,0 +1,59 @@
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+from config import DB_PATH
+import approval_server
+import main
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+def add_pending(client_id):
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute(
+        "INSERT INTO approvals (client_id, content, base_apiurl, timestart, result, status) "
+        "VALUES (?, '申请', 'http://coordinator.test/', '2025-01-01T00:00:00', NULL, 0)", (client_id,)
+    )
+    conn.commit()
+    conn.close()
+    approval_server.bump_approvals_version()
+
+def get(client, if_none_match=None, **params):
+    headers = {"If-None-Match": if_none_match} if if_none_match is not None else {}
+    return client.get("/approval/get_approvals", params={"type": "pending", **params}, headers=headers)
+
+@pytest.mark.parametrize("header,matches", [
+    ("{etag}", True),
+    ("W/{etag}", True),
+    ('"other", {etag}', True),
+    ("*", True),
+    ("", False),
+    ('"other"', False),
+    # 子串不算命中
+    ('"x{bare}x"', False),
+    ("{bare}", False),
+])
+def test_etag_matches(header, matches):
+    etag = approval_server.approvals_etag(12, ("pending", None, 100))
+    header = header.format(etag=etag, bare=etag.strip('"'))
+    assert approval_server.etag_matches(header, etag) is matches
+
+def test_not_modified_until_next_write(client):
+    add_pending("cache-1")
+    first = get(client)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert "cache-1" in {row["client_id"] for row in first.json()["data"]}
+    assert get(client, etag).status_code == 304
+    assert get(client, f'"stale", W/{etag}').status_code == 304
+    # 其他分页的 ETag 不能命中
+    assert get(client, etag, page=1).status_code == 200
+
+    add_pending("cache-2")
+    fresh = get(client, etag)
+    assert fresh.status_code == 200
+    assert fresh.headers["etag"] != etag
+    assert "cache-2" in {row["client_id"] for row in fresh.json()["data"]}
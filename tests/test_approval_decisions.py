@@ -0,0 +1,56 @@
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+from config import DB_PATH
+import main
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+def add_pending(client_id):
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute(
+        "INSERT INTO approvals (client_id, content, base_apiurl, timestart, result, status) "
+        "VALUES (?, '申请', 'http://coordinator.test/', '2025-01-01T00:00:00', NULL, 0)", (client_id,)
+    )
+    conn.commit()
+    conn.close()
+
+def outbox_results(client_id):
+    conn = sqlite3.connect(DB_PATH)
+    found = [row[0] for row in conn.execute("SELECT result FROM outbox WHERE client_id = ? ORDER BY id", (client_id,))]
+    conn.close()
+    return found
+
+def decide(client, client_id, result):
+    return client.post("/approval/submit_decision", json={"client_id": client_id, "result": result})
+
+def test_decision_is_final(client):
+    add_pending("decide-once")
+    assert decide(client, "decide-once", "yes").status_code == 200
+    # 重复提交相同决定不再转发
+    assert decide(client, "decide-once", "yes").status_code == 200
+    assert decide(client, "decide-once", "no").status_code == 409
+    assert outbox_results("decide-once") == ["yes"]
+
+def test_batch_decisions_skip_decided(client):
+    add_pending("batch-new")
+    add_pending("batch-same")
+    add_pending("batch-changed")
+    decide(client, "batch-same", "yes")
+    decide(client, "batch-changed", "yes")
+    r = client.post("/approval/submit_decisions", json={"decisions": [
+        {"client_id": "batch-new", "result": "no"},
+        {"client_id": "batch-same", "result": "yes"},
+        {"client_id": "batch-changed", "result": "no"},
+        {"client_id": "batch-missing", "result": "yes"},
+    ]}).json()
+    assert r["updated"] == 1
+    assert r["conflicts"] == ["batch-changed"]
+    assert r["missing"] == ["batch-missing"]
+    assert outbox_results("batch-new") == ["no"]
+    assert outbox_results("batch-same") == ["yes"]
+    assert outbox_results("batch-changed") == ["yes"]
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import coordinator
+import main
+import vault_server
+
+SECRET = "test-approval-secret"
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setattr(coordinator, "APPROVAL_TOKEN_SECRET", SECRET)
+    monkeypatch.setattr(vault_server, "APPROVAL_TOKEN_SECRET", SECRET)
+
+def issue(client_id="token-client", key_names=None):
+    return coordinator.issue_approval_token(client_id, json.dumps(key_names) if key_names else None)
+
+def test_valid_token():
+    token = issue(key_names=["k1"])
+    assert vault_server.verify_approval_token(token, "token-client", "k1") is None
+
+def test_token_is_bound_to_client_and_keys():
+    token = issue(key_names=["k1"])
+    assert vault_server.verify_approval_token(token, "other-client", "k1") == "审批令牌与 client_id 不匹配"
+    assert vault_server.verify_approval_token(token, "token-client", "k2") == "审批令牌不允许解密该密钥"
+    assert vault_server.verify_approval_token(issue(), "token-client", "any-key") is None
+
+def test_expired_token(monkeypatch):
+    monkeypatch.setattr(coordinator, "APPROVAL_TOKEN_TTL", -1)
+    assert vault_server.verify_approval_token(issue(), "token-client", "k1") == "审批令牌已过期"
+
+def test_tampered_token():
+    body, sig = issue().split(".")
+    forged = vault_server._b64url_decode(body).replace(b"token-client", b"evil-client")
+    token = f"{coordinator._b64url(forged)}.{sig}"
+    assert vault_server.verify_approval_token(token, "evil-client", "k1") == "审批令牌签名无效"
+
+def test_revocation_requires_signature_and_reaches_other_replicas(monkeypatch):
+    token = issue()
+    jti = vault_server.parse_approval_token(token)["jti"]
+    client = TestClient(main.app)
+    r = client.post("/vault/revoke_token", data={"approval_token": token, "signature": "forged"})
+    assert r.status_code == 403
+    assert vault_server.verify_approval_token(token, "token-client", "k1") is None
+
+    r = client.post("/vault/revoke_token", data={
+        "approval_token": token, "signature": vault_server.revocation_signature(jti),
+    })
+    assert r.status_code == 200
+    assert vault_server.verify_approval_token(token, "token-client", "k1") == "审批令牌已被吊销"
+
+    # 另一个副本：本地吊销缓存为空，从共用的审批数据库同步后同样拒绝
+    monkeypatch.setattr(vault_server, "_revoked_tokens", {})
+    monkeypatch.setattr(vault_server, "_revocation_sync", {"rowid": 0, "at": 0.0})
+    assert vault_server.verify_approval_token(token, "token-client", "k1") == "审批令牌已被吊销"
@@ -0,0 +1,131 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import coordinator
+
+SERVERS = ["http://127.0.0.1:9001", "http://127.0.0.1:9002", "http://127.0.0.1:9003"]
+
+@pytest.fixture
+def client(monkeypatch):
+    # 不实际通知审批服务器
+    async def noop(*args, **kwargs):
+        pass
+    monkeypatch.setattr(coordinator, "send_approval", noop)
+    monkeypatch.setattr(coordinator, "send_approvals", noop)
+    with TestClient(coordinator.app) as c:
+        yield c
+
+def start(client, client_id, servers=SERVERS):
+    r = client.post("/start_approval", json={"client_id": client_id, "server_urls": servers, "content": "test"})
+    assert r.status_code == 200
+
+def result(client, client_id, server, answer="yes"):
+    return client.post("/receive_result", json={"client_id": client_id, "server_url": server + "/", "result": answer})
+
+def final(client, client_id):
+    return client.get(f"/get_results/{client_id}").json()["results"][0]
+
+def test_all_yes_finishes(client):
+    start(client, "all-yes")
+    for server in SERVERS:
+        result(client, "all-yes", server)
+    assert final(client, "all-yes") == "yes"
+
+def test_duplicate_result_is_not_counted_twice(client):
+    # 发件箱至少投递一次：同一审批服务器的结果重复到达不能让任务提前收齐
+    start(client, "dup-single")
+    for _ in range(len(SERVERS)):
+        assert result(client, "dup-single", SERVERS[0]).status_code == 200
+    assert final(client, "dup-single") is None
+    for server in SERVERS[1:]:
+        result(client, "dup-single", server)
+    assert final(client, "dup-single") == "yes"
+
+def test_duplicate_batch_delivery(client):
+    start(client, "dup-batch")
+    batch = {"results": [{"client_id": "dup-batch", "server_url": SERVERS[0] + "/", "result": "yes"}]}
+    for _ in range(len(SERVERS)):
+        r = client.post("/receive_results", json=batch)
+        assert r.json()["finished"] == []
+    assert final(client, "dup-batch") is None
+    r = client.post("/receive_results", json={"results": [
+        {"client_id": "dup-batch", "server_url": server + "/", "result": "yes"} for server in SERVERS
+    ]})
+    assert r.json()["finished"] == ["dup-batch"]
+    assert final(client, "dup-batch") == "yes"
+
+def test_result_only_updates_its_own_server(client):
+    start(client, "per-server")
+    result(client, "per-server", SERVERS[0], "no")
+    result(client, "per-server", SERVERS[1], "yes")
+    result(client, "per-server", SERVERS[2], "yes")
+    assert final(client, "per-server") == "no"
+    rows = {r["server_url"]: r["result"] for r in coordinator.get_results_by_client("per-server")}
+    assert rows == {SERVERS[0] + "/": "no", SERVERS[1] + "/": "yes", SERVERS[2] + "/": "yes"}
+
+def test_unknown_server_is_ignored(client):
+    start(client, "unknown-server", SERVERS[:1])
+    result(client, "unknown-server", "http://127.0.0.1:9999")
+    assert final(client, "unknown-server") is None
+
+def test_token_requires_result_secret(client, monkeypatch):
+    monkeypatch.setattr(coordinator, "APPROVAL_TOKEN_SECRET", "test-secret")
+    r = client.post("/start_approval", json={"client_id": "secret-holder", "server_urls": SERVERS[:1],
+                                             "content": "test"})
+    secret = r.json()["result_secret"]
+    result(client, "secret-holder", SERVERS[0])
+
+    anonymous = client.get("/get_results/secret-holder").json()
+    assert anonymous["results"] == ["yes"]
+    assert anonymous["token"] is None
+    wrong = client.get("/get_results/secret-holder", headers={"X-Result-Secret": "guess"}).json()
+    assert wrong["token"] is None
+    owner = client.get("/get_results/secret-holder", headers={"X-Result-Secret": secret}).json()
+    assert owner["token"].count(".") == 1
+
+def test_batch_start_returns_result_secrets(client):
+    r = client.post("/start_approvals", json={"requests": [
+        {"client_id": "batch-secret-1", "server_urls": SERVERS, "content": "test"},
+        {"client_id": "batch-secret-2", "server_urls": SERVERS, "content": "test"},
+    ]}).json()
+    assert set(r["result_secrets"]) == {"batch-secret-1", "batch-secret-2"}
+    again = client.post("/start_approvals", json={"requests": [
+        {"client_id": "batch-secret-1", "server_urls": SERVERS, "content": "test"},
+    ]}).json()
+    assert again["duplicates"] == ["batch-secret-1"]
+    assert again["result_secrets"] == {}
+
+def test_start_approvals_notifies_each_server_once(client, monkeypatch):
+    calls = []
+
+    async def record(server_url, approvals):
+        calls.append((server_url, [a["client_id"] for a in approvals]))
+    monkeypatch.setattr(coordinator, "send_approvals", record)
+    r = client.post("/start_approvals", json={"requests": [
+        {"client_id": "bulk-1", "server_urls": SERVERS[:2], "content": "test"},
+        {"client_id": "bulk-2", "server_urls": SERVERS[1:], "content": "test"},
+    ]}).json()
+    assert r["started"] == 2
+    assert sorted(calls) == [(SERVERS[0], ["bulk-1"]), (SERVERS[1], ["bulk-1", "bulk-2"]), (SERVERS[2], ["bulk-2"])]
+    for server in SERVERS[:2]:
+        result(client, "bulk-1", server)
+    assert final(client, "bulk-1") == "yes"
+
+def test_server_urls_are_normalized_and_deduplicated(client):
+    # 结尾带 / 的地址与不带 / 的地址视为同一审批服务器
+    r = client.post("/start_approvals", json={"requests": [
+        {"client_id": "bulk-slash", "server_urls": [SERVERS[0] + "/", SERVERS[0], SERVERS[1] + "/"],
+         "content": "test"},
+    ]})
+    assert r.status_code == 200
+    assert r.json()["started"] == 1
+    rows = {row["server_url"] for row in coordinator.get_results_by_client("bulk-slash")}
+    assert rows == {SERVERS[0] + "/", SERVERS[1] + "/"}
+    result(client, "bulk-slash", SERVERS[0])
+    assert final(client, "bulk-slash") is None
+    result(client, "bulk-slash", SERVERS[1])
+    assert final(client, "bulk-slash") == "yes"
+
+    start(client, "single-slash", [SERVERS[2] + "/", SERVERS[2]])
+    result(client, "single-slash", SERVERS[2])
+    assert final(client, "single-slash") == "yes"
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+import coordinator_db
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    monkeypatch.setattr(coordinator_db, "DB_PATH", str(tmp_path / "approval_results.db"))
+    return tmp_path
+
+def add_task(client_id, shard_count, servers=("http://a/", "http://b/")):
+    path = coordinator_db.shard_paths(shard_count)[coordinator_db.shard_index(client_id, shard_count)]
+    conn = coordinator_db.connect_path(path)
+    conn.execute("INSERT INTO approvals (client_id, total_count, receive_count) VALUES (?, ?, 0)",
+                 (client_id, len(servers)))
+    conn.executemany("INSERT INTO approval_results (client_id, server_url, result) VALUES (?, ?, 'yes')",
+                     [(client_id, server) for server in servers])
+    conn.commit()
+    conn.close()
+
+def rows(shard_count):
+    found = {}
+    for path in coordinator_db.shard_paths(shard_count):
+        conn = coordinator_db.connect_path(path)
+        approvals = [row[0] for row in conn.execute("SELECT client_id FROM approvals")]
+        results = [row[0] for row in conn.execute("SELECT client_id FROM approval_results")]
+        conn.close()
+        found[path] = (approvals, results)
+    return found
+
+def test_shard_index_is_stable():
+    # 分片位置不能随进程的哈希种子变化
+    assert coordinator_db.shard_index("client_001", 8) == coordinator_db.shard_index("client_001", 8)
+    assert {coordinator_db.shard_index(f"client_{i}", 4) for i in range(200)} == {0, 1, 2, 3}
+    assert coordinator_db.shard_index("client_001", 1) == 0
+
+def test_shard_paths_include_shard_count(shards):
+    assert coordinator_db.shard_paths(1) == [coordinator_db.DB_PATH]
+    assert os.path.basename(coordinator_db.shard_paths(4)[2]) == "approval_results.2-of-4.db"
+
+@pytest.mark.parametrize("old_count,new_count", [(1, 4), (4, 3), (3, 1)])
+def test_reshard_moves_every_task_to_its_new_shard(shards, old_count, new_count):
+    coordinator_db.init_db(old_count)
+    client_ids = [f"client_{i}" for i in range(50)]
+    for client_id in client_ids:
+        add_task(client_id, old_count)
+
+    coordinator_db.reshard(old_count, new_count)
+
+    moved = rows(new_count)
+    new_paths = coordinator_db.shard_paths(new_count)
+    for client_id in client_ids:
+        path = new_paths[coordinator_db.shard_index(client_id, new_count)]
+        assert moved[path][0].count(client_id) == 1
+        assert moved[path][1].count(client_id) == 2
+    assert sum(len(approvals) for approvals, _ in moved.values()) == len(client_ids)
+    # 迁移后删除旧分片文件
+    for path in coordinator_db.shard_paths(old_count):
+        assert path in new_paths or not os.path.exists(path)
+
+def test_reshard_keep_leaves_old_shards(shards):
+    coordinator_db.init_db(2)
+    add_task("kept", 2)
+    coordinator_db.reshard(2, 3, keep=True)
+    assert all(os.path.exists(path) for path in coordinator_db.shard_paths(2))
+    assert any("kept" in approvals for approvals, _ in rows(3).values())
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import deadlines
+from deadlines import DeadlineScheduler
+
+async def never(client_ids):
+    raise AssertionError("不应调用 expire")
+
+def test_discarded_entries_are_skipped_lazily():
+    scheduler = DeadlineScheduler(never)
+    scheduler.add("done", 100.0)
+    scheduler.add("open", 200.0)
+    scheduler.discard("done")
+    # 堆中的旧条目在弹出时才删除
+    assert len(scheduler) == 1
+    assert len(scheduler._heap) == 2
+    assert scheduler.next_deadline() == 200.0
+    assert len(scheduler._heap) == 1
+    assert scheduler.pop_expired(300.0, 10) == ["open"]
+    assert scheduler.next_deadline() is None
+
+def test_readded_client_uses_latest_deadline():
+    scheduler = DeadlineScheduler(never)
+    scheduler.add("moved", 100.0)
+    scheduler.add("moved", 500.0)
+    assert scheduler.pop_expired(200.0, 10) == []
+    assert scheduler.pop_expired(600.0, 10) == ["moved"]
+
+def test_pop_expired_respects_limit_and_order():
+    scheduler = DeadlineScheduler(never)
+    scheduler.load([(f"c{i}", float(i)) for i in range(5)])
+    assert scheduler.pop_expired(10.0, 2) == ["c0", "c1"]
+    assert scheduler.pop_expired(3.0, 10) == ["c2", "c3"]
+    assert len(scheduler) == 1
+
+def test_heap_is_compacted_when_mostly_stale(monkeypatch):
+    monkeypatch.setattr(deadlines, "COMPACT_SLACK", 2)
+    scheduler = DeadlineScheduler(never)
+    for i in range(20):
+        scheduler.add(f"c{i}", 1000.0 + i)
+    for i in range(15):
+        scheduler.discard(f"c{i}")
+    assert len(scheduler) == 5
+    assert len(scheduler._heap) <= 2 * len(scheduler) + deadlines.COMPACT_SLACK
+    assert scheduler.pop_expired(2000.0, 100) == [f"c{i}" for i in range(15, 20)]
+
+def run_until(scheduler, done, timeout=5.0):
+    async def scenario():
+        scheduler.start()
+        try:
+            start = time.monotonic()
+            while not done() and time.monotonic() - start < timeout:
+                await asyncio.sleep(0.01)
+        finally:
+            scheduler.stop()
+    asyncio.run(scenario())
+
+def test_failed_batch_is_retried(monkeypatch):
+    monkeypatch.setattr(deadlines, "RETRY_DELAY", 0.05)
+    calls = []
+
+    async def flaky(client_ids):
+        calls.append(list(client_ids))
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+
+    scheduler = DeadlineScheduler(flaky)
+    now = time.time()
+    scheduler.load([("a", now - 1), ("b", now - 1)])
+    run_until(scheduler, lambda: scheduler.stats["expired"] == 2)
+    assert [sorted(c) for c in calls] == [["a", "b"], ["a", "b"]]
+    assert scheduler.stats == {"expired": 2, "batches": 1, "failures": 1}
+    assert len(scheduler) == 0
+
+def test_earlier_deadline_wakes_the_scheduler():
+    expired = []
+
+    async def expire(client_ids):
+        expired.extend(client_ids)
+
+    scheduler = DeadlineScheduler(expire, batch_size=2)
+
+    async def scenario():
+        scheduler.add("later", time.time() + 3600)
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        # 调度协程正在睡到一小时后，新加入的截止时间须立即唤醒它
+        soon = time.time() + 0.05
+        for i in range(3):
+            scheduler.add(f"soon-{i}", soon)
+        start = time.monotonic()
+        while len(expired) < 3 and time.monotonic() - start < 5:
+            await asyncio.sleep(0.01)
+        scheduler.stop()
+
+    asyncio.run(scenario())
+    assert sorted(expired) == ["soon-0", "soon-1", "soon-2"]
+    assert scheduler.stats["batches"] == 2
+    assert len(scheduler) == 1
@@ -0,0 +1,87 @@
+import base64
+import io
+import json
+import os
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+import chunk_store
+import envelope_format
+import main
+import vault_server
+
+pytestmark = pytest.mark.skipif(not envelope_format.available_backends(), reason="未安装 cryptography")
+
+KEY_NAME = "dedup-key"
+
+@pytest.fixture
+def client(fake_vault, tmp_path, monkeypatch):
+    monkeypatch.setattr(chunk_store, "STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(vault_server, "DEDUP_AVG_CHUNK_SIZE", 4096)
+    chunk_store.init_store()
+    yield TestClient(main.app)
+    vault_server.invalidate_key(KEY_NAME)
+
+def encrypt(client, data, **fields):
+    r = client.post("/vault/encrypt_file", files={"file": ("model.bin", data)},
+                    data={"sym_key_name": KEY_NAME, "dedup": "true", **fields})
+    assert r.status_code == 200
+    return r
+
+def open_envelope(client, content: bytes) -> bytes:
+    with zipfile.ZipFile(io.BytesIO(content)) as z:
+        manifest = json.loads(z.read(envelope_format.MANIFEST_NAME))
+        recipe = envelope_format.load_recipe(z)
+        ciphertext_key = z.read("encrypted_key.txt").decode()
+    store_key = base64.b64decode(vault_server.decrypt_datakeys(KEY_NAME, [ciphertext_key])[0])
+    # 与 tee 一样通过 /chunks 接口按清单取分块
+    blobs = [client.get(f"/vault/chunks/{chunk_id}").content
+             for chunk_id, _ in envelope_format.recipe_entries(recipe)]
+    out = io.BytesIO()
+    envelope_format.decrypt_recipe(store_key, manifest, recipe, blobs, out)
+    return out.getvalue()
+
+def test_repeated_content_is_stored_once(client):
+    data = os.urandom(200 * 1024)
+    before = client.get("/vault/chunks", params={"key_name": KEY_NAME}).json()
+    first = encrypt(client, data)
+    chunks = int(first.headers["x-dedup-chunks"])
+    assert chunks > 1
+    assert int(first.headers["x-dedup-new-chunks"]) == chunks
+    assert open_envelope(client, first.content) == data
+
+    second = encrypt(client, data, compression="zlib")
+    assert second.headers["x-dedup-new-chunks"] == "0"
+    assert second.headers["x-dedup-new-bytes"] == "0"
+    assert open_envelope(client, second.content) == data
+    stats = client.get("/vault/chunks", params={"key_name": KEY_NAME}).json()
+    assert stats["chunks"] - before["chunks"] == chunks
+    assert stats["plaintext_bytes"] - before["plaintext_bytes"] == len(data)
+
+def test_local_edit_only_stores_nearby_chunks(client):
+    data = bytearray(os.urandom(200 * 1024))
+    chunks = int(encrypt(client, bytes(data)).headers["x-dedup-chunks"])
+    data[100 * 1024:100 * 1024 + 16] = os.urandom(16)
+    edited = encrypt(client, bytes(data))
+    # 内容定义分块：修改处之外的分块边界不变
+    assert 0 < int(edited.headers["x-dedup-new-chunks"]) <= 3 < chunks
+    assert open_envelope(client, edited.content) == bytes(data)
+
+def test_chunk_download(client):
+    r = encrypt(client, os.urandom(10000))
+    with zipfile.ZipFile(io.BytesIO(r.content)) as z:
+        chunk_id = envelope_format.recipe_entries(envelope_format.load_recipe(z))[0][0]
+    chunk = client.get(f"/vault/chunks/{chunk_id}")
+    assert chunk.status_code == 200
+    assert chunk.headers["etag"] == f'"{chunk_id}"'
+    assert client.get("/vault/chunks/" + "0" * 64).status_code == 404
+    assert client.get("/vault/chunks/..%2Fconfig.py").status_code == 404
+
+def test_dedup_requires_chunk_store(fake_vault, monkeypatch):
+    monkeypatch.setattr(chunk_store, "STORE_DIR", "")
+    r = TestClient(main.app).post("/vault/encrypt_file", files={"file": ("a.bin", b"x")},
+                                  data={"sym_key_name": KEY_NAME, "dedup": "true"})
+    assert r.status_code == 400
+    assert "ENVELOPE_CHUNK_STORE_DIR" in r.json()["detail"]
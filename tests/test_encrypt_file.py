@@ -0,0 +1,58 @@
+import io
+import json
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+import envelope_format
+import main
+import vault_server
+
+aead_only = pytest.mark.skipif(not envelope_format.available_backends(), reason="未安装 cryptography")
+
+@pytest.fixture
+def client(fake_vault):
+    return TestClient(main.app)
+
+def encrypt(client, data=b"hello envelope", **fields):
+    return client.post("/vault/encrypt_file", files={"file": ("data.bin", data)},
+                       data={"sym_key_name": "test-key", **fields})
+
+def test_default_format_is_luks(client):
+    assert vault_server.ENVELOPE_FORMAT == "luks"
+    assert client.get("/vault/crypto_backends").json()["format"] == "luks2"
+
+def test_unknown_format_is_rejected(client):
+    assert encrypt(client, format="bogus").status_code == 400
+
+def test_batch_requires_aead(client):
+    r = encrypt(client, batch_id="batch-1")
+    assert r.status_code == 400
+    assert "format=aead" in r.json()["detail"]
+
+@pytest.mark.parametrize("fields", [{"dedup": "true"}, {"dedup": "true", "format": "aead"}])
+def test_batch_is_rejected_with_dedup(client, fields):
+    r = encrypt(client, batch_id="batch-1", **fields)
+    assert r.status_code == 400
+    assert "batch_id" in r.json()["detail"]
+
+@aead_only
+def test_aead_is_opt_in_per_request(client):
+    r = encrypt(client, format="aead")
+    assert r.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(r.content)) as z:
+        names = set(z.namelist())
+        manifest = json.loads(z.read(envelope_format.MANIFEST_NAME))
+    assert {envelope_format.DATA_NAME, envelope_format.MANIFEST_NAME, "encrypted_key.txt"} <= names
+    assert manifest["format"] == envelope_format.FORMAT_NAME
+
+@pytest.mark.parametrize("fields", [
+    {"digest": "md5"},
+    {"format": "aead", "compression": "lzma"},
+    {"format": "aead", "digest": "md5"},
+])
+def test_invalid_options_are_client_errors(client, fields):
+    r = encrypt(client, **fields)
+    assert r.status_code == 400
+    assert "不支持" in r.json()["detail"]
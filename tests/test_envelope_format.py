@@ -0,0 +1,162 @@
+import hashlib
+import io
+import json
+import os
+import zipfile
+
+import pytest
+
+import envelope_format
+
+pytestmark = pytest.mark.skipif(not envelope_format.available_backends(), reason="未安装 cryptography")
+
+BACKEND = "aes-256-gcm"
+CHUNK_SIZE = 64 * 1024
+
+def seal(data: bytes, key: bytes, **options):
+    """返回 (信封头, 密文帧)，信封头经过一次 JSON 往返，与从 zip 中读出时一致"""
+    dst = io.BytesIO()
+    manifest = envelope_format.encrypt_stream(key, io.BytesIO(data), dst, BACKEND, CHUNK_SIZE, **options)
+    return json.loads(json.dumps(manifest)), dst.getvalue()
+
+def open_stream(key: bytes, manifest: dict, frames: bytes) -> bytes:
+    out = io.BytesIO()
+    envelope_format.decrypt_stream(key, manifest, io.BytesIO(frames), out)
+    return out.getvalue()
+
+@pytest.mark.parametrize("size", [0, 10, CHUNK_SIZE, 3 * CHUNK_SIZE + 7])
+def test_roundtrip(size):
+    key = os.urandom(32)
+    data = os.urandom(size)
+    manifest, frames = seal(data, key)
+    assert manifest["version"] == envelope_format.FORMAT_VERSION
+    assert manifest["chunks"] == max(-(-size // CHUNK_SIZE), 1)
+    assert open_stream(key, manifest, frames) == data
+    buf = bytearray(size)
+    envelope_format.decrypt_into_buffer(key, manifest, memoryview(frames), memoryview(buf))
+    assert bytes(buf) == data
+
+def test_compressed_batch_roundtrip():
+    master = os.urandom(32)
+    file_key, derivation = envelope_format.derive_file_key(master)
+    data = b"compressible " * 20000
+    manifest, frames = seal(data, file_key, compressor=envelope_format.ChunkCompressor("zlib"),
+                            key_derivation=derivation)
+    assert manifest["key_derivation"] == derivation
+    assert manifest["compressed_chunks"] > 0
+    assert open_stream(master, manifest, frames) == data
+
+def test_digest_is_keyed():
+    key = os.urandom(32)
+    data = b"guessable plaintext"
+    manifest, _ = seal(data, key)
+    assert manifest["digest"]["keyed"] is True
+    assert manifest["digest"]["value"] != hashlib.sha256(data).hexdigest()
+    # 不同的 DEK 得到不同的摘要
+    assert seal(data, os.urandom(32))[0]["digest"]["value"] != manifest["digest"]["value"]
+
+@pytest.mark.parametrize("field,value", [
+    ("digest", None),
+    ("plaintext_size", 1),
+    ("chunks", 2),
+    ("chunk_size", CHUNK_SIZE * 2),
+    ("compression", {"codec": "zlib", "level": 6}),
+    ("note", "unauthenticated"),
+])
+def test_manifest_is_bound_to_frames(field, value):
+    key = os.urandom(32)
+    manifest, frames = seal(b"x" * 1000, key)
+    tampered = dict(manifest)
+    if value is None:
+        del tampered[field]
+    else:
+        tampered[field] = value
+    with pytest.raises(ValueError):
+        open_stream(key, tampered, frames)
+
+def test_tampered_and_truncated_frames_are_rejected():
+    key = os.urandom(32)
+    manifest, frames = seal(os.urandom(2 * CHUNK_SIZE + 1), key)
+    flipped = bytearray(frames)
+    flipped[100] ^= 1
+    with pytest.raises(ValueError, match="认证失败"):
+        open_stream(key, manifest, bytes(flipped))
+    first_frame = envelope_format.FRAME_HEADER.size + CHUNK_SIZE + envelope_format.TAG_SIZE
+    with pytest.raises(ValueError, match="截断"):
+        open_stream(key, manifest, frames[:2 * first_frame])
+
+def test_version_1_envelopes_still_decrypt():
+    """版本 1：附加认证数据只有帧头和序号，摘要不带密钥"""
+    key = os.urandom(32)
+    data = os.urandom(CHUNK_SIZE + 5)
+    cipher = envelope_format.get_backend(BACKEND).cipher(key)
+    prefix = os.urandom(envelope_format.NONCE_PREFIX_SIZE)
+    frames = b""
+    for index, chunk in enumerate([data[:CHUNK_SIZE], data[CHUNK_SIZE:]]):
+        flags = envelope_format.FLAG_LAST if index == 1 else 0
+        header = envelope_format.FRAME_HEADER.pack(len(chunk) + envelope_format.TAG_SIZE, flags)
+        frames += header + cipher.encrypt(prefix + index.to_bytes(8, "big"), chunk,
+                                          header + index.to_bytes(8, "big"))
+    manifest = {
+        "format": envelope_format.FORMAT_NAME, "version": 1, "backend": BACKEND, "chunk_size": CHUNK_SIZE,
+        "nonce_prefix": prefix.hex(), "chunks": 2, "plaintext_size": len(data),
+        "digest": {"algorithm": "sha256", "value": hashlib.sha256(data).hexdigest()},
+    }
+    assert open_stream(key, manifest, frames) == data
+
+def test_envelope_reader_authenticates_trailer(tmp_path):
+    key = os.urandom(32)
+    data = os.urandom(3 * CHUNK_SIZE)
+    manifest, frames = seal(data, key)
+
+    def write(path, manifest):
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as z:
+            z.writestr(envelope_format.DATA_NAME, frames)
+            z.writestr(envelope_format.MANIFEST_NAME, json.dumps(manifest))
+        return str(path)
+
+    with envelope_format.EnvelopeReader(write(tmp_path / "ok.zip", manifest), key) as reader:
+        reader.seek(CHUNK_SIZE + 3)
+        assert reader.read(10) == data[CHUNK_SIZE + 3:CHUNK_SIZE + 13]
+        reader.seek(0)
+        assert reader.read() == data
+    tampered = dict(manifest, digest=dict(manifest["digest"], value="0" * 64))
+    with pytest.raises(ValueError, match="认证失败"):
+        envelope_format.EnvelopeReader(write(tmp_path / "bad.zip", tampered), key)
+
+def test_keyed_luks_digest():
+    dek = os.urandom(32)
+    data = b"luks plaintext"
+    hasher = envelope_format.new_digest("sha256", envelope_format.digest_key(dek))
+    hasher.update(data)
+    expected = envelope_format.describe_digest(hasher, "sha256")
+    verifier = envelope_format.DigestVerifier(expected, envelope_format.digest_key(dek))
+    verifier.update(data)
+    assert verifier.verify()
+    with pytest.raises(ValueError, match="摘要密钥"):
+        envelope_format.DigestVerifier(expected)
+    wrong = envelope_format.DigestVerifier(expected, envelope_format.digest_key(os.urandom(32)))
+    wrong.update(data)
+    with pytest.raises(ValueError, match="不一致"):
+        wrong.verify()
+
+def test_recipe_manifest_is_authenticated():
+    dedup = envelope_format.DedupKey(os.urandom(32), BACKEND)
+    chunker = envelope_format.CDCChunker(1024, 4096, 16384)
+    store = {}
+    data = os.urandom(50000)
+    manifest, recipe, _ = envelope_format.encrypt_recipe(
+        dedup, io.BytesIO(data), store.__contains__, lambda cid, blob, size: store.__setitem__(cid, blob), chunker)
+    manifest = json.loads(json.dumps(manifest))
+    assert manifest["digest"]["keyed"] is True
+
+    def open_recipe(manifest):
+        out = io.BytesIO()
+        blobs = [store[cid] for cid, _ in envelope_format.recipe_entries(recipe)]
+        envelope_format.decrypt_recipe(dedup.store_key, manifest, recipe, blobs, out)
+        return out.getvalue()
+
+    assert open_recipe(manifest) == data
+    tampered = dict(manifest, chunker=dict(manifest["chunker"], max_size=1 << 30))
+    with pytest.raises(ValueError, match="清单认证失败"):
+        open_recipe(tampered)
@@ -0,0 +1,79 @@
+import sqlite3
+
+import pytest
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from config import DB_PATH
+import approval_server
+import fast_json
+import main
+
+COLUMNS = approval_server.APPROVAL_COLUMNS
+SQL = "SELECT client_id, content, base_apiurl, timestart, result, status FROM approvals WHERE status = ?"
+PAGED_SQL = SQL + " ORDER BY timestart, client_id LIMIT ? OFFSET ?"
+
+ROWS = [
+    ("c1", "申请访问数据集", "http://coordinator.test/", "2025-01-01T00:00:00", None, 0),
+    ("c2", 'quote " and \\ backslash', "http://coordinator.test/", "2025-01-01T00:00:01", "yes", 1),
+    ("c3", "换行\n制表\t控制\x01", None, "2025-01-01T00:00:02", "no", 1),
+    ("c4", "emoji 😀", "http://a.test/", "2025-01-01T00:00:03", None, 0),
+    ("c5", "", "", "2025-01-01T00:00:03", "yes", 1),
+]
+
+def previous_listing(conn, sql, params):
+    """改为 SQLite 生成 JSON 之前 get_approvals 的响应体：逐行构造字典后用 JSONResponse 编码"""
+    rows = conn.execute(sql, params).fetchall()
+    result = [dict(zip(COLUMNS, row)) for row in rows]
+    return JSONResponse({"count": len(result), "data": result}).body
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE approvals (client_id TEXT PRIMARY KEY, content TEXT, base_apiurl TEXT, "
+                 "timestart TEXT, result TEXT, status INTEGER DEFAULT 0)")
+    conn.executemany("INSERT INTO approvals VALUES (?, ?, ?, ?, ?, ?)", ROWS)
+    yield conn
+    conn.close()
+
+@pytest.fixture(params=[True, False], ids=["sqlite-json", "python"])
+def sqlite_json(request, monkeypatch):
+    # False 时模拟 SQLite 未编译 JSON 函数，走逐行编码
+    monkeypatch.setattr(fast_json, "_sqlite_json", request.param)
+    return request.param
+
+@pytest.mark.parametrize("sql,params", [
+    (SQL, (0,)),
+    (SQL, (1,)),
+    # 分页：第一页、最后一页不满、超出范围的空页
+    (PAGED_SQL, (1, 2, 0)),
+    (PAGED_SQL, (1, 2, 2)),
+    (PAGED_SQL, (1, 2, 4)),
+    # 没有记录
+    (SQL, (2,)),
+])
+def test_listing_matches_previous_encoding(conn, sqlite_json, sql, params):
+    assert fast_json.listing_body(conn, COLUMNS, sql, params) == previous_listing(conn, sql, params)
+
+def test_empty_listing(conn, sqlite_json):
+    assert fast_json.listing_body(conn, COLUMNS, SQL, (2,)) == b'{"count":0,"data":[]}'
+
+@pytest.mark.parametrize("params", [{}, {"page": 1, "page_size": 2}, {"page": 2, "page_size": 2},
+                                    {"page": 1000}])
+def test_get_approvals_body(params):
+    conn = sqlite3.connect(DB_PATH)
+    conn.executemany("INSERT OR IGNORE INTO approvals (client_id, content, base_apiurl, timestart, result, status) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", [(f"listing-{row[0]}", *row[1:4], "yes", 1) for row in ROWS])
+    conn.commit()
+    conn.close()
+    approval_server.bump_approvals_version()
+    r = TestClient(main.app).get("/approval/get_approvals", params={"type": "approved", **params})
+    assert r.status_code == 200
+    sql, args = SQL, [1]
+    if params:
+        sql, args = PAGED_SQL, [1, params.get("page_size", 100), (params["page"] - 1) * params.get("page_size", 100)]
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        assert r.content == previous_listing(conn, sql, args)
+    finally:
+        conn.close()
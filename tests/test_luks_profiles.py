@@ -0,0 +1,22 @@
+import pytest
+
+import luks_profiles
+
+def test_default_is_cryptsetup_defaults(monkeypatch):
+    monkeypatch.setattr(luks_profiles, "KEY_PROFILES", {})
+    profile = luks_profiles.select_profile("any-key")
+    assert profile.name == "compat"
+    # 只指定 LUKS2 和扇区大小，其余交给 cryptsetup
+    assert profile.format_args() == ["--type", "luks2", "--sector-size", "512"]
+
+def test_fast_is_opt_in(monkeypatch):
+    monkeypatch.setattr(luks_profiles, "KEY_PROFILES", {"fast-key": "fast"})
+    assert luks_profiles.select_profile("other-key").name == "compat"
+    assert luks_profiles.select_profile("fast-key").name == "fast"
+    # 请求中指定的参数组优先于根密钥的配置
+    assert luks_profiles.select_profile("fast-key", "adiantum").name == "adiantum"
+    assert luks_profiles.select_profile("other-key", "fast").sector_size == 4096
+
+def test_unknown_profile_is_rejected():
+    with pytest.raises(ValueError):
+        luks_profiles.select_profile("any-key", "bogus")
@@ -0,0 +1,104 @@
+import asyncio
+import sqlite3
+
+import httpx
+
+from config import DB_PATH
+import approval_server  # noqa: F401  初始化提供方数据库（含发件箱表）
+import outbox
+
+class FakeCoordinator:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.posts = []
+
+    async def post(self, url, json=None, headers=None):
+        self.posts.append((url, json))
+        if self.fail:
+            raise httpx.ConnectError("coordinator down")
+        return httpx.Response(200, json={"status": "ok"})
+
+def enqueue(client_id, result="yes", coordinator="http://coordinator.test/"):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    outbox.enqueue(c, [(coordinator, client_id, "http://provider.test/", result, None)])
+    conn.commit()
+    conn.close()
+
+def rows(client_id):
+    conn = sqlite3.connect(DB_PATH)
+    found = conn.execute(
+        "SELECT result, attempts, delivered FROM outbox WHERE client_id = ? ORDER BY id", (client_id,)
+    ).fetchall()
+    conn.close()
+    return found
+
+def make_due():
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("UPDATE outbox SET next_attempt = 0 WHERE delivered = 0")
+    conn.commit()
+    conn.close()
+
+def test_failed_delivery_is_retried():
+    enqueue("outbox-retry")
+    down = FakeCoordinator(fail=True)
+    asyncio.run(outbox._dispatch_once(down))
+    assert rows("outbox-retry") == [("yes", 1, 0)]
+
+    make_due()
+    up = FakeCoordinator()
+    asyncio.run(outbox._dispatch_once(up))
+    assert rows("outbox-retry") == [("yes", 1, 1)]
+    url, body = up.posts[0]
+    assert url == "http://coordinator.test/receive_results"
+    assert {"client_id": "outbox-retry", "server_url": "http://provider.test/", "result": "yes",
+            "traceparent": None} in body["results"]
+
+def test_results_are_sent_in_order():
+    # 协调器采纳第一次答复，发件箱不能丢弃或调换同一 client_id 的消息
+    make_due()
+    enqueue("outbox-order", "yes")
+    enqueue("outbox-order", "no")
+    up = FakeCoordinator()
+    asyncio.run(outbox._dispatch_once(up))
+    sent = [r for _, body in up.posts for r in body["results"] if r["client_id"] == "outbox-order"]
+    assert [r["result"] for r in sent] == ["yes", "no"]
+    assert [row[2] for row in rows("outbox-order")] == [1, 1]
+
+class RejectingCoordinator(FakeCoordinator):
+    """拒绝任何包含 bad_client 的批量请求，模拟协调器对非法消息返回 422"""
+
+    def __init__(self, bad_client, status_code=422):
+        super().__init__()
+        self.bad_client = bad_client
+        self.status_code = status_code
+
+    async def post(self, url, json=None, headers=None):
+        self.posts.append((url, json))
+        if any(r["client_id"] == self.bad_client for r in json["results"]):
+            return httpx.Response(self.status_code, json={"detail": "invalid"})
+        return httpx.Response(200, json={"status": "ok"})
+
+def test_rejected_message_is_dead_lettered():
+    make_due()
+    enqueue("outbox-good-1")
+    enqueue("outbox-bad")
+    enqueue("outbox-good-2")
+    coordinator = RejectingCoordinator("outbox-bad")
+    asyncio.run(outbox._dispatch_once(coordinator))
+    assert rows("outbox-good-1") == [("yes", 0, 1)]
+    assert rows("outbox-good-2") == [("yes", 0, 1)]
+    assert rows("outbox-bad") == [("yes", 1, outbox.REJECTED)]
+    assert outbox.pending_count(outbox.REJECTED) >= 1
+
+    # 死信不再发送
+    make_due()
+    again = FakeCoordinator()
+    asyncio.run(outbox._dispatch_once(again))
+    assert all(r["client_id"] != "outbox-bad" for _, body in again.posts for r in body["results"])
+
+def test_server_errors_back_off_the_whole_batch():
+    make_due()
+    enqueue("outbox-5xx")
+    asyncio.run(outbox._dispatch_once(RejectingCoordinator("outbox-5xx", status_code=503)))
+    assert rows("outbox-5xx") == [("yes", 1, 0)]
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import rate_limit
+import vault_server
+
+def test_bucket_refills_at_rate():
+    bucket = rate_limit.TokenBucket(10, 2)
+    bucket.take()
+    bucket.take()
+    assert not bucket.ready()
+    assert abs(bucket.delay() - 0.1) < 1e-9
+    start = bucket.updated
+    bucket.refill(start + 0.05)
+    assert not bucket.ready()
+    bucket.refill(start + 0.1)
+    assert bucket.ready()
+    # 补充不超过桶容量
+    bucket.refill(start + 10)
+    assert bucket.tokens == 2
+
+def test_unlimited_bucket_is_always_ready():
+    bucket = rate_limit.TokenBucket(0)
+    for _ in range(100):
+        bucket.take()
+    assert bucket.ready() and bucket.delay() == 0.0
+
+def test_interactive_granted_before_queued_bulk():
+    limiter = rate_limit.PriorityRateLimiter(20, 1)
+    order = []
+
+    async def take(name, tag):
+        await limiter.acquire_async(name)
+        order.append(tag)
+
+    async def scenario():
+        await limiter.acquire_async(rate_limit.BULK)  # 用掉唯一的令牌
+        bulk = [asyncio.create_task(take(rate_limit.BULK, f"bulk{i}")) for i in range(2)]
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(take(rate_limit.INTERACTIVE, "interactive"))
+        await asyncio.wait_for(asyncio.gather(*bulk, interactive), 2)
+
+    asyncio.run(scenario())
+    # 后到的交互请求插到排队的批量请求前面，同一类别内按到达顺序
+    assert order == ["interactive", "bulk0", "bulk1"]
+    stats = limiter.stats()["classes"]
+    assert stats[rate_limit.BULK]["queued"] == 2
+    assert stats[rate_limit.INTERACTIVE]["granted"] == 1
+
+def test_grants_follow_refill_rate():
+    limiter = rate_limit.PriorityRateLimiter(20, 1)
+
+    async def scenario():
+        start = time.monotonic()
+        for _ in range(5):
+            await limiter.acquire_async(rate_limit.BULK)
+        return time.monotonic() - start
+
+    # 第一个令牌来自桶中已有的，其余 4 个每 50ms 补充一个
+    elapsed = asyncio.run(scenario())
+    assert 0.18 <= elapsed < 1.0
+
+def test_class_rate_does_not_block_other_class():
+    limiter = rate_limit.PriorityRateLimiter(0, None, [(rate_limit.INTERACTIVE, 0), (rate_limit.BULK, 1)])
+
+    async def scenario():
+        await limiter.acquire_async(rate_limit.BULK)
+        bulk = asyncio.create_task(limiter.acquire_async(rate_limit.BULK))
+        await asyncio.sleep(0.01)
+        # bulk 已用完自己的额度在排队，interactive 只受总速率（不限速）限制
+        await asyncio.wait_for(limiter.acquire_async(rate_limit.INTERACTIVE), 0.2)
+        assert not bulk.done()
+        bulk.cancel()
+        await asyncio.gather(bulk, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert limiter.stats()["classes"][rate_limit.BULK]["queue_depth"] == 0
+
+def test_thread_acquire_blocks_until_refill():
+    limiter = rate_limit.PriorityRateLimiter(20, 1)
+    limiter.acquire()
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.03
+
+def test_vault_call_takes_one_token_per_request(fake_vault, monkeypatch):
+    limiter = rate_limit.PriorityRateLimiter(1000, 1000)
+    monkeypatch.setattr(vault_server, "vault_limiter", limiter)
+
+    def granted(name):
+        return limiter.stats()["classes"][name]["granted"]
+
+    # 密钥不存在：查询、创建、再查询共 3 次请求
+    asyncio.run(vault_server.vault_call(rate_limit.BULK, vault_server.create_key, "metered-key"))
+    assert granted(rate_limit.BULK) == 3
+    # 已存在：只查询一次
+    asyncio.run(vault_server.vault_call(rate_limit.BULK, vault_server.create_key, "metered-key"))
+    assert granted(rate_limit.BULK) == 4
+    # 后续请求记在 vault_call 的优先级类别下
+    plaintext, ciphertext = vault_server.datakey_plain("metered-key")
+    assert granted(rate_limit.BULK) == 5
+    asyncio.run(vault_server.vault_call(rate_limit.INTERACTIVE, vault_server.decrypt_datakeys,
+                                        "metered-key", [ciphertext]))
+    assert granted(rate_limit.INTERACTIVE) == 1
+    assert granted(rate_limit.BULK) == 5
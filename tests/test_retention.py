@@ -0,0 +1,48 @@
+import sqlite3
+
+from config import DB_PATH
+import approval_server
+import retention
+import vault_server
+
+def insert_approved(client_id, decided_at="2000-01-01T00:00:00"):
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute('''
+        INSERT OR REPLACE INTO approvals (client_id, content, base_apiurl, timestart, result, status, decided_at)
+        VALUES (?, 'test', 'http://coordinator.test/', ?, 'yes', 1, ?)
+    ''', (client_id, decided_at, decided_at))
+    conn.commit()
+    conn.close()
+
+def test_archival_is_opt_in():
+    # 默认不归档：很久以前审批通过的记录仍可通过本地数据库校验
+    assert approval_server.RETENTION_DAYS == 0
+    insert_approved("retention-default")
+    approval_server.archive_approvals()
+    assert vault_server.check_approval("retention-default", ["k1"]) is None
+
+def test_archive_moves_old_rows(monkeypatch, tmp_path):
+    monkeypatch.setattr(approval_server, "RETENTION_DAYS", 30)
+    monkeypatch.setattr(approval_server, "ARCHIVE_DIR", str(tmp_path))
+    insert_approved("retention-old")
+    approval_server.archive_approvals()
+    assert vault_server.check_approval("retention-old", ["k1"]) == "未找到审批记录"
+    archived = retention.query_archive(str(tmp_path), "approvals", {"client_id": "retention-old"})
+    assert [(r["client_id"], r["result"]) for r in archived] == [("retention-old", "yes")]
+
+def test_new_database_uses_incremental_vacuum(tmp_path):
+    conn = sqlite3.connect(tmp_path / "new.db")
+    retention.init_incremental_vacuum(conn)
+    conn.execute("CREATE TABLE t (x)")
+    assert retention.is_incremental_vacuum(conn)
+
+def test_existing_database_is_converted_only_on_request(tmp_path):
+    conn = sqlite3.connect(tmp_path / "old.db")
+    conn.execute("CREATE TABLE t (x)")
+    conn.commit()
+    # 启动时不对已有数据库执行完整 VACUUM
+    retention.init_incremental_vacuum(conn)
+    assert not retention.is_incremental_vacuum(conn)
+    assert retention.enable_incremental_vacuum(conn)
+    assert retention.is_incremental_vacuum(conn)
+    assert not retention.enable_incremental_vacuum(conn)
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import tee
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tee, "TEE_DATA_DIR", str(tmp_path))
+    (tmp_path / "encrypted").mkdir()
+    return tmp_path
+
+@pytest.fixture
+def client():
+    return TestClient(tee.app)
+
+def decrypt_folder(client, input_dir, output_dir="decrypted"):
+    return client.post("/decrypt_folder", data={"input_dir": input_dir, "output_dir": output_dir,
+                                                "client_id": "client_001"})
+
+@pytest.mark.parametrize("input_dir,output_dir", [
+    ("/etc", "decrypted"),
+    ("encrypted", "/tmp/out"),
+    ("../encrypted", "decrypted"),
+    ("encrypted", "decrypted/../../out"),
+    ("encrypted\\..\\..", "decrypted"),
+    ("", "decrypted"),
+])
+def test_paths_outside_data_dir_are_rejected(data_dir, client, input_dir, output_dir):
+    r = decrypt_folder(client, input_dir, output_dir)
+    assert r.status_code in (400, 422)
+
+def test_symlink_out_of_data_dir_is_rejected(data_dir, client, tmp_path_factory):
+    outside = tmp_path_factory.mktemp("outside")
+    os.symlink(outside, data_dir / "escape")
+    assert decrypt_folder(client, "escape").status_code == 400
+
+def test_relative_paths_resolve_under_data_dir(data_dir, client):
+    assert tee.resolve_data_path("encrypted") == os.path.realpath(data_dir / "encrypted")
+    # 目录合法但没有信封
+    assert decrypt_folder(client, "encrypted").status_code == 404
+
+def test_decrypt_stored_output_dir_is_checked(data_dir, client):
+    r = client.post("/decrypt_stored", data={"envelope_ids": "a" * 64, "output_dir": "/var/tmp",
+                                             "client_id": "client_001"})
+    assert r.status_code == 400
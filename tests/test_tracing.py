@@ -0,0 +1,67 @@
+import json
+import threading
+
+import tracing
+
+def test_spans_are_exported_by_background_thread(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(path))
+    opened_on = []
+    real_open = open
+
+    def spy_open(*args, **kwargs):
+        opened_on.append(threading.current_thread().name)
+        return real_open(*args, **kwargs)
+
+    monkeypatch.setattr("builtins.open", spy_open)
+    with tracing.span("parent") as parent:
+        with tracing.span("child", attempt=1):
+            pass
+    tracing.flush()
+    monkeypatch.setattr("builtins.open", real_open)
+
+    assert threading.current_thread().name not in opened_on
+    spans = {item["name"]: item for item in map(json.loads, path.read_text(encoding="utf-8").splitlines())}
+    assert spans["child"]["parent_id"] == parent.span_id
+    assert spans["child"]["attributes"] == {"attempt": 1}
+    # 内存缓冲区与导出文件中的同一 span 只计一次
+    assert sum(1 for item in tracing.load_spans() if item["span_id"] == parent.span_id) == 1
+
+def test_unwritable_trace_file_does_not_fail_requests(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(tmp_path))  # 目录无法作为文件打开
+    dropped = tracing.export_stats["dropped"]
+    with tracing.span("still-recorded"):
+        pass
+    tracing.flush()
+    assert tracing.export_stats["dropped"] == dropped + 1
+    assert any(item["name"] == "still-recorded" for item in tracing._finished)
+
+def fake_span(span_id, trace_id="t" * 32):
+    return {"trace_id": trace_id, "span_id": span_id, "parent_id": None, "name": "file-span", "service": "test",
+            "start": 1.0, "duration_ms": 1.0, "error": None, "attributes": {}}
+
+def test_viewer_reads_only_the_tail_of_the_trace_file(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    lines = [json.dumps(fake_span(f"{i:016x}")) for i in range(100)]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    tail = len(lines[-1]) * 3 + 10
+    ids = {item["span_id"] for item in tracing.load_spans(str(path), tail) if item["name"] == "file-span"}
+    # 被截断的第一行被丢弃，其余整行都能解析
+    assert ids == {f"{i:016x}" for i in (97, 98, 99)}
+    assert len([i for i in tracing.load_spans(str(path)) if i["name"] == "file-span"]) == 100
+
+def test_viewer_endpoints_run_off_the_event_loop(tmp_path, monkeypatch):
+    import inspect
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    assert not inspect.iscoroutinefunction(tracing.list_traces)
+    assert not inspect.iscoroutinefunction(tracing.get_trace)
+    path = tmp_path / "traces.jsonl"
+    path.write_text(json.dumps(fake_span("a" * 16, "b" * 32)) + "\n", encoding="utf-8")
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(path))
+    app = FastAPI()
+    app.include_router(tracing.router)
+    client = TestClient(app)
+    assert "b" * 32 in {t["trace_id"] for t in client.get("/traces", params={"limit": 1000}).json()["traces"]}
+    assert client.get("/traces/" + "b" * 32).json()["summary"]["spans"] == 1
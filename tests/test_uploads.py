@@ -0,0 +1,87 @@
+import base64
+import io
+import json
+import os
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+import envelope_format
+import main
+import uploads
+import vault_server
+
+pytestmark = pytest.mark.skipif(not envelope_format.available_backends(), reason="未安装 cryptography")
+
+@pytest.fixture
+def client(fake_vault, tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_DIR", str(tmp_path))
+    return TestClient(main.app)
+
+def create(client, **fields):
+    r = client.post("/vault/uploads", data={"sym_key_name": "upload-key", **fields})
+    assert r.status_code == 201
+    assert r.headers["upload-offset"] == "0"
+    return r.json()["upload_id"]
+
+def patch(client, upload_id, offset, data):
+    return client.patch(f"/vault/uploads/{upload_id}", content=data,
+                        headers={"Upload-Offset": str(offset), "Content-Type": "application/offset+octet-stream"})
+
+def open_envelope(content: bytes) -> bytes:
+    with zipfile.ZipFile(io.BytesIO(content)) as z:
+        manifest = json.loads(z.read(envelope_format.MANIFEST_NAME))
+        frames = z.read(envelope_format.DATA_NAME)
+        key_name = z.read("key_name.txt").decode()
+        ciphertext_dek = z.read("encrypted_key.txt").decode()
+    plaintext_dek = base64.b64decode(vault_server.decrypt_datakeys(key_name, [ciphertext_dek])[0])
+    out = io.BytesIO()
+    envelope_format.decrypt_stream(plaintext_dek, manifest, io.BytesIO(frames), out)
+    return out.getvalue()
+
+def test_resumed_upload_decrypts_to_original(client):
+    data = os.urandom(3 * envelope_format.DEFAULT_CHUNK_SIZE // 2 + 11)
+    upload_id = create(client, upload_length=str(len(data)), compression="zlib")
+    split = len(data) // 3
+    assert patch(client, upload_id, 0, data[:split]).headers["upload-offset"] == str(split)
+    # 断线后先查询偏移量，再从该位置继续
+    assert client.head(f"/vault/uploads/{upload_id}").headers["upload-offset"] == str(split)
+    r = patch(client, upload_id, split, data[split:])
+    assert r.status_code == 204
+    assert r.headers["upload-offset"] == str(len(data))
+
+    r = client.post(f"/vault/uploads/{upload_id}/finalize")
+    assert r.status_code == 200
+    assert open_envelope(r.content) == data
+    assert client.get(f"/vault/uploads/{upload_id}").status_code == 404
+
+def test_offset_mismatch_is_rejected(client):
+    upload_id = create(client)
+    assert patch(client, upload_id, 0, b"abc").status_code == 204
+    r = patch(client, upload_id, 0, b"abc")
+    assert r.status_code == 409
+    assert r.headers["upload-offset"] == "3"
+    assert patch(client, upload_id, 3, b"def").status_code == 204
+    assert open_envelope(client.post(f"/vault/uploads/{upload_id}/finalize").content) == b"abcdef"
+
+def test_missing_offset_header(client):
+    upload_id = create(client)
+    assert client.patch(f"/vault/uploads/{upload_id}", content=b"x").status_code == 400
+
+def test_declared_length_is_enforced(client):
+    upload_id = create(client, upload_length="4")
+    assert patch(client, upload_id, 0, b"12345").status_code == 413
+    assert patch(client, upload_id, 0, b"12").status_code == 204
+    assert client.post(f"/vault/uploads/{upload_id}/finalize").status_code == 409
+    # 未完成的会话仍可继续
+    assert patch(client, upload_id, 2, b"34").status_code == 204
+    assert open_envelope(client.post(f"/vault/uploads/{upload_id}/finalize").content) == b"1234"
+
+def test_abort_removes_partial_envelope(client, tmp_path):
+    upload_id = create(client)
+    patch(client, upload_id, 0, b"partial")
+    assert os.listdir(tmp_path)
+    assert client.delete(f"/vault/uploads/{upload_id}").status_code == 204
+    assert not os.listdir(tmp_path)
+    assert client.head(f"/vault/uploads/{upload_id}").status_code == 404
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import types
+
+import pytest
+
+import vault_server
+
+def test_single_flight_survives_leader_cancellation():
+    calls = []
+    release = threading.Event()
+
+    def slow(name):
+        calls.append(name)
+        release.wait(5)
+        return {"name": name}
+
+    async def scenario():
+        inflight = {}
+        stats = {"misses": 0, "coalesced": 0}
+        leader = asyncio.create_task(vault_server.single_flight(inflight, "k", stats, slow, "k"))
+        await asyncio.sleep(0.05)
+        follower = asyncio.create_task(vault_server.single_flight(inflight, "k", stats, slow, "k"))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        result = await follower
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return result, stats, inflight
+
+    result, stats, inflight = asyncio.run(scenario())
+    assert result == {"name": "k"}
+    assert calls == ["k"]
+    assert stats == {"misses": 1, "coalesced": 1}
+    assert inflight == {}
+
+def test_single_flight_shares_errors():
+    def fail(name):
+        raise RuntimeError("vault down")
+
+    async def scenario():
+        inflight = {}
+        stats = {"misses": 0, "coalesced": 0}
+        return await asyncio.gather(
+            vault_server.single_flight(inflight, "k", stats, fail, "k"),
+            vault_server.single_flight(inflight, "k", stats, fail, "k"),
+            return_exceptions=True,
+        ), stats, inflight
+
+    results, stats, inflight = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert stats == {"misses": 1, "coalesced": 1}
+    assert inflight == {}
+
+def test_create_key_without_read_permission(fake_vault, monkeypatch):
+    monkeypatch.setattr(vault_server.requests, "get",
+                        lambda url, **kwargs: types.SimpleNamespace(status_code=403, text="permission denied"))
+    info = vault_server.create_key("write-only-key")
+    assert info == {"name": "write-only-key", "type": "aes256-gcm96", "latest_version": None}
+    assert "write-only-key" in fake_vault.keys
+    # 已存在的密钥再次创建不报错
+    assert vault_server.create_key("write-only-key")["name"] == "write-only-key"
+
+def test_create_key_reads_metadata(fake_vault):
+    info = vault_server.create_key("readable-key")
+    assert info["latest_version"] == 1
+    assert vault_server.read_key("readable-key") == info